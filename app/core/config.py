@@ -1,15 +1,19 @@
 """
 OTS Hub — Configuração Central
+
+Única instância de Settings do processo (.env / variáveis de ambiente).
+Valores vindos do Supabase são aplicados sobre ela em runtime pelo
+serviço de configuração (app/core/config_supabase.py).
 """
 
 from pydantic_settings import BaseSettings
-from typing import List, Union
+from typing import Dict, List, Union
 
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "OTS Hub"
     API_V1_STR: str = "/api/v1"
-    VERSION: str = "2.0.0"
+    VERSION: str = "3.0.0"
 
     HOST: str = "0.0.0.0"
     PORT: int = 8000
@@ -27,6 +31,97 @@ class Settings(BaseSettings):
 
     TELEMETRY_INTERVAL_MIN: int = 10
 
+    # Config service — snapshot local e intervalo de hot reload do Supabase
+    CONFIG_SNAPSHOT_PATH: str = ".ots_config_snapshot.json"
+    CONFIG_REFRESH_S: int = 60
+
+    # Entrega conflacionada (dashboards lentos) — intervalo mínimo entre envios
+    CONFLATE_INTERVAL_MS: int = 100
+
+    # Stream SSE (/api/v1/stream) — intervalo de keepalive
+    SSE_KEEPALIVE_S: int = 15
+
+    # Heartbeat (ping/pong) — intervalo e timeout de silêncio (o curto vale
+    # só para quem já respondeu um pong; os demais mantêm o limite antigo)
+    HEARTBEAT_INTERVAL_S: int = 10
+    HEARTBEAT_TIMEOUT_S: int = 30
+    HEARTBEAT_LEGACY_TIMEOUT_S: int = 300
+
+    # Rate limiting por conexão/type (ver app/websockets/ratelimit.py)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMITS: Dict[str, dict] = {}
+
+    # TTL de mensagens por type (ms; ver app/websockets/ttl.py)
+    MESSAGE_TTL_ENABLED: bool = True
+    MESSAGE_TTLS_MS: Dict[str, int] = {}
+    MESSAGE_TTL_REPORT: bool = False
+
+    # Frames: tamanho máximo aceito (global e por role) e limite para decode fora do event loop
+    MAX_FRAME_BYTES: int = 8 * 1024 * 1024
+    MAX_FRAME_BYTES_BY_ROLE: Dict[str, int] = {}
+    OFFLOAD_FRAME_BYTES: int = 256 * 1024
+    DECODE_WORKERS: int = 1
+
+    # Orçamento de bytes retidos para entrega (filas + envios); 0 = sem limite
+    MEMORY_BUDGET_BYTES: int = 0
+
+    # Compressão seletiva (negociada no auth) — tamanho mínimo, nível e
+    # limite acima do qual a compressão roda numa thread (fora do event loop)
+    COMPRESS_MIN_BYTES: int = 4096
+    COMPRESS_LEVEL: int = 3
+    COMPRESS_OFFLOAD_BYTES: int = 64 * 1024
+
+    # Transporte stream para processos locais (vazio/0 = desabilitado)
+    UNIX_SOCKET_PATH: str = ""
+    STREAM_TCP_HOST: str = "127.0.0.1"
+    STREAM_TCP_PORT: int = 0
+
+    # Shards de event loop (threads) para conexões stream e, com `python -m app.main`,
+    # HTTP/WebSocket; 0 = loop principal.
+    # Fila máxima (mensagens) entre shard e loop principal, por conexão e direção
+    LOOP_SHARDS: int = 0
+    LOOP_SHARD_QUEUE: int = 256
+
+    # Ring buffer de barras em memória compartilhada (preditors locais)
+    SHM_BARS_ENABLED: bool = False
+    SHM_RING_CAPACITY: int = 4096
+
+    # Restart sem downtime — snapshot do estado do hub e dica de reconexão
+    HUB_SNAPSHOT_PATH: str = ".ots_hub_snapshot.json.gz"
+    HUB_SNAPSHOT_MAX_AGE_S: int = 300
+    DRAIN_FLUSH_TIMEOUT_S: float = 2.0
+    RECONNECT_BASE_MS: int = 500
+    RECONNECT_JITTER_MS: int = 2000
+
+    # Namespaces (estratégias/contas isoladas): token e limites por namespace.
+    # Limites: {"ns": {"max_connections": 50, "max_pending_commands": 100}}, "*" = todos
+    NAMESPACE_TOKENS: Dict[str, str] = {}
+    NAMESPACE_LIMITS: Dict[str, dict] = {}
+
+    # Admissão de handshakes (tempestade de reconexões) e resume tickets
+    HANDSHAKE_CONCURRENCY: int = 32
+    ADMISSION_WAIT_S: float = 10.0
+    RESUME_TICKET_TTL_S: int = 600
+    RESUME_TICKET_SECRET: str = ""
+
+    # Dedup de order_command/order_result (retries após reconexão)
+    ORDER_DEDUP_TTL_S: int = 300
+    ORDER_DEDUP_MAX: int = 10_000
+
+    # Log de auditoria de comandos (em memória, indexado) e expiração sem ack
+    COMMAND_LOG_SIZE: int = 10_000
+    COMMAND_ACK_TIMEOUT_S: int = 30
+
+    # Store local (SQLite WAL) write-behind de telemetria e comandos
+    # (opt-in: vazio = desabilitado; ex: ".ots_hub_store.db")
+    LOCAL_STORE_PATH: str = ""
+    LOCAL_STORE_FLUSH_MS: int = 500
+    LOCAL_STORE_BATCH: int = 500
+    LOCAL_STORE_MAX_RETRIES: int = 3
+    LOCAL_STORE_MAX_QUEUE: int = 100_000
+    LOCAL_STORE_REPLICATE_S: int = 30
+    LOCAL_STORE_RETENTION_DAYS: int = 30
+
     class Config:
         env_file = ".env"
         case_sensitive = True
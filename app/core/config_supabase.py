@@ -1,88 +1,222 @@
 """
 OTS Hub — Configuração via Supabase
 
-Carrega configurações do Supabase ao invés de .env direto.
+Serviço de configuração sobre a instância única de Settings
+(app/core/config.py):
+
+1. Startup instantâneo a partir de um snapshot local em disco
+   (último config conhecido do Supabase), sem esperar a rede.
+2. Refresh em background a cada CONFIG_REFRESH_S, com o client síncrono
+   do Supabase rodando fora do event loop.
+3. Mudanças são validadas por completo e aplicadas de uma vez (sem await
+   no meio), então o loop nunca vê um config pela metade. Componentes leem
+   `settings.X` no uso (token, timeouts, intervalos) e pegam o valor novo.
+4. Só chaves de HOT_RELOAD_KEYS vêm do Supabase; caminhos em disco, tokens
+   de namespace e o que só vale no boot ficam no .env. O snapshot (contém
+   o ORACLE_TOKEN) é gravado com permissão 0600.
+5. Uma chave removida de ots_config volta ao valor do .env/default
+   (capturado quando o serviço é criado) no próximo refresh.
+
 Mantém compatibilidade com .env como fallback.
 """
 
-import os
 import asyncio
-from typing import List, Union, Optional
-from pydantic_settings import BaseSettings
-
-
-class Settings(BaseSettings):
-    PROJECT_NAME: str = "OTS Hub"
-    API_V1_STR: str = "/api/v1"
-    VERSION: str = "3.0.0"
-
-    # Supabase (sempre necessário)
-    SUPABASE_URL: str = ""
-    SUPABASE_KEY: str = ""
-
-    # Defaults (serão substituídos por valores do Supabase se disponíveis)
-    HOST: str = "0.0.0.0"
-    PORT: int = 8000
-    DEBUG: bool = False
-    ORACLE_TOKEN: str = "change-me-in-production"
-    AUTH_TIMEOUT: int = 5
-    ALLOWED_ORIGINS: Union[str, List[str]] = "*"
-    TELEMETRY_INTERVAL_MIN: int = 10
-
-    class Config:
-        env_file = ".env"
-        case_sensitive = True
-        extra = "ignore"
-
-    async def load_from_supabase(self):
-        """Load settings from Supabase database."""
-        if not self.SUPABASE_URL or not self.SUPABASE_KEY:
-            print("⚠️ SUPABASE_URL ou SUPABASE_KEY não definidos — usando .env apenas")
+import copy
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from pydantic import TypeAdapter, ValidationError
+
+from app.core.config import Settings, settings
+from app.core.database import get_supabase, supabase_configured
+
+logger = logging.getLogger("hub.config")
+
+# Chaves aceitas de ots_config: lidas em `settings.X` no uso, então valem
+# sem restart. Fora daqui (paths, NAMESPACE_TOKENS, SUPABASE_*, HOST/PORT...)
+# só pelo .env.
+HOT_RELOAD_KEYS = {
+    "DEBUG", "ORACLE_TOKEN", "AUTH_TIMEOUT",
+    "CONFIG_REFRESH_S", "CONFLATE_INTERVAL_MS", "SSE_KEEPALIVE_S",
+    "HEARTBEAT_INTERVAL_S", "HEARTBEAT_TIMEOUT_S", "HEARTBEAT_LEGACY_TIMEOUT_S",
+    "RATE_LIMIT_ENABLED", "RATE_LIMITS",
+    "MESSAGE_TTL_ENABLED", "MESSAGE_TTLS_MS", "MESSAGE_TTL_REPORT",
+    "MEMORY_BUDGET_BYTES", "COMPRESS_MIN_BYTES", "NAMESPACE_LIMITS",
+    "ORDER_DEDUP_TTL_S", "COMMAND_ACK_TIMEOUT_S",
+}
+
+
+def _config_hash(config_map: Dict[str, str]) -> str:
+    return hashlib.sha256(json.dumps(config_map, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def parse_config(config_map: Dict[str, str]) -> Dict[str, object]:
+    """
+    Converte linhas key/value de ots_config em campos de Settings validados.
+    Chaves fora de HOT_RELOAD_KEYS são ignoradas; valores inválidos também
+    (com log).
+    """
+    parsed: Dict[str, object] = {}
+    for key, value in config_map.items():
+        field = str(key).upper()
+        if field not in HOT_RELOAD_KEYS:
+            if field in Settings.model_fields:
+                logger.warning(f"Config key {key} not accepted from Supabase (set it in .env)")
+            continue
+        try:
+            annotation = Settings.model_fields[field].annotation
+            parsed[field] = TypeAdapter(annotation).validate_python(value)
+        except ValidationError:
+            logger.warning(f"Invalid config value for {key}: {value!r}")
+    return parsed
+
+
+class ConfigService:
+    """Carrega, versiona e aplica atomicamente o config do Supabase."""
+
+    def __init__(self, target: Settings):
+        self._settings = target
+        self.version: int = 0
+        self.hash: str = ""
+        self.source: str = "env"
+        self.updated_at: float = 0.0
+        self._config_map: Dict[str, str] = {}
+        # Valores do .env/default, restaurados quando a chave sai do Supabase
+        self._baseline: Dict[str, object] = {
+            f: copy.deepcopy(getattr(target, f)) for f in HOT_RELOAD_KEYS
+        }
+        # Campos hoje vindos do Supabase (os demais seguem o .env)
+        self._remote_fields: set = set()
+        self._listeners: List[Callable[[Dict[str, object]], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def on_change(self, callback: Callable[[Dict[str, object]], None]):
+        """Registra callback chamado com os campos alterados."""
+        self._listeners.append(callback)
+
+    def apply(self, config_map: Dict[str, str], source: str) -> Dict[str, object]:
+        """Aplica um config completo. Retorna os campos efetivamente alterados."""
+        digest = _config_hash(config_map)
+        if digest == self.hash:
+            return {}
+        parsed = parse_config(config_map)
+        removed = {f: copy.deepcopy(self._baseline[f]) for f in self._remote_fields - parsed.keys()}
+        target = {**removed, **parsed}
+        changed = {f: v for f, v in target.items() if getattr(self._settings, f) != v}
+
+        # Aplicação atômica do ponto de vista do event loop
+        for field, value in changed.items():
+            setattr(self._settings, field, value)
+        self._config_map = dict(config_map)
+        self._remote_fields = set(parsed)
+        self.hash = digest
+        self.version += 1
+        self.source = source
+        self.updated_at = time.time()
+
+        if changed:
+            logger.info(f"Config v{self.version} from {source}: {sorted(changed)}")
+            for callback in self._listeners:
+                try:
+                    callback(changed)
+                except Exception as e:
+                    logger.error(f"Config listener failed: {e}")
+        return changed
+
+    # ── Snapshot local ────────────────────────────────────
+
+    def load_snapshot(self) -> bool:
+        path = self._settings.CONFIG_SNAPSHOT_PATH
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+            self.apply(snapshot["values"], source="snapshot")
+            logger.info(f"Config snapshot loaded ({len(snapshot['values'])} keys)")
+            return True
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Config snapshot unreadable ({path}): {e}")
+            return False
+
+    def _write_snapshot(self, config_map: Dict[str, str]):
+        path = self._settings.CONFIG_SNAPSHOT_PATH
+        if not path:
             return
-
+        tmp = f"{path}.tmp"
+        # Contém o ORACLE_TOKEN: só o dono do processo lê
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"values": config_map, "hash": _config_hash(config_map),
+                       "fetched_at": time.time()}, f)
+        os.replace(tmp, path)
+
+    # ── Supabase (fora do event loop) ────────────────────
+
+    @staticmethod
+    def _fetch() -> Optional[Dict[str, str]]:
+        client = get_supabase()
+        if client is None:
+            return None
+        result = client.table("ots_config").select("key, value").execute()
+        return {row["key"]: row["value"] for row in (result.data or [])}
+
+    async def refresh(self) -> bool:
+        """Busca o config no Supabase (em thread) e aplica se mudou."""
         try:
-            from supabase import create_client
-
-            client = create_client(self.SUPABASE_URL, self.SUPABASE_KEY)
-
-            # Fetch all Hub config
-            result = client.table("ots_config").select("key, value").execute()
-
-            if result.data:
-                config_map = {row["key"]: row["value"] for row in result.data}
-
-                # Apply to settings
-                if "host" in config_map:
-                    self.HOST = config_map["host"]
-                if "port" in config_map:
-                    self.PORT = int(config_map["port"])
-                if "debug" in config_map:
-                    self.DEBUG = config_map["debug"].lower() == "true"
-                if "oracle_token" in config_map:
-                    self.ORACLE_TOKEN = config_map["oracle_token"]
-                if "auth_timeout" in config_map:
-                    self.AUTH_TIMEOUT = int(config_map["auth_timeout"])
-                if "allowed_origins" in config_map:
-                    origins = config_map["allowed_origins"]
-                    self.ALLOWED_ORIGINS = origins.split(",") if "," in origins else origins
-                if "telemetry_interval_min" in config_map:
-                    self.TELEMETRY_INTERVAL_MIN = int(config_map["telemetry_interval_min"])
-
-                print(f"✅ Configuração carregada do Supabase ({len(config_map)} keys)")
-            else:
-                print("⚠️ Nenhuma configuração encontrada no Supabase — usando defaults")
-
+            config_map = await asyncio.to_thread(self._fetch)
         except Exception as e:
-            print(f"❌ Erro ao carregar config do Supabase: {e}")
-            print("   Usando configuração do .env como fallback")
+            logger.error(f"Supabase config refresh failed: {e}")
+            return False
+        if config_map is None:
+            return False
+        # Tabela vazia também é aplicada: devolve as chaves removidas ao .env
+        if _config_hash(config_map) != self.hash:
+            self.apply(config_map, source="supabase")
+            try:
+                await asyncio.to_thread(self._write_snapshot, config_map)
+            except OSError as e:
+                logger.warning(f"Config snapshot write failed: {e}")
+        return True
+
+    async def _refresh_loop(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(max(1, self._settings.CONFIG_REFRESH_S))
+
+    def start(self):
+        if not supabase_configured():
+            logger.warning("SUPABASE_URL ou SUPABASE_KEY não definidos — usando .env apenas")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "hash": self.hash,
+            "source": self.source,
+            "updated_at": self.updated_at,
+            "keys": sorted(self._config_map),
+        }
 
 
-# Create settings instance
-settings = Settings()
+config_service = ConfigService(settings)
 
 
 # Helper function to initialize settings
 async def init_settings() -> Settings:
-    """Initialize settings from Supabase."""
-    await settings.load_from_supabase()
+    """Aplica o snapshot local (instantâneo) e inicia o refresh em background."""
+    config_service.load_snapshot()
+    config_service.start()
     return settings
@@ -1,20 +1,36 @@
 """
 OTS Hub — Database (Supabase)
+
+Client único e compartilhado, criado sob demanda na primeira utilização
+(a criação é síncrona: chamar fora do event loop).
 """
 
 import logging
+import threading
+
 from app.core.config import settings
 
 logger = logging.getLogger("hub.db")
 
-supabase = None
-
-if settings.SUPABASE_URL and settings.SUPABASE_KEY:
-    try:
-        from supabase import create_client
-        supabase = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
-        logger.info(f"Supabase initialized: {settings.SUPABASE_URL[:40]}...")
-    except Exception as e:
-        logger.error(f"Supabase init failed: {e}")
-else:
-    logger.warning("Supabase not configured — telemetry will only be in-memory")
+_client = None
+_lock = threading.Lock()
+
+
+def supabase_configured() -> bool:
+    return bool(settings.SUPABASE_URL and settings.SUPABASE_KEY)
+
+
+def get_supabase():
+    """Retorna o client do Supabase (ou None se não configurado/indisponível)."""
+    global _client
+    if _client is not None or not supabase_configured():
+        return _client
+    with _lock:
+        if _client is None:
+            try:
+                from supabase import create_client
+                _client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+                logger.info(f"Supabase initialized: {settings.SUPABASE_URL[:40]}...")
+            except Exception as e:
+                logger.error(f"Supabase init failed: {e}")
+    return _client
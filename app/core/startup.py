@@ -0,0 +1,40 @@
+"""
+OTS Hub — Startup timing
+
+Mede as fases do cold start (import → settings → ready → primeira conexão
+aceita) para acompanhar o tempo de recuperação após crash/restart.
+Importado primeiro em app/main.py, então t0 ≈ início do import do Hub.
+"""
+
+import logging
+import time
+from typing import Dict
+
+logger = logging.getLogger("hub.startup")
+
+PHASES = ("import", "settings", "ready", "first_accept")
+
+
+class StartupTimer:
+    """Instantes (s desde t0) em que cada fase do startup terminou."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: str):
+        if phase in self.phases:
+            return
+        self.phases[phase] = time.perf_counter() - self.t0
+        if phase == "first_accept":
+            logger.info("Startup: " + ", ".join(
+                f"{p}={self.phases[p] * 1000:.0f}ms" for p in PHASES if p in self.phases))
+
+    def report(self) -> dict:
+        return {
+            "phases_ms": {p: round(self.phases[p] * 1000, 1) for p in PHASES if p in self.phases},
+            "complete": "first_accept" in self.phases,
+        }
+
+
+startup_timer = StartupTimer()
@@ -4,19 +4,36 @@ OTS Hub — Main Application
 FastAPI server com WebSocket (auth obrigatória) e REST endpoints.
 """
 
+# Primeiro import: marca t0 do cold start
+from app.core.startup import startup_timer
+
 import asyncio
+import hashlib
 import json
 import logging
 import time
+from typing import Optional
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from app.core.config_supabase import settings, init_settings
+from app.core.config import settings
+from app.core.config_supabase import config_service, init_settings
 from app.websockets.manager import manager
-from app.websockets.router import route_message
-from app.modules.telemetry.service import telemetry_store
-from app.modules.commands.service import command_router
+from app.websockets.accounting import memory_budget
+from app.websockets.admission import admission, role_hint
+from app.websockets.namespaces import namespaces
+from app.websockets.heartbeat import heartbeat
+from app.websockets.codec import shutdown_pool
+from app.websockets.drain import hub_drain
+from app.websockets.session import serve_session
+from app.websockets.stream import stream_servers
+from app.modules.events.service import event_bus
+from app.modules.metrics.service import metrics
+from app.modules.snapshot.service import hub_snapshot
+from app.modules.store.service import local_store
+from app.modules.bars.service import COLUMNS as BAR_COLUMNS, to_npy, to_npz, to_raw
 
 # Logging will be configured after settings are loaded
 logger = logging.getLogger("hub")
@@ -59,34 +76,335 @@ async def health():
         "connections": manager.count,
         "authenticated": manager.authenticated_count,
         "uptime_s": round(time.time() - _start_time, 0),
+        "config_version": config_service.version,
+        "draining": manager.draining,
+    }
+
+
+def _status_payload() -> dict:
+    """Parte estável do status (muda com conexões, telemetria e comandos)."""
+    return {
+        "connections": manager.list_connections(counters=False),
+        "telemetry": {iid: data for space in namespaces.all()
+                      for iid, data in space.telemetry.get_all_latest().items()},
+        "active_instances": _active_instances(),
+        "pending_commands": [{**cmd, "namespace": space.name} for space in namespaces.all()
+                             for cmd in space.commands.get_pending()],
+        # Do default; os demais namespaces em /status/live (namespaces[].bar_subscriptions)
+        "bar_subscriptions": namespaces.get().resampler.get_subscriptions(),
     }
 
 
+def _active_instances() -> list:
+    return [iid for space in namespaces.all() for iid in space.telemetry.get_connected_instances()]
+
+
+def _status_etag() -> str:
+    """
+    Validador do status sem montar nem serializar o corpo: conjunto de
+    conexões, versão (server_ts) de cada telemetria, ids de comandos
+    pendentes, assinaturas de barras e instâncias ativas.
+    """
+    key = (
+        [tuple(c.values()) for c in manager.list_connections(counters=False)],
+        [(space.name, iid, data.get("server_ts"))
+         for space in namespaces.all() for iid, data in space.telemetry.get_all_latest().items()],
+        [(space.name, cmd["id"]) for space in namespaces.all() for cmd in space.commands.get_pending()],
+        sorted(namespaces.get().resampler.get_subscriptions().items()),
+        _active_instances(),
+    )
+    return f'"{hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [t.strip() for t in header.split(",")]
+
+
 @app.get(f"{settings.API_V1_STR}/status")
-async def status():
-    """Status detalhado para dashboard."""
+async def status(request: Request):
+    """
+    Status para dashboard (conexões, telemetria, comandos pendentes).
+
+    O ETag é calculado antes do corpo: polls sem mudança respondem 304 sem
+    montar nem serializar o status. Contadores voláteis (rtt, tráfego,
+    memória, admission, métricas por namespace) ficam em /status/live.
+    """
+    etag = _status_etag()
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    body = json.dumps(_status_payload(), separators=(",", ":"), default=str)
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+@app.get(f"{settings.API_V1_STR}/status/live")
+async def status_live():
+    """Contadores voláteis do status (mudam a cada frame; sem ETag)."""
     return {
         "connections": manager.list_connections(),
-        "telemetry": telemetry_store.get_all_latest(),
-        "active_instances": telemetry_store.get_connected_instances(),
-        "pending_commands": command_router.get_pending(),
+        "admission": admission.info(),
+        "namespaces": namespaces.info(),
+        "memory": memory_budget.info(),
     }
 
 
 @app.get(f"{settings.API_V1_STR}/telemetry/{{instance_id}}")
-async def get_telemetry(instance_id: str):
-    data = telemetry_store.get_latest(instance_id)
+async def get_telemetry(instance_id: str, request: Request):
+    data = namespaces.find_telemetry(instance_id)
+    if not data:
+        return {"error": "not found"}
+    etag = f'W/"{instance_id}:{data["server_ts"]}"'
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(data, headers={"ETag": etag})
+
+
+@app.get(f"{settings.API_V1_STR}/config")
+async def get_config_info():
+    """Versão/origem do config em uso (sem valores, que podem conter segredos)."""
+    return config_service.info()
+
+
+@app.get(f"{settings.API_V1_STR}/startup")
+async def get_startup_report():
+    """Tempos das fases do cold start (import, settings, ready, first_accept)."""
+    return startup_timer.report()
+
+
+@app.get(f"{settings.API_V1_STR}/metrics")
+async def get_metrics():
+    """Contadores e latências (p50/p95/p99) do Hub + orçamento de memória."""
+    return {**metrics.snapshot(), "memory": memory_budget.info()}
+
+
+def _sse(event: str, data: dict, event_id: int) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.get(f"{settings.API_V1_STR}/stream")
+async def stream(request: Request):
+    """
+    Stream SSE para dashboards: snapshot inicial + eventos incrementais
+    (connection, telemetry, telemetry_removed, command).
+    Se o cliente ficar para trás, recebe um novo snapshot.
+    """
+    async def events():
+        sub = event_bus.subscribe()
+        try:
+            yield _sse("snapshot", _status_payload(), event_bus.version)
+            while not await request.is_disconnected():
+                item = await sub.next(timeout=settings.SSE_KEEPALIVE_S)
+                if item is None:
+                    yield ": keepalive\n\n"
+                    continue
+                version, event, data = item
+                if event == "resync":
+                    sub.resync = False
+                    yield _sse("snapshot", _status_payload(), event_bus.version)
+                    continue
+                yield _sse(event, data, version)
+        finally:
+            event_bus.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get(f"{settings.API_V1_STR}/state")
+async def get_state(namespace: Optional[str] = None):
+    """Estado materializado (conta + posições abertas) dos connectors do namespace."""
+    space = namespaces.find(namespace)
+    if space is None:
+        return {"error": "unknown namespace"}
+    return {"connectors": space.state.snapshot()}
+
+
+@app.get(f"{settings.API_V1_STR}/state/{{instance_id}}")
+async def get_connector_state(instance_id: str, namespace: Optional[str] = None):
+    if namespace is None:
+        data = namespaces.find_state(instance_id)
+    else:
+        space = namespaces.find(namespace)
+        if space is None:
+            return {"error": "unknown namespace"}
+        data = space.state.get(instance_id)
     if not data:
         return {"error": "not found"}
     return data
 
 
+@app.get(f"{settings.API_V1_STR}/ownership")
+async def get_ownership(namespace: Optional[str] = None):
+    """Donos de conta/symbol (connectors), interesses dos executors e conflitos."""
+    space = namespaces.find(namespace)
+    if space is None:
+        return {"error": "unknown namespace"}
+    return space.ownership.info()
+
+
+@app.get(f"{settings.API_V1_STR}/namespaces")
+async def get_namespaces():
+    """Namespaces: conexões, comandos pendentes, limites e métricas de cada um."""
+    return namespaces.info()
+
+
+@app.get(f"{settings.API_V1_STR}/commands")
+async def get_commands(
+    target: Optional[str] = None,
+    origin: Optional[str] = None,
+    action: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    before: Optional[int] = None,
+    limit: int = 50,
+    namespace: Optional[str] = None,
+):
+    """
+    Log de auditoria de comandos (mais novos primeiro), via índices.
+    Paginação: passar `next_before` da resposta como `before`.
+    """
+    space = namespaces.find(namespace)
+    if space is None:
+        return {"error": "unknown namespace"}
+    items, next_before = space.commands.query_log(
+        target=target, origin=origin, action=action, status=status,
+        since=since, until=until, before=before, limit=min(max(limit, 1), 1000))
+    return {"items": items, "next_before": next_before}
+
+
+@app.get(f"{settings.API_V1_STR}/commands/latency")
+async def get_command_latency(namespace: Optional[str] = None):
+    """Percentis (p50/p95/p99/max, ms) da latência envio → ack por action."""
+    space = namespaces.find(namespace)
+    if space is None:
+        return {"error": "unknown namespace"}
+    return space.commands.latency()
+
+
+@app.get(f"{settings.API_V1_STR}/history")
+async def get_local_store_info():
+    """Estado do store local (fila, gravados, replicados, último erro)."""
+    return local_store.info()
+
+
+@app.get(f"{settings.API_V1_STR}/history/telemetry")
+async def get_telemetry_history(
+    instance_id: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 100,
+):
+    """Amostras de telemetria do store local, mais recentes primeiro."""
+    if not local_store.enabled:
+        return {"error": "local store disabled"}
+    return await local_store.query_telemetry(instance_id, since, until, min(max(limit, 1), 5000))
+
+
+@app.get(f"{settings.API_V1_STR}/history/commands")
+async def get_command_history(
+    target: Optional[str] = None,
+    origin: Optional[str] = None,
+    action: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 100,
+):
+    """Comandos concluídos (ack ou expirados) do store local, mais recentes primeiro."""
+    if not local_store.enabled:
+        return {"error": "local store disabled"}
+    return await local_store.query_commands(target, origin, action, status, since, until,
+                                            min(max(limit, 1), 5000))
+
+
+@app.get(f"{settings.API_V1_STR}/bars")
+async def list_bar_series(namespace: Optional[str] = None):
+    """Séries de barras do namespace (symbol, timeframe, contagem, intervalo)."""
+    space = namespaces.find(namespace)
+    if space is None:
+        return {"error": "unknown namespace"}
+    return {"series": space.bars.list_series()}
+
+
+@app.get(f"{settings.API_V1_STR}/bars/{{symbol}}/{{timeframe}}")
+async def export_bars(
+    symbol: str,
+    timeframe: str,
+    format: str = "npz",
+    columns: Optional[str] = None,
+    column: str = "close",
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    limit: Optional[int] = None,
+    namespace: Optional[str] = None,
+):
+    """
+    Export colunar binário das barras (time em int64, OHLCV em float64, little-endian).
+
+    - format=npz: um .npy por coluna (`columns=open,close`, default todas)
+    - format=npy: uma coluna (`column`) em .npy (aceita np.load(mmap_mode=...);
+      .npz não)
+    - format=raw: uma coluna (`column`) como bytes crus (np.frombuffer)
+
+    `start`/`end` (epoch s, [start, end)) e `limit` (últimas N) fazem o recorte;
+    `namespace` escolhe as séries (default: `default`).
+    """
+    space = namespaces.find(namespace)
+    series = space.bars.get(symbol, timeframe) if space else None
+    if series is None:
+        return JSONResponse({"error": "not found"}, status_code=404)
+
+    selected = [c.strip() for c in columns.split(",")] if columns else list(BAR_COLUMNS)
+    if any(c not in BAR_COLUMNS for c in selected + [column]):
+        return JSONResponse({"error": f"columns must be in {list(BAR_COLUMNS)}"}, status_code=400)
+
+    i, j = series.bounds(start, end, limit)
+    headers = {"X-Bar-Count": str(j - i)}
+    if j > i:
+        headers["X-Bar-First"] = str(series.cols["time"][i])
+        headers["X-Bar-Last"] = str(series.cols["time"][j - 1])
+
+    if format == "npz":
+        content = to_npz(series, selected, i, j)
+    elif format == "npy":
+        content = to_npy(series, column, i, j)
+    elif format == "raw":
+        content = to_raw(series, column, i, j)
+        headers["X-Dtype"] = "<i8" if column == "time" else "<f8"
+    else:
+        return JSONResponse({"error": "format must be npz, npy or raw"}, status_code=400)
+    return Response(content=content, media_type="application/octet-stream", headers=headers)
+
+
+@app.get(f"{settings.API_V1_STR}/shm/bars")
+async def list_shm_bar_rings(namespace: Optional[str] = None):
+    """Rings de barras em memória compartilhada (nome do segmento, capacidade, write_seq)."""
+    space = namespaces.find(namespace)
+    if space is None:
+        return {"error": "unknown namespace"}
+    return {"enabled": settings.SHM_BARS_ENABLED, "rings": space.bar_rings.list_rings()}
+
+
+@app.get(f"{settings.API_V1_STR}/shards")
+async def list_loop_shards():
+    """Loop shards das conexões stream (conexões e mensagens por shard)."""
+    from app.websockets.shards import loop_shards
+    return {"count": settings.LOOP_SHARDS, "shards": loop_shards.info()}
+
+
 @app.post(f"{settings.API_V1_STR}/command")
 async def send_command(body: dict):
     """Envia comando para um processo via REST."""
     token = body.get("token", "")
-    from app.modules.auth.service import validate_token
-    if not validate_token(token):
+    from app.modules.auth.service import DEFAULT_NAMESPACE, validate_token
+    namespace = body.get("namespace") or DEFAULT_NAMESPACE
+    if not validate_token(token, namespace):
         return {"error": "unauthorized"}
 
     target = body.get("target")
@@ -96,7 +414,12 @@ async def send_command(body: dict):
     if not target or not action:
         return {"error": "target and action required"}
 
-    cmd = command_router.create_command(action, target, "rest-api", params)
+    space = namespaces.get(namespace)
+    if namespaces.of(target) is not space:
+        return {"status": "target_not_connected"}
+    if not space.accepts_command():
+        return {"error": "pending command limit reached"}
+    cmd = space.commands.create_command(action, target, "rest-api", params)
     if not cmd:
         return {"error": f"invalid action: {action}"}
 
@@ -104,6 +427,19 @@ async def send_command(body: dict):
     return {"status": "sent" if sent else "target_not_connected", "cmd_id": cmd["id"]}
 
 
+@app.post(f"{settings.API_V1_STR}/admin/drain")
+async def drain(body: dict):
+    """
+    Prepara um restart sem downtime: para de aceitar conexões, esvazia as
+    filas, grava o snapshot do estado e manda os clientes reconectarem
+    (reconnect_after). Chamar antes do `systemctl restart`.
+    """
+    from app.modules.auth.service import validate_token
+    if not validate_token(body.get("token", "")):
+        return {"error": "unauthorized"}
+    return await hub_drain.run(body.get("reason") or "restart")
+
+
 # ═══════════════════════════════════════════════════════════
 # WebSocket Endpoint
 # ═══════════════════════════════════════════════════════════
@@ -117,53 +453,61 @@ async def websocket_endpoint(websocket: WebSocket, instance_id: str):
     1. Conecta
     2. DEVE enviar 'auth' em AUTH_TIMEOUT segundos
     3. Loop: envia/recebe mensagens
-    """
-    conn = await manager.connect(websocket, instance_id)
 
-    try:
-        # Auth Handshake
-        try:
-            raw = await asyncio.wait_for(websocket.receive_text(), timeout=settings.AUTH_TIMEOUT)
-            response = await route_message(raw, instance_id)
-            if response:
-                await websocket.send_text(response)
-
-            if not manager.is_authenticated(instance_id):
-                logger.warning(f"Auth failed for {instance_id}, closing")
-                await websocket.close(code=4001, reason="Unauthorized")
-                return
-
-        except asyncio.TimeoutError:
-            logger.warning(f"Auth timeout for {instance_id}")
-            await websocket.close(code=4001, reason="Auth timeout")
-            return
-
-        # Message Loop
-        while True:
-            raw = await websocket.receive_text()
-            response = await route_message(raw, instance_id)
-            if response:
-                await websocket.send_text(response)
-
-    except WebSocketDisconnect:
-        pass
-    except Exception as e:
-        logger.error(f"Error with {instance_id}: {e}")
-    finally:
-        manager.disconnect(instance_id)
-        telemetry_store.remove(instance_id)
+    Query opcional `resume` (ticket) prioriza o handshake numa
+    tempestade de reconexões (app/websockets/admission.py).
+
+    Sessão compartilhada com os transportes stream (app/websockets/session.py).
+    """
+    params = websocket.query_params
+    role = role_hint(instance_id, params.get("resume"))
+    await serve_session(websocket, instance_id, role=role)
 
 
 # Startup
 _start_time = time.time()
+startup_timer.mark("import")
+_expiry_task: Optional[asyncio.Task] = None
+
+
+async def _command_expiry():
+    """Expira comandos sem ack em todos os namespaces."""
+    interval = max(1.0, settings.COMMAND_ACK_TIMEOUT_S / 3)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            namespaces.expire_commands()
+        except Exception as e:
+            logger.error(f"Command expiry failed: {e}")
 
 
 @app.on_event("startup")
 async def startup():
-    # Load settings from Supabase
+    _configure_logging()
+    config_service.on_change(_on_config_change)
+
+    # Snapshot local (instantâneo) + refresh do Supabase em background
     await init_settings()
+    startup_timer.mark("settings")
+
+    # Estado do processo anterior (restart via drain/shutdown)
+    hub_snapshot.restore()
 
-    # Configure logging now that settings are loaded
+    logger.info(f"OTS Hub v{settings.VERSION} starting on {settings.HOST}:{settings.PORT}")
+    logger.info(f"Supabase: {'✅ Configured' if settings.SUPABASE_URL else '❌ Not configured'} "
+                f"(config v{config_service.version} from {config_service.source})")
+    global _expiry_task
+    heartbeat.start()
+    _expiry_task = asyncio.create_task(_command_expiry())
+    local_store.start()
+    await stream_servers.start()
+    if settings.LOOP_SHARDS > 0:
+        from app.websockets.shards import loop_shards
+        await loop_shards.serve_http(app)
+    startup_timer.mark("ready")
+
+
+def _configure_logging():
     logging.basicConfig(
         level=logging.DEBUG if settings.DEBUG else logging.INFO,
         format="%(asctime)s [%(name)s] %(levelname)s — %(message)s",
@@ -171,26 +515,42 @@ async def startup():
         force=True,  # Override existing config
     )
 
-    logger.info(f"OTS Hub v{settings.VERSION} starting on {settings.HOST}:{settings.PORT}")
-    logger.info(f"Supabase: {'✅ Connected' if settings.SUPABASE_URL else '❌ Not configured'}")
-    asyncio.create_task(_stale_connection_cleanup())
-
 
-async def _stale_connection_cleanup():
-    """Remove conexões que não enviaram mensagem há 5 minutos."""
-    while True:
-        await asyncio.sleep(60)
-        now = time.time()
-        stale = []
-        for conn_info in manager.list_connections():
-            last_msg = conn_info.get("last_message_at", 0)
-            if last_msg > 0 and (now - last_msg) > 300:
-                stale.append(conn_info["instance_id"])
-        for iid in stale:
-            logger.warning(f"Removing stale connection: {iid}")
-            manager.disconnect(iid)
+def _on_config_change(changed: dict):
+    if "DEBUG" in changed:
+        logging.getLogger().setLevel(logging.DEBUG if settings.DEBUG else logging.INFO)
 
 
 @app.on_event("shutdown")
 async def shutdown():
+    # Fallback do drain: sem conexões a fechar, garante o snapshot
+    await hub_drain.run("shutdown", abort_on_failure=False)
+    heartbeat.stop()
+    if _expiry_task:
+        _expiry_task.cancel()
+    await local_store.stop()
+    config_service.stop()
+    await stream_servers.stop()
+    for space in namespaces.all():
+        space.bar_rings.close()
+    shutdown_pool()
     logger.info("OTS Hub shutting down")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    from app.websockets.accounting import ws_max_size
+
+    # Frames acima do maior limite são recusados pelo servidor, antes de bufferizar
+    options = {"ws_max_size": ws_max_size()}
+    config = uvicorn.Config("app.main:app", host=settings.HOST, port=settings.PORT, **options)
+    if settings.LOOP_SHARDS > 0:
+        # HTTP/WebSocket servidos pelos loop shards (app/websockets/shards.py);
+        # o uvicorn do loop principal só roda lifespan e a app
+        from app.websockets.shards import loop_shards
+        loop_shards.http_socket = config.bind_socket()
+        loop_shards.http_options = options
+        uvicorn.Server(config).run(sockets=[])
+    else:
+        uvicorn.Server(config).run()
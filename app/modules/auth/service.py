@@ -1,20 +1,38 @@
 """
 OTS Hub — Auth Module
 
-Valida token no handshake WebSocket.
+Valida token no handshake WebSocket e emite resume tickets: tokens
+assinados (HMAC-SHA256) e de vida curta, devolvidos no ack de auth, que
+permitem a uma instância conhecida re-autenticar em uma mensagem após
+uma queda (`{"type": "auth", "payload": {"resume": "<ticket>"}}`).
+
+Namespaces: cada namespace tem seu token (NAMESPACE_TOKENS); o
+namespace `default` aceita o ORACLE_TOKEN. Tickets carregam o namespace.
 """
 
+import base64
+import hashlib
+import hmac
+import json
 import logging
+import time
+from typing import Optional, Tuple
+
 from app.core.config import settings
 
 logger = logging.getLogger("hub.auth")
 
+DEFAULT_NAMESPACE = "default"
 
-def validate_token(token: str) -> bool:
-    """Valida token contra ORACLE_TOKEN configurado."""
+
+def validate_token(token: str, namespace: str = DEFAULT_NAMESPACE) -> bool:
+    """Valida token contra o token do namespace (default também aceita ORACLE_TOKEN)."""
     if not token:
         return False
-    return token == settings.ORACLE_TOKEN
+    if namespace == DEFAULT_NAMESPACE and token == settings.ORACLE_TOKEN:
+        return True
+    expected = settings.NAMESPACE_TOKENS.get(namespace)
+    return expected is not None and token == expected
 
 
 def get_permissions(role: str) -> list:
@@ -28,3 +46,58 @@ def get_permissions(role: str) -> list:
         "dashboard":  ["telemetry:read", "signal:read"],
     }
     return perms.get(role, [])
+
+
+def _ticket_key() -> Optional[bytes]:
+    # Sem segredo dedicado, deriva do ORACLE_TOKEN (trocar o token invalida os tickets)
+    secret = settings.RESUME_TICKET_SECRET or settings.ORACLE_TOKEN
+    if not secret:
+        return None
+    return hashlib.sha256(b"ots-resume:" + secret.encode()).digest()
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def issue_resume_ticket(instance_id: str, role: str,
+                        namespace: str = DEFAULT_NAMESPACE) -> Optional[Tuple[str, float]]:
+    """Ticket `<claims>.<assinatura>` válido por RESUME_TICKET_TTL_S. None se desativado."""
+    key = _ticket_key()
+    if key is None or settings.RESUME_TICKET_TTL_S <= 0:
+        return None
+    expires_at = time.time() + settings.RESUME_TICKET_TTL_S
+    claims = {"iid": instance_id, "role": role, "exp": round(expires_at, 3)}
+    if namespace != DEFAULT_NAMESPACE:
+        claims["ns"] = namespace
+    claims = _b64(json.dumps(claims, separators=(",", ":")).encode())
+    signature = _b64(hmac.new(key, claims.encode(), hashlib.sha256).digest())
+    return f"{claims}.{signature}", expires_at
+
+
+def verify_resume_ticket(ticket: str, instance_id: str,
+                         namespace: Optional[str] = None) -> Optional[str]:
+    """
+    Role do ticket se assinatura, instância e validade conferem; senão None.
+    Com `namespace`, o ticket também precisa ser desse namespace.
+    """
+    key = _ticket_key()
+    if key is None or not isinstance(ticket, str) or ticket.count(".") != 1:
+        return None
+    claims, signature = ticket.split(".")
+    expected = _b64(hmac.new(key, claims.encode(), hashlib.sha256).digest())
+    if not hmac.compare_digest(signature, expected):
+        return None
+    try:
+        data = json.loads(_unb64(claims))
+    except ValueError:
+        return None
+    if data.get("iid") != instance_id or data.get("exp", 0) < time.time():
+        return None
+    if namespace is not None and data.get("ns", DEFAULT_NAMESPACE) != namespace:
+        return None
+    return data.get("role")
@@ -0,0 +1,415 @@
+"""
+OTS Hub — Bars Module
+
+Reamostragem incremental de barras OHLCV para timeframes maiores e
+armazenamento colunar das barras vistas pelo Hub (export binário).
+
+Connectors publicam barras no timeframe base; preditors assinam os
+timeframes derivados que querem (`bar_subscribe`). Cada barra base
+atualiza em O(1) a barra em formação de cada timeframe assinado; ao
+fechar o bucket, a barra derivada é emitida só para os assinantes.
+
+Formato esperado da barra: {symbol, time (epoch s, abertura), open, high,
+low, close, volume, timeframe (opcional, ex: "M1")}.
+"""
+
+import base64
+import logging
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.modules.events.service import event_bus
+
+logger = logging.getLogger("hub.bars")
+
+_TF_UNITS = {"M": 60, "H": 3600, "D": 86400, "W": 604800}
+_TF_RE = re.compile(r"^([MHDW])(\d+)$")
+
+
+def timeframe_seconds(timeframe: str) -> Optional[int]:
+    """'M5' → 300, 'H1' → 3600. None se inválido."""
+    match = _TF_RE.match(str(timeframe or "").upper())
+    if not match:
+        return None
+    seconds = _TF_UNITS[match.group(1)] * int(match.group(2))
+    return seconds or None
+
+
+class _Bucket:
+    """
+    Barra derivada em formação: agregado das barras base anteriores mais a
+    última barra base, guardada à parte (OHLCV já convertidos para float).
+    Barra base repetida com a mesma `time` substitui a última (atualização
+    no lugar, como em BarSeries.append) em vez de somar de novo; barra base
+    mais antiga que a última (fora de ordem) é ignorada.
+    """
+
+    __slots__ = ("start", "emitted", "last_time", "last", "open", "high", "low", "volume")
+
+    def __init__(self, start: int, t: int, bar: dict):
+        self.start = start
+        self.emitted = False
+        self.last_time = t
+        self.last = bar
+        # Agregado das barras anteriores à última (open None = nenhuma)
+        self.open = self.high = self.low = None
+        self.volume = 0
+
+    def update(self, t: int, bar: dict) -> bool:
+        """Aplica uma barra base do bucket. Retorna False se nada mudou."""
+        last = self.last
+        if t < self.last_time:
+            return False
+        if t == self.last_time:
+            self.last = bar
+            return bar != last
+        if self.open is None:
+            self.open, self.high, self.low = last["open"], last["high"], last["low"]
+        else:
+            if last["high"] > self.high:
+                self.high = last["high"]
+            if last["low"] < self.low:
+                self.low = last["low"]
+        self.volume += last["volume"]
+        self.last_time, self.last = t, bar
+        return True
+
+    def to_payload(self, symbol: str, timeframe: str) -> dict:
+        last = self.last
+        if self.open is None:
+            open_, high, low = last["open"], last["high"], last["low"]
+        else:
+            open_, high, low = self.open, max(self.high, last["high"]), min(self.low, last["low"])
+        return {
+            "symbol": symbol,
+            "timeframe": timeframe,
+            "time": self.start,
+            "open": open_,
+            "high": high,
+            "low": low,
+            "close": last["close"],
+            "volume": self.volume + last["volume"],
+            "derived": True,
+        }
+
+
+class BarResampler:
+    """Agregador OHLCV incremental por (origem, symbol, timeframe)."""
+
+    def __init__(self):
+        # (symbol, timeframe) → assinantes
+        self._subscribers: Dict[Tuple[str, str], Set[str]] = {}
+        # (origem, symbol, timeframe) → barra em formação
+        self._buckets: Dict[Tuple[str, str, str], _Bucket] = {}
+        # symbol → timeframes assinados (evita varrer _subscribers por barra)
+        self._by_symbol: Dict[str, Set[str]] = {}
+
+    def subscribe(self, instance_id: str, symbol: str, timeframes: List[str]) -> List[str]:
+        """Assina timeframes derivados. Retorna os timeframes aceitos."""
+        accepted = []
+        for tf in timeframes:
+            tf = str(tf).upper()
+            if not timeframe_seconds(tf):
+                continue
+            self._subscribers.setdefault((symbol, tf), set()).add(instance_id)
+            self._by_symbol.setdefault(symbol, set()).add(tf)
+            accepted.append(tf)
+        if accepted:
+            event_bus.publish("bar_subscription", {
+                "instance_id": instance_id, "symbol": symbol,
+                "timeframes": accepted, "state": "subscribed",
+            })
+        return accepted
+
+    def unsubscribe(self, instance_id: str, symbol: Optional[str] = None,
+                    timeframes: Optional[List[str]] = None):
+        for (sym, tf), subs in list(self._subscribers.items()):
+            if symbol and sym != symbol:
+                continue
+            if timeframes and tf not in {str(t).upper() for t in timeframes}:
+                continue
+            if instance_id not in subs:
+                continue
+            subs.discard(instance_id)
+            event_bus.publish("bar_subscription", {
+                "instance_id": instance_id, "symbol": sym,
+                "timeframes": [tf], "state": "unsubscribed",
+            })
+            if not subs:
+                self._drop_timeframe(sym, tf)
+
+    def _drop_timeframe(self, symbol: str, tf: str):
+        self._subscribers.pop((symbol, tf), None)
+        tfs = self._by_symbol.get(symbol)
+        if tfs:
+            tfs.discard(tf)
+            if not tfs:
+                self._by_symbol.pop(symbol, None)
+        for key in [k for k in self._buckets if k[1] == symbol and k[2] == tf]:
+            self._buckets.pop(key, None)
+
+    def process(self, from_id: str, bar: dict) -> List[Tuple[dict, Set[str]]]:
+        """
+        Aplica uma barra base. Retorna [(barra derivada fechada, assinantes)].
+
+        Correção da última barra base de um bucket já emitido (mesma `time`,
+        valores diferentes) reemite a barra derivada com a mesma `time`.
+        """
+        symbol = bar.get("symbol")
+        timeframes = self._by_symbol.get(symbol)
+        if not timeframes:
+            return []
+        try:
+            t = int(bar.get("time", bar.get("timestamp")))
+            # Preços podem vir como string: compara e agrega sempre em float
+            ohlcv = {k: float(bar[k]) for k in ("open", "high", "low", "close")}
+            ohlcv["volume"] = float(bar.get("volume") or 0)
+        except (TypeError, KeyError, ValueError):
+            return []
+        base_secs = timeframe_seconds(bar.get("timeframe")) or 0
+
+        closed = []
+        for tf in timeframes:
+            tf_secs = timeframe_seconds(tf)
+            if base_secs and tf_secs <= base_secs:
+                continue
+            key = (from_id, symbol, tf)
+            subscribers = self._subscribers[(symbol, tf)]
+            start = t - t % tf_secs
+            bucket = self._buckets.get(key)
+            if bucket is None or start > bucket.start:
+                # Chegou barra de um bucket novo: fecha o anterior (se ainda aberto)
+                if bucket is not None and not bucket.emitted:
+                    closed.append((bucket.to_payload(symbol, tf), subscribers))
+                bucket = self._buckets[key] = _Bucket(start, t, ohlcv)
+            elif start == bucket.start and not bucket.emitted:
+                bucket.update(t, ohlcv)
+            elif start == bucket.start and t == bucket.last_time:
+                if bucket.update(t, ohlcv):
+                    closed.append((bucket.to_payload(symbol, tf), subscribers))
+                continue
+            else:
+                continue  # barra atrasada de bucket já emitido
+
+            # Timeframe base conhecido: fecha assim que a última barra do bucket chega
+            if base_secs and t + base_secs >= start + tf_secs:
+                closed.append((bucket.to_payload(symbol, tf), subscribers))
+                bucket.emitted = True
+        return closed
+
+    def remove(self, instance_id: str):
+        """Remove assinaturas e barras em formação de uma instância."""
+        self.unsubscribe(instance_id)
+        for key in [k for k in self._buckets if k[0] == instance_id]:
+            self._buckets.pop(key, None)
+
+    def get_subscriptions(self) -> Dict[str, List[str]]:
+        return {f"{sym}:{tf}": sorted(subs) for (sym, tf), subs in self._subscribers.items()}
+
+
+# ═══════════════════════════════════════════════════════════
+# Armazenamento colunar + export binário
+# ═══════════════════════════════════════════════════════════
+
+COLUMNS = ("time", "open", "high", "low", "close", "volume")
+_TYPECODES = {"time": "q", "open": "d", "high": "d", "low": "d", "close": "d", "volume": "d"}
+_NPY_DESCR = {"q": "<i8", "d": "<f8"}
+
+
+def columns_from_bars(bars: Iterable[dict]) -> Optional[Dict[str, array]]:
+    """Converte lista de barras (dicts) em colunas `array` ordenadas por time."""
+    cols = {c: array(_TYPECODES[c]) for c in COLUMNS}
+    try:
+        for bar in bars:
+            cols["time"].append(int(bar.get("time", bar.get("timestamp"))))
+            cols["open"].append(float(bar["open"]))
+            cols["high"].append(float(bar["high"]))
+            cols["low"].append(float(bar["low"]))
+            cols["close"].append(float(bar["close"]))
+            cols["volume"].append(float(bar.get("volume", 0) or 0))
+    except (TypeError, KeyError, ValueError, AttributeError):
+        return None
+    times = cols["time"]
+    if any(times[i] > times[i + 1] for i in range(len(times) - 1)):
+        order = sorted(range(len(times)), key=times.__getitem__)
+        cols = {c: array(_TYPECODES[c], (col[i] for i in order)) for c, col in cols.items()}
+    return cols
+
+
+def history_columns(payload: dict) -> Optional[dict]:
+    """Extrai {symbol, timeframe, columns} de um payload history_response."""
+    if not isinstance(payload, dict) or not payload.get("symbol"):
+        return None
+    bars = payload.get("bars", payload.get("data"))
+    if not isinstance(bars, list) or not bars:
+        return None
+    columns = columns_from_bars(bars)
+    if columns is None:
+        return None
+    return {
+        "symbol": payload["symbol"],
+        "timeframe": str(payload.get("timeframe") or "M1").upper(),
+        "columns": columns,
+    }
+
+
+class BarSeries:
+    """Série OHLCV colunar (arrays contíguos) com capacidade limitada."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.cols: Dict[str, array] = {c: array(_TYPECODES[c]) for c in COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.cols["time"])
+
+    def append(self, bar: dict):
+        times = self.cols["time"]
+        t = int(bar.get("time", bar.get("timestamp")))
+        values = (float(bar["open"]), float(bar["high"]), float(bar["low"]),
+                  float(bar["close"]), float(bar.get("volume", 0) or 0))
+        if times and t <= times[-1]:
+            if t == times[-1]:
+                # Atualização da última barra (barra em formação)
+                for col, v in zip(COLUMNS[1:], values):
+                    self.cols[col][-1] = v
+            return
+        times.append(t)
+        for col, v in zip(COLUMNS[1:], values):
+            self.cols[col].append(v)
+        self._trim()
+
+    def merge(self, columns: Dict[str, array]):
+        """Mescla histórico: prevalece o histórico no seu intervalo, mantém o resto."""
+        hist_times = columns["time"]
+        if not hist_times:
+            return
+        times = self.cols["time"]
+        head = bisect_left(times, hist_times[0])
+        tail = bisect_left(times, hist_times[-1] + 1)
+        for c in COLUMNS:
+            col = self.cols[c]
+            self.cols[c] = col[:head] + columns[c] + col[tail:]
+        self._trim()
+
+    def _trim(self):
+        # Corte amortizado: só quando passa de 1.25x a capacidade
+        excess = len(self) - self.capacity
+        if excess > self.capacity // 4:
+            for c in COLUMNS:
+                del self.cols[c][:excess]
+
+    def bounds(self, start: Optional[int] = None, end: Optional[int] = None,
+               limit: Optional[int] = None) -> Tuple[int, int]:
+        """Índices [i, j) para time em [start, end), limitado às últimas `limit`."""
+        times = self.cols["time"]
+        i = bisect_left(times, start) if start is not None else 0
+        j = bisect_left(times, end) if end is not None else len(times)
+        if limit is not None and limit >= 0 and j - i > limit:
+            i = j - limit
+        return i, max(i, j)
+
+
+class BarStore:
+    """Séries por (symbol, timeframe), alimentadas por bar e history_response."""
+
+    def __init__(self, capacity: int = 50_000):
+        self.capacity = capacity
+        self._series: Dict[Tuple[str, str], BarSeries] = {}
+
+    def _get_or_create(self, symbol: str, timeframe: str) -> BarSeries:
+        key = (symbol, timeframe)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = BarSeries(self.capacity)
+        return series
+
+    def add_bar(self, payload: dict):
+        if not isinstance(payload, dict) or not payload.get("symbol"):
+            return
+        timeframe = str(payload.get("timeframe") or "M1").upper()
+        try:
+            self._get_or_create(payload["symbol"], timeframe).append(payload)
+        except (TypeError, KeyError, ValueError):
+            pass
+
+    def add_history(self, history: Optional[dict]):
+        if history:
+            self._get_or_create(history["symbol"], history["timeframe"]).merge(history["columns"])
+
+    def get(self, symbol: str, timeframe: str) -> Optional[BarSeries]:
+        return self._series.get((symbol, timeframe.upper()))
+
+    def list_series(self) -> list:
+        return [
+            {"symbol": sym, "timeframe": tf, "count": len(s),
+             "first": s.cols["time"][0] if len(s) else None,
+             "last": s.cols["time"][-1] if len(s) else None}
+            for (sym, tf), s in self._series.items()
+        ]
+
+    def dump(self) -> list:
+        """Séries serializáveis em JSON (colunas little-endian em base64)."""
+        return [
+            {"symbol": sym, "timeframe": tf,
+             "columns": {c: base64.b64encode(_le_bytes(s.cols[c])).decode("ascii") for c in COLUMNS}}
+            for (sym, tf), s in self._series.items() if len(s)
+        ]
+
+    def load(self, data: list):
+        for entry in data:
+            columns = {}
+            for c in COLUMNS:
+                col = array(_TYPECODES[c])
+                col.frombytes(base64.b64decode(entry["columns"][c]))
+                if sys.byteorder != "little":
+                    col.byteswap()
+                columns[c] = col
+            self._get_or_create(entry["symbol"], entry["timeframe"]).merge(columns)
+
+
+def _le_bytes(col: array) -> bytes:
+    if sys.byteorder == "little":
+        return col.tobytes()
+    swapped = array(col.typecode, col)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+def to_raw(series: BarSeries, column: str, i: int, j: int) -> bytes:
+    """Coluna como bytes little-endian crus (int64 para time, float64 para o resto)."""
+    return _le_bytes(series.cols[column][i:j])
+
+
+def to_npy(series: BarSeries, column: str, i: int, j: int) -> bytes:
+    """Coluna no formato .npy (v1.0), legível por numpy.load/np.memmap."""
+    col = series.cols[column][i:j]
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (
+        _NPY_DESCR[col.typecode], len(col))
+    # Magic (6) + versão (2) + tamanho (2) + header + '\n' alinhado em 64 bytes
+    pad = (64 - (10 + len(header) + 1) % 64) % 64
+    header = header + " " * pad + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1") + _le_bytes(col)
+
+
+def to_npz(series: BarSeries, columns: Iterable[str], i: int, j: int) -> bytes:
+    """
+    Várias colunas num .npz sem compressão (cópia direta, sem deflate).
+    numpy.load não faz mmap de membros de .npz: quem quer mmap_mode deve
+    pedir uma coluna em .npy (`format=npy`) ou extrair os .npy do zip.
+    """
+    import io
+    import zipfile
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        for column in columns:
+            zf.writestr(f"{column}.npy", to_npy(series, column, i, j))
+    return buf.getvalue()
+
+
+bar_resampler = BarResampler()
+bar_store = BarStore()
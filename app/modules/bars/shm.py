@@ -0,0 +1,190 @@
+"""
+OTS Hub — Ring buffer de barras em memória compartilhada
+
+Caminho rápido para preditors na mesma máquina: um ring SPMC (um
+produtor, vários consumidores) por (symbol, timeframe) em
+`multiprocessing.shared_memory`, com registros de tamanho fixo. Cada
+namespace tem seus rings (ver `ring_name`).
+
+O Hub é o único produtor: ao rotear um `bar`, grava o registro no ring
+(O(1), sem JSON) e continua publicando o envelope `bar` normal para os
+assinantes remotos. Preditors locais que declaram `"shm_bars": true` no
+auth deixam de receber `bar` base pelo socket e leem direto do ring.
+
+Layout (little-endian):
+  header (64 bytes): magic u32 | version u16 | record_size u16 | capacity u32 |
+                     pad u32 | write_seq u64 | pad
+  registro (64 bytes): seq u64 | time i64 | open | high | low | close | volume (f64)
+
+Protocolo de sequência: o registro n (n >= 1) fica no slot (n - 1) % capacity.
+O produtor zera `seq` do slot, grava os campos, grava `seq = n` e por fim
+`write_seq = n`. O leitor confere `seq` antes e depois da cópia; se mudou
+ou difere do esperado, o registro foi sobrescrito (overrun).
+"""
+
+import logging
+import re
+import struct
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("hub.shm")
+
+MAGIC = 0x4253544F  # "OTSB"
+VERSION = 1
+HEADER = struct.Struct("<IHHIIQ")
+HEADER_SIZE = 64
+WRITE_SEQ_OFFSET = 16
+RECORD = struct.Struct("<Qqddddd")
+RECORD_SIZE = 64
+_SEQ = struct.Struct("<Q")
+
+
+def ring_name(symbol: str, timeframe: str, namespace: str = "default") -> str:
+    """Nome do segmento: `ots_bars_<symbol>_<tf>` no default, `ots_bars.<ns>.<symbol>_<tf>` nos demais."""
+    safe = re.sub(r"[^A-Za-z0-9]", "_", f"{symbol}_{timeframe}")
+    if not namespace or namespace == "default":
+        return f"ots_bars_{safe}"
+    return f"ots_bars.{re.sub(r'[^A-Za-z0-9]', '_', namespace)}.{safe}"
+
+
+class BarRing:
+    """Produtor: cria o segmento e grava barras."""
+
+    def __init__(self, symbol: str, timeframe: str, capacity: int, namespace: str = "default"):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.capacity = capacity
+        self.name = ring_name(symbol, timeframe, namespace)
+        from multiprocessing import shared_memory
+        size = HEADER_SIZE + capacity * RECORD_SIZE
+        try:
+            self._shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        except FileExistsError:
+            # Sobra de uma execução anterior: recria do zero
+            stale = shared_memory.SharedMemory(name=self.name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        self._buf = self._shm.buf
+        HEADER.pack_into(self._buf, 0, MAGIC, VERSION, RECORD_SIZE, capacity, 0, 0)
+        self.write_seq = 0
+
+    def write(self, t: int, o: float, h: float, l: float, c: float, v: float):
+        n = self.write_seq + 1
+        offset = HEADER_SIZE + ((n - 1) % self.capacity) * RECORD_SIZE
+        RECORD.pack_into(self._buf, offset, 0, t, o, h, l, c, v)
+        _SEQ.pack_into(self._buf, offset, n)
+        _SEQ.pack_into(self._buf, WRITE_SEQ_OFFSET, n)
+        self.write_seq = n
+
+    def info(self) -> dict:
+        return {
+            "symbol": self.symbol, "timeframe": self.timeframe, "name": self.name,
+            "capacity": self.capacity, "record_size": RECORD_SIZE,
+            "header_size": HEADER_SIZE, "write_seq": self.write_seq,
+        }
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class BarRingReader:
+    """
+    Consumidor (lado do preditor). Só depende da stdlib.
+
+    `read()` retorna (barras novas, perdidas por overrun). Cada barra é
+    uma tupla (seq, time, open, high, low, close, volume).
+    """
+
+    def __init__(self, name: str, from_latest: bool = True):
+        from multiprocessing import shared_memory
+        self._shm = shared_memory.SharedMemory(name=name)
+        try:
+            # Python < 3.13 registra também quem só anexa; evita unlink na saída
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        except Exception:
+            pass
+        self._buf = self._shm.buf
+        magic, version, record_size, capacity, _, write_seq = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            self.close()
+            raise ValueError(f"Invalid bar ring: {name}")
+        self.capacity = capacity
+        self.next_seq = write_seq + 1 if from_latest else max(1, write_seq - capacity + 1)
+
+    def read(self, max_records: Optional[int] = None) -> Tuple[List[tuple], int]:
+        write_seq = _SEQ.unpack_from(self._buf, WRITE_SEQ_OFFSET)[0]
+        lost = 0
+        if write_seq - self.next_seq + 1 > self.capacity:
+            oldest = write_seq - self.capacity + 1
+            lost += oldest - self.next_seq
+            self.next_seq = oldest
+
+        out = []
+        while self.next_seq <= write_seq and (max_records is None or len(out) < max_records):
+            n = self.next_seq
+            offset = HEADER_SIZE + ((n - 1) % self.capacity) * RECORD_SIZE
+            record = RECORD.unpack_from(self._buf, offset)
+            if record[0] != n or _SEQ.unpack_from(self._buf, offset)[0] != n:
+                # Sobrescrito durante a leitura: pula para o mais antigo válido
+                write_seq = _SEQ.unpack_from(self._buf, WRITE_SEQ_OFFSET)[0]
+                oldest = max(n + 1, write_seq - self.capacity + 1)
+                lost += oldest - n
+                self.next_seq = oldest
+                continue
+            out.append(record)
+            self.next_seq = n + 1
+        return out, lost
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+
+class SharedBarRings:
+    """Rings de um namespace do Hub, criados sob demanda por (symbol, timeframe)."""
+
+    def __init__(self, namespace: str = "default"):
+        self.namespace = namespace
+        self._rings: Dict[Tuple[str, str], BarRing] = {}
+
+    def publish(self, bar: dict, capacity: int) -> bool:
+        """Grava a barra no ring do seu (symbol, timeframe). False se inválida."""
+        symbol = bar.get("symbol") if isinstance(bar, dict) else None
+        if not symbol:
+            return False
+        try:
+            values = (int(bar.get("time", bar.get("timestamp"))),
+                      float(bar["open"]), float(bar["high"]), float(bar["low"]),
+                      float(bar["close"]), float(bar.get("volume", 0) or 0))
+        except (TypeError, KeyError, ValueError):
+            return False
+        timeframe = str(bar.get("timeframe") or "M1").upper()
+        key = (symbol, timeframe)
+        ring = self._rings.get(key)
+        if ring is None:
+            try:
+                ring = self._rings[key] = BarRing(symbol, timeframe, capacity, self.namespace)
+            except OSError as e:
+                logger.error(f"Shared memory ring {symbol}/{timeframe} failed: {e}")
+                return False
+            logger.info(f"Shared memory ring created: {ring.name} (capacity={capacity})")
+        ring.write(*values)
+        return True
+
+    def list_rings(self) -> list:
+        return [ring.info() for ring in self._rings.values()]
+
+    def close(self):
+        for ring in self._rings.values():
+            ring.close()
+        self._rings.clear()
+
+
+shared_bar_rings = SharedBarRings()
@@ -3,12 +3,23 @@ OTS Hub — Commands Module
 
 Gerencia comandos enviados pelo admin/dashboard para os processos.
 O Hub atua como proxy: recebe comando → roteia para target → coleta ack.
+
+Todo comando entra no CommandLog (auditoria): log limitado com índices
+secundários por target, origin, action e status, consultável por janela
+de tempo e paginado sem varrer o log inteiro. A latência de ida e volta
+(envio → ack) é registrada por action.
 """
 
 import logging
 import uuid
 import time
-from typing import Dict, Optional
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.modules.events.service import event_bus
+from app.modules.metrics.service import Metrics, metrics
+from app.modules.store.service import local_store
 
 logger = logging.getLogger("hub.commands")
 
@@ -28,13 +39,133 @@ VALID_ACTIONS = {
 }
 
 
+class CommandLog:
+    """
+    Log de auditoria limitado a `capacity` registros (FIFO).
+
+    Cada registro ganha um `seq` crescente. Os índices são listas de seq
+    ordenadas por valor de campo; consultas partem do menor índice que
+    casa com os filtros, recortado por bisect (janela de tempo e cursor
+    `before`), e percorrem só esse trecho do mais novo ao mais antigo.
+    Registros expulsos ficam como prefixo morto das listas (seq < _first)
+    até a compactação amortizada.
+    """
+
+    INDEXED = ("target", "origin", "action", "status")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._entries: Dict[int, dict] = {}
+        self._by_id: Dict[str, int] = {}
+        self._seqs: List[int] = []
+        self._times: List[float] = []
+        self._index: Dict[str, Dict[str, List[int]]] = {f: {} for f in self.INDEXED}
+        self._next_seq = 0
+        self._first = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, record: dict) -> dict:
+        seq = self._next_seq
+        self._next_seq += 1
+        record["seq"] = seq
+        self._entries[seq] = record
+        self._by_id[record["id"]] = seq
+        self._seqs.append(seq)
+        # Tempo monotônico para o bisect (relógio de parede pode recuar)
+        sent_at = record["sent_at"]
+        self._times.append(max(sent_at, self._times[-1]) if self._times else sent_at)
+        for field in self.INDEXED:
+            self._index[field].setdefault(record[field], []).append(seq)
+        while len(self._entries) > self.capacity:
+            self._evict()
+        return record
+
+    def _evict(self):
+        record = self._entries.pop(self._first)
+        if self._by_id.get(record["id"]) == self._first:
+            del self._by_id[record["id"]]
+        self._first += 1
+        if len(self._seqs) - len(self._entries) > max(self.capacity // 4, 1):
+            self._compact()
+
+    def _compact(self):
+        cut = bisect_left(self._seqs, self._first)
+        del self._seqs[:cut]
+        del self._times[:cut]
+        for index in self._index.values():
+            for value in list(index):
+                seqs = index[value]
+                del seqs[:bisect_left(seqs, self._first)]
+                if not seqs:
+                    del index[value]
+
+    def get(self, cmd_id: str) -> Optional[dict]:
+        seq = self._by_id.get(cmd_id)
+        return self._entries.get(seq) if seq is not None else None
+
+    def update(self, cmd_id: str, **fields) -> Optional[dict]:
+        record = self.get(cmd_id)
+        if record is None:
+            return None
+        status = fields.get("status")
+        if status is not None and status != record["status"]:
+            old = self._index["status"].get(record["status"], [])
+            i = bisect_left(old, record["seq"])
+            if i < len(old) and old[i] == record["seq"]:
+                del old[i]
+            insort(self._index["status"].setdefault(status, []), record["seq"])
+        record.update(fields)
+        return record
+
+    def _seq_at(self, ts: float) -> int:
+        i = bisect_left(self._times, ts)
+        return self._seqs[i] if i < len(self._seqs) else self._next_seq
+
+    def query(self, target: Optional[str] = None, origin: Optional[str] = None,
+              action: Optional[str] = None, status: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              before: Optional[int] = None, limit: int = 50) -> Tuple[list, Optional[int]]:
+        """Registros do mais novo ao mais antigo + cursor `before` da próxima página."""
+        filters = {f: v for f, v in (("target", target), ("origin", origin),
+                                     ("action", action), ("status", status)) if v is not None}
+        if filters:
+            candidates = min((self._index[f].get(v, []) for f, v in filters.items()), key=len)
+        else:
+            candidates = self._seqs
+
+        lo = bisect_left(candidates, self._first)
+        if since is not None:
+            lo = max(lo, bisect_left(candidates, self._seq_at(since)))
+        hi = len(candidates)
+        if until is not None:
+            hi = min(hi, bisect_left(candidates, self._seq_at(until)))
+        if before is not None:
+            hi = min(hi, bisect_left(candidates, before))
+
+        page: list = []
+        for i in range(hi - 1, lo - 1, -1):
+            record = self._entries[candidates[i]]
+            if all(record[f] == v for f, v in filters.items()):
+                if len(page) == limit:
+                    return page, page[-1]["seq"]
+                page.append(record)
+        return page, None
+
+    def records(self) -> list:
+        return list(self._entries.values())
+
+
 class CommandRouter:
     """Roteia comandos do admin para processos conectados."""
 
     def __init__(self):
         self._pending: Dict[str, dict] = {}
         self._msg_id_map: Dict[str, str] = {}
-        self._history: list = []
+        self._log = CommandLog(settings.COMMAND_LOG_SIZE)
+        # Latência envio → ack por action (ms)
+        self._rtt = Metrics()
 
     def create_command(
         self,
@@ -68,7 +199,15 @@ class CommandRouter:
         }
         if original_msg_id:
             self._msg_id_map[cmd_id] = original_msg_id
+        self._log.add({
+            "id": cmd_id, "target": target_instance, "origin": origin_id, "action": action,
+            "params": params or {}, "status": "pending", "sent_at": envelope["timestamp"],
+            "acked_at": None, "latency_ms": None, "ack_from": None, "result": None,
+        })
 
+        event_bus.publish("command", {
+            "id": cmd_id, "target": target_instance, "action": action, "state": "pending",
+        })
         return envelope
 
     def process_ack(self, instance_id: str, ack_payload: dict) -> tuple[Optional[str], Optional[dict]]:
@@ -84,11 +223,22 @@ class CommandRouter:
             "received_at": time.time(),
         }
 
-        self._history.append(pending)
-        if len(self._history) > 100:
-            self._history = self._history[-100:]
+        action = pending["command"]["payload"]["action"]
+        latency_ms = (pending["ack"]["received_at"] - pending["sent_at"]) * 1000
+        self._rtt.observe(action, latency_ms)
+        metrics.observe("command.rtt_ms", latency_ms)
+        ack = pending["ack"]
+        self._log.update(ref_id, status=ack["status"], acked_at=ack["received_at"],
+                         latency_ms=round(latency_ms, 3), ack_from=instance_id,
+                         result=ack["result"])
+        local_store.add_command(pending)
 
         logger.info(f"Ack received: {ref_id} from {instance_id} status={ack_payload.get('status')}")
+        event_bus.publish("command", {
+            "id": ref_id, "target": pending["target"],
+            "action": pending["command"]["payload"]["action"],
+            "state": "acked", "status": pending["ack"]["status"],
+        })
 
         original_msg_id = self._msg_id_map.pop(ref_id, None)
         if original_msg_id:
@@ -96,6 +246,10 @@ class CommandRouter:
 
         return pending["origin"], ack_payload
 
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
     def get_pending(self) -> list:
         return [
             {"id": k, "target": v["target"], "action": v["command"]["payload"]["action"]}
@@ -103,14 +257,39 @@ class CommandRouter:
         ]
 
     def get_history(self, limit: int = 20) -> list:
-        return self._history[-limit:]
+        return self._log.query(limit=limit)[0]
+
+    def query_log(self, **filters) -> Tuple[list, Optional[int]]:
+        return self._log.query(**filters)
+
+    def latency(self) -> Dict[str, dict]:
+        """Percentis de latência envio → ack por action (janela recente)."""
+        return self._rtt.snapshot()["latency"]
+
+    def dump(self) -> dict:
+        return {"pending": self._pending, "msg_id_map": self._msg_id_map,
+                "log": self._log.records()}
+
+    def load(self, data: dict):
+        self._pending.update(data.get("pending", {}))
+        self._msg_id_map.update(data.get("msg_id_map", {}))
+        for record in data.get("log", []):
+            if self._log.get(record["id"]) is None:
+                self._log.add(dict(record))
 
     def cleanup_stale(self, timeout: float = 30.0):
         now = time.time()
         expired = [k for k, v in self._pending.items() if now - v["sent_at"] > timeout]
         for k in expired:
-            self._pending.pop(k)
+            v = self._pending.pop(k)
+            self._msg_id_map.pop(k, None)
+            local_store.add_command({**v, "state": "expired"})
+            self._log.update(k, status="expired")
             logger.warning(f"Command {k} expired (no ack)")
+            event_bus.publish("command", {
+                "id": k, "target": v["target"],
+                "action": v["command"]["payload"]["action"], "state": "expired",
+            })
 
 
 command_router = CommandRouter()
@@ -0,0 +1,69 @@
+"""
+OTS Hub — Events Module
+
+Barramento de eventos de mudança de estado do Hub (conexões, telemetria,
+comandos). Alimenta o stream SSE dos dashboards e a versão usada como
+ETag nos endpoints de status.
+"""
+
+import asyncio
+import logging
+from typing import Optional, Set, Tuple
+
+logger = logging.getLogger("hub.events")
+
+
+class Subscription:
+    """Fila de eventos de um assinante (ex: cliente SSE)."""
+
+    def __init__(self, maxsize: int):
+        self.queue: "asyncio.Queue[Tuple[int, str, dict]]" = asyncio.Queue(maxsize=maxsize)
+        # Setado quando a fila estoura: o assinante deve pedir novo snapshot
+        self.resync: bool = False
+
+    def push(self, version: int, event: str, data: dict):
+        if self.resync:
+            return
+        try:
+            self.queue.put_nowait((version, event, data))
+        except asyncio.QueueFull:
+            self.resync = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            # Acorda o consumidor para que ele faça o resync
+            self.queue.put_nowait((version, "resync", {}))
+
+    async def next(self, timeout: Optional[float] = None) -> Optional[Tuple[int, str, dict]]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBus:
+    """Publica eventos de mudança e mantém uma versão monotônica do estado."""
+
+    def __init__(self, queue_size: int = 1000):
+        self.version: int = 0
+        self._queue_size = queue_size
+        self._subscribers: Set[Subscription] = set()
+
+    def publish(self, event: str, data: dict):
+        self.version += 1
+        for sub in self._subscribers:
+            sub.push(self.version, event, data)
+
+    def subscribe(self) -> Subscription:
+        sub = Subscription(self._queue_size)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self._subscribers.discard(sub)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+
+event_bus = EventBus()
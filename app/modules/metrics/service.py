@@ -0,0 +1,61 @@
+"""
+OTS Hub — Metrics Module
+
+Contadores e amostras de latência em memória (janela deslizante),
+expostos via REST para dashboards/monitoramento.
+"""
+
+import logging
+from collections import defaultdict, deque
+from typing import Deque, Dict
+
+logger = logging.getLogger("hub.metrics")
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class Metrics:
+    """Registro de contadores e latências (últimas `window` amostras por nome)."""
+
+    def __init__(self, window: int = 1024):
+        self._window = window
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def incr(self, name: str, value: int = 1):
+        self._counters[name] += value
+
+    def observe(self, name: str, value: float):
+        samples = self._samples.get(name)
+        if samples is None:
+            samples = self._samples[name] = deque(maxlen=self._window)
+        samples.append(value)
+
+    def counter(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def summary(self, name: str) -> dict:
+        values = sorted(self._samples.get(name, ()))
+        if not values:
+            return {"count": 0}
+        return {
+            "count": len(values),
+            "p50": round(_percentile(values, 50), 3),
+            "p95": round(_percentile(values, 95), 3),
+            "p99": round(_percentile(values, 99), 3),
+            "max": round(values[-1], 3),
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self._counters),
+            "latency": {name: self.summary(name) for name in self._samples},
+        }
+
+
+metrics = Metrics()
@@ -0,0 +1,113 @@
+"""
+OTS Hub — Snapshot Module
+
+Persiste o estado em memória do Hub num arquivo local (JSON gzip) no
+restart e o restaura no startup seguinte: telemetria mais recente,
+comandos pendentes/histórico, estado de conta/posições e séries de
+barras. Assim o processo novo já responde late-join e acks de comandos
+emitidos antes do restart.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from app.core.config import settings
+from app.modules.bars.service import bar_store
+from app.modules.commands.service import command_router
+from app.modules.state.service import state_store
+from app.modules.telemetry.service import telemetry_store
+from app.websockets.namespaces import namespaces
+
+logger = logging.getLogger("hub.snapshot")
+
+SNAPSHOT_FORMAT = 1
+
+# Nome no arquivo → store com dump()/load()
+_STORES = {
+    "telemetry": telemetry_store,
+    "commands": command_router,
+    "state": state_store,
+    "bars": bar_store,
+    # Telemetria e comandos dos namespaces além do default
+    "namespaces": namespaces,
+}
+
+
+class HubSnapshot:
+    """Coleta, grava e restaura o estado dos stores do Hub."""
+
+    def __init__(self):
+        self.written_at: Optional[float] = None
+        self.restored_from: Optional[float] = None
+
+    @staticmethod
+    def collect() -> dict:
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "version": settings.VERSION,
+            "created_at": time.time(),
+            "stores": {name: store.dump() for name, store in _STORES.items()},
+        }
+
+    @staticmethod
+    def _write(path: str, payload: bytes):
+        import gzip
+        tmp = f"{path}.tmp"
+        with gzip.open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+
+    async def write(self, path: Optional[str] = None) -> bool:
+        """
+        Serializa no loop e grava em thread (atômico).
+
+        collect() devolve os dicts vivos dos stores: o JSON é gerado antes
+        de sair do loop, para o roteamento não mutá-los durante a leitura.
+        Só a compressão e a escrita vão para a thread.
+        """
+        path = path if path is not None else settings.HUB_SNAPSHOT_PATH
+        if not path:
+            return False
+        data = self.collect()
+        try:
+            payload = json.dumps(data, separators=(",", ":")).encode("utf-8")
+            await asyncio.to_thread(self._write, path, payload)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Hub snapshot write failed ({path}): {e}")
+            return False
+        self.written_at = data["created_at"]
+        logger.info(f"Hub snapshot written to {path}")
+        return True
+
+    def restore(self, path: Optional[str] = None) -> bool:
+        """Restaura se existir e tiver menos de HUB_SNAPSHOT_MAX_AGE_S."""
+        import gzip
+        path = path if path is not None else settings.HUB_SNAPSHOT_PATH
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            age = time.time() - data["created_at"]
+            if data.get("format") != SNAPSHOT_FORMAT or age > settings.HUB_SNAPSHOT_MAX_AGE_S:
+                logger.info(f"Hub snapshot ignored (format={data.get('format')}, age={age:.0f}s)")
+                return False
+            for name, store in _STORES.items():
+                if name in data["stores"]:
+                    store.load(data["stores"][name])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Hub snapshot unreadable ({path}): {e}")
+            return False
+        self.restored_from = data["created_at"]
+        logger.info(f"Hub snapshot restored (age={age:.1f}s)")
+        return True
+
+    def info(self) -> dict:
+        return {"written_at": self.written_at, "restored_from": self.restored_from}
+
+
+hub_snapshot = HubSnapshot()
@@ -0,0 +1,110 @@
+"""
+OTS Hub — State Module
+
+Visão materializada do estado de conta e posições abertas por connector.
+Atualizada incrementalmente a partir de account_update, position_event e
+order_result roteados; enviada como snapshot para executors/dashboards
+logo após o auth (evita get_account/get_positions a cada reconexão).
+"""
+
+import logging
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger("hub.state")
+
+# Status de position_event/order_result que encerram uma posição
+_CLOSE_STATUSES = {"closed", "close", "sl", "tp", "stop_loss", "take_profit", "removed"}
+
+
+def _position_key(data: dict) -> Optional[str]:
+    key = data.get("ticket") or data.get("position_id")
+    return str(key) if key is not None else None
+
+
+class StateStore:
+    """Último estado de conta + posições abertas por connector."""
+
+    def __init__(self):
+        self._accounts: Dict[str, dict] = {}
+        self._positions: Dict[str, Dict[str, dict]] = {}
+        self._updated_at: Dict[str, float] = {}
+
+    def apply(self, msg_type: str, instance_id: str, payload: dict):
+        """Aplica mensagem roteada ao estado do connector `instance_id`."""
+        if not isinstance(payload, dict):
+            return
+        if msg_type == "account_update":
+            self._apply_account(instance_id, payload)
+        elif msg_type == "position_event":
+            self._apply_position(instance_id, payload)
+        elif msg_type == "order_result":
+            self._apply_order_result(instance_id, payload)
+        else:
+            return
+        self._updated_at[instance_id] = time.time()
+
+    def _apply_account(self, instance_id: str, payload: dict):
+        account = {k: v for k, v in payload.items() if k != "positions"}
+        self._accounts[instance_id] = {**self._accounts.get(instance_id, {}), **account}
+        # account_update com lista completa de posições substitui o conjunto
+        if isinstance(payload.get("positions"), list):
+            positions = {}
+            for pos in payload["positions"]:
+                key = _position_key(pos) if isinstance(pos, dict) else None
+                if key:
+                    positions[key] = pos
+            self._positions[instance_id] = positions
+
+    def _apply_position(self, instance_id: str, payload: dict):
+        key = _position_key(payload)
+        if not key:
+            return
+        positions = self._positions.setdefault(instance_id, {})
+        status = str(payload.get("status") or payload.get("event") or "").lower()
+        if status in _CLOSE_STATUSES:
+            positions.pop(key, None)
+        else:
+            positions[key] = {**positions.get(key, {}), **payload}
+
+    def _apply_order_result(self, instance_id: str, payload: dict):
+        if not payload.get("success"):
+            return
+        key = _position_key(payload)
+        if not key:
+            return
+        positions = self._positions.setdefault(instance_id, {})
+        action = str(payload.get("action") or "").lower()
+        if action.startswith("close") or action in _CLOSE_STATUSES:
+            positions.pop(key, None)
+        else:
+            positions[key] = {**positions.get(key, {}), **payload}
+
+    def get(self, instance_id: str) -> Optional[dict]:
+        if instance_id not in self._updated_at:
+            return None
+        return {
+            "account": self._accounts.get(instance_id),
+            "positions": list(self._positions.get(instance_id, {}).values()),
+            "updated_at": self._updated_at[instance_id],
+        }
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {iid: self.get(iid) for iid in self._updated_at}
+
+    def dump(self) -> dict:
+        return {"accounts": self._accounts, "positions": self._positions,
+                "updated_at": self._updated_at}
+
+    def load(self, data: dict):
+        self._accounts.update(data.get("accounts", {}))
+        self._positions.update(data.get("positions", {}))
+        self._updated_at.update(data.get("updated_at", {}))
+
+    def remove(self, instance_id: str):
+        self._accounts.pop(instance_id, None)
+        self._positions.pop(instance_id, None)
+        self._updated_at.pop(instance_id, None)
+
+
+state_store = StateStore()
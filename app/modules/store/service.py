@@ -0,0 +1,365 @@
+"""
+OTS Hub — Local Store Module
+
+Store embarcado (SQLite em modo WAL) com escrita write-behind para
+amostras de telemetria e comandos concluídos (ack ou expirados).
+
+- Rotas só enfileiram em memória (sem serializar); uma task grava em
+  lotes numa thread, que gera o JSON das linhas (a cada
+  LOCAL_STORE_FLUSH_MS ou ao atingir LOCAL_STORE_BATCH)
+- Consultas indexadas por instância, action e tempo (REST /api/v1/history)
+- Lote que falha LOCAL_STORE_MAX_RETRIES vezes é regravado linha a
+  linha; só as linhas que ainda falham são descartadas (quarentena), para
+  uma linha inválida não travar a fila
+- Replicador opcional: sobe ao Supabase as linhas pendentes quando ele
+  está configurado e acessível; falhas só adiam o envio, nada se perde.
+  O envio é upsert por chave estável (cmd_id / sample_id), então reenviar
+  um lote após um crash entre o upsert e a marcação não duplica linhas
+- Retenção local de LOCAL_STORE_RETENTION_DAYS (só linhas já replicadas
+  ou que não vão para o Supabase)
+
+Telemetria: toda amostra é gravada localmente; só as amostradas para o
+Supabase (1 a cada 30 s por instância) ficam pendentes de replicação.
+Comandos ficam pendentes só com o Supabase configurado.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from app.core.config import settings
+from app.core.database import get_supabase, supabase_configured
+from app.modules.metrics.service import metrics
+
+logger = logging.getLogger("hub.store")
+
+# replicated: NULL = só local, 0 = pendente, 1 = replicado
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS telemetry (
+    id INTEGER PRIMARY KEY,
+    instance_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    balance REAL,
+    equity REAL,
+    status TEXT,
+    data TEXT NOT NULL,
+    replicated INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_telemetry_instance_ts ON telemetry (instance_id, ts);
+CREATE INDEX IF NOT EXISTS ix_telemetry_ts ON telemetry (ts);
+CREATE INDEX IF NOT EXISTS ix_telemetry_pending ON telemetry (replicated) WHERE replicated = 0;
+
+CREATE TABLE IF NOT EXISTS commands (
+    id TEXT PRIMARY KEY,
+    target TEXT,
+    origin TEXT,
+    action TEXT,
+    status TEXT,
+    sent_at REAL,
+    acked_at REAL,
+    data TEXT NOT NULL,
+    replicated INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_commands_target_ts ON commands (target, sent_at);
+CREATE INDEX IF NOT EXISTS ix_commands_origin_ts ON commands (origin, sent_at);
+CREATE INDEX IF NOT EXISTS ix_commands_action_ts ON commands (action, sent_at);
+CREATE INDEX IF NOT EXISTS ix_commands_ts ON commands (sent_at);
+CREATE INDEX IF NOT EXISTS ix_commands_pending ON commands (replicated) WHERE replicated = 0;
+"""
+
+_REPLICATE_BATCH = 500
+
+
+def _telemetry_row(sample: dict, replicate: bool) -> tuple:
+    return (sample["instance_id"], sample["server_ts"], sample.get("balance"),
+            sample.get("equity"), sample.get("status"), json.dumps(sample, default=str),
+            0 if replicate else None)
+
+
+def _command_row(entry: dict, replicate: bool) -> tuple:
+    command = entry["command"]
+    ack = entry.get("ack") or {}
+    return (command["id"], entry.get("target"), entry.get("origin"),
+            command["payload"]["action"], ack.get("status") or entry.get("state"),
+            entry.get("sent_at"), ack.get("received_at"), json.dumps(entry, default=str),
+            0 if replicate else None)
+
+
+class LocalStore:
+    """Write-behind em SQLite; toda E/S em thread, fora do event loop."""
+
+    def __init__(self):
+        # (amostra/entrada, replicar): as linhas são montadas na thread de escrita
+        self._telemetry: List[tuple] = []
+        self._commands: List[tuple] = []
+        self._conn = None
+        self._path: Optional[str] = None
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.written: int = 0
+        self.dropped: int = 0
+        self.replicated: int = 0
+        self.quarantined: int = 0
+        # Falhas seguidas do lote na cabeça da fila
+        self._failures: int = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.LOCAL_STORE_PATH)
+
+    @property
+    def queued(self) -> int:
+        return len(self._telemetry) + len(self._commands)
+
+    # ── Enfileiramento (event loop, O(1)) ─────────────────
+    # Amostras e entradas concluídas não são mais alteradas depois de
+    # enfileiradas, então o JSON pode ser gerado na thread de escrita.
+
+    def add_telemetry(self, sample: dict, replicate: bool = False):
+        self._enqueue(self._telemetry, (sample, replicate))
+
+    def add_command(self, entry: dict):
+        self._enqueue(self._commands, (entry, supabase_configured()))
+
+    def _enqueue(self, queue: list, row: tuple):
+        if self.queued >= settings.LOCAL_STORE_MAX_QUEUE:
+            self.dropped += 1
+            metrics.incr("store.dropped")
+            return
+        queue.append(row)
+        if self._wakeup and self.queued >= settings.LOCAL_STORE_BATCH:
+            self._wakeup.set()
+
+    # ── SQLite (thread) ───────────────────────────────────
+
+    def _db(self):
+        path = settings.LOCAL_STORE_PATH
+        if self._conn is None or self._path != path:
+            import sqlite3
+            if self._conn is not None:
+                self._conn.close()
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn, self._path = conn, path
+        return self._conn
+
+    def _write(self, telemetry: List[tuple], commands: List[tuple]):
+        telemetry = [_telemetry_row(sample, replicate) for sample, replicate in telemetry]
+        commands = [_command_row(entry, replicate) for entry, replicate in commands]
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN")
+            try:
+                if telemetry:
+                    db.executemany(
+                        "INSERT INTO telemetry (instance_id, ts, balance, equity, status, data, replicated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", telemetry)
+                if commands:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO commands "
+                        "(id, target, origin, action, status, sent_at, acked_at, data, replicated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", commands)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def _write_each(self, telemetry: List[tuple], commands: List[tuple]) -> int:
+        """Grava linha a linha, descartando as que falham. Retorna as gravadas."""
+        written = 0
+        for row in telemetry:
+            try:
+                self._write([row], [])
+                written += 1
+            except Exception as e:
+                logger.error(f"Local store quarantined telemetry row: {e}")
+        for row in commands:
+            try:
+                self._write([], [row])
+                written += 1
+            except Exception as e:
+                logger.error(f"Local store quarantined command row: {e}")
+        return written
+
+    async def flush(self) -> int:
+        """
+        Grava o que está na fila. Em falha, devolve o lote à fila; depois de
+        LOCAL_STORE_MAX_RETRIES falhas seguidas, grava linha a linha e
+        descarta as que continuam falhando.
+        """
+        if not self.enabled or not self.queued:
+            return 0
+        telemetry, self._telemetry = self._telemetry, []
+        commands, self._commands = self._commands, []
+        total = len(telemetry) + len(commands)
+        try:
+            await asyncio.to_thread(self._write, telemetry, commands)
+            count = total
+        except Exception as e:
+            self.last_error = str(e)
+            self._failures += 1
+            if self._failures < settings.LOCAL_STORE_MAX_RETRIES:
+                logger.error(f"Local store write failed ({self._failures}x): {e}")
+                self._telemetry[:0] = telemetry
+                self._commands[:0] = commands
+                return 0
+            count = await asyncio.to_thread(self._write_each, telemetry, commands)
+            self.quarantined += total - count
+            metrics.incr("store.quarantined", total - count)
+            logger.error(f"Local store dropped {total - count}/{total} rows "
+                         f"after {self._failures} failed writes: {e}")
+        self._failures = 0
+        self.written += count
+        metrics.incr("store.written", count)
+        return count
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       timeout=settings.LOCAL_STORE_FLUSH_MS / 1000.0)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    # ── Consultas ─────────────────────────────────────────
+
+    def _select(self, table: str, time_col: str, filters: dict,
+                since: Optional[float], until: Optional[float], limit: int) -> list:
+        clauses, params = [], []
+        for column, value in filters.items():
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append(f"{time_col} >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append(f"{time_col} < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT data FROM {table} {where} ORDER BY {time_col} DESC LIMIT ?"
+        with self._lock:
+            rows = self._db().execute(sql, (*params, limit)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    async def query_telemetry(self, instance_id: Optional[str] = None,
+                              since: Optional[float] = None, until: Optional[float] = None,
+                              limit: int = 100) -> list:
+        return await asyncio.to_thread(
+            self._select, "telemetry", "ts", {"instance_id": instance_id}, since, until, limit)
+
+    async def query_commands(self, target: Optional[str] = None, origin: Optional[str] = None,
+                             action: Optional[str] = None, status: Optional[str] = None,
+                             since: Optional[float] = None, until: Optional[float] = None,
+                             limit: int = 100) -> list:
+        filters = {"target": target, "origin": origin, "action": action, "status": status}
+        return await asyncio.to_thread(
+            self._select, "commands", "sent_at", filters, since, until, limit)
+
+    # ── Replicação para o Supabase (thread) ───────────────
+
+    def _replicate_once(self) -> int:
+        client = get_supabase()
+        if client is None:
+            return 0
+        total = 0
+        for table, remote, key, to_record in (
+            ("telemetry", "telemetry", "sample_id", lambda d: {
+                "sample_id": f"{d['instance_id']}:{d['server_ts']}",
+                "instance_id": d["instance_id"], "balance": d.get("balance"),
+                "equity": d.get("equity"), "status": d.get("status"), "raw_data": d}),
+            ("commands", "command_history", "cmd_id", lambda d: {
+                "cmd_id": d["command"]["id"], "target": d.get("target"),
+                "origin": d.get("origin"), "action": d["command"]["payload"]["action"],
+                "sent_at": d.get("sent_at"), "raw_data": d}),
+        ):
+            with self._lock:
+                rows = self._db().execute(
+                    f"SELECT rowid, data FROM {table} WHERE replicated = 0 LIMIT ?",
+                    (_REPLICATE_BATCH,)).fetchall()
+            if not rows:
+                continue
+            # Upsert: reenviar após crash antes do UPDATE abaixo não duplica
+            client.table(remote).upsert([to_record(json.loads(data)) for _, data in rows],
+                                        on_conflict=key).execute()
+            with self._lock:
+                self._db().executemany(f"UPDATE {table} SET replicated = 1 WHERE rowid = ?",
+                                       [(rowid,) for rowid, _ in rows])
+            total += len(rows)
+        return total
+
+    def _prune(self):
+        if settings.LOCAL_STORE_RETENTION_DAYS <= 0:
+            return
+        cutoff = time.time() - settings.LOCAL_STORE_RETENTION_DAYS * 86400
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM telemetry WHERE ts < ? AND (replicated IS NULL OR replicated = 1)",
+                       (cutoff,))
+            db.execute("DELETE FROM commands WHERE sent_at < ? AND (replicated IS NULL OR replicated = 1)",
+                       (cutoff,))
+
+    async def replicate(self) -> int:
+        if not self.enabled or not supabase_configured():
+            return 0
+        try:
+            count = await asyncio.to_thread(self._replicate_once)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning(f"Supabase replication deferred: {e}")
+            return 0
+        self.replicated += count
+        return count
+
+    async def _replicate_loop(self):
+        while True:
+            await asyncio.sleep(settings.LOCAL_STORE_REPLICATE_S)
+            await self.replicate()
+            try:
+                await asyncio.to_thread(self._prune)
+            except Exception as e:
+                logger.error(f"Local store prune failed: {e}")
+
+    # ── Ciclo de vida ─────────────────────────────────────
+
+    def start(self):
+        if not self.enabled or self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._flush_loop()),
+                       asyncio.create_task(self._replicate_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._wakeup = None
+        await self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def info(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "path": settings.LOCAL_STORE_PATH,
+            "queued": self.queued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "replicated": self.replicated,
+            "quarantined": self.quarantined,
+            "last_error": self.last_error,
+        }
+
+
+local_store = LocalStore()
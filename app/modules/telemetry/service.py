@@ -1,7 +1,8 @@
 """
 OTS Hub — Telemetry Module
 
-Recebe, cacheia e persiste telemetria dos processos.
+Recebe, cacheia e persiste telemetria dos processos (store local
+write-behind + replicação ao Supabase, ver app/modules/store).
 """
 
 import asyncio
@@ -10,7 +11,9 @@ import time
 from collections import defaultdict
 from typing import Dict, Optional
 
-from app.core.database import supabase
+from app.core.database import get_supabase, supabase_configured
+from app.modules.events.service import event_bus
+from app.modules.store.service import local_store
 
 logger = logging.getLogger("hub.telemetry")
 
@@ -31,12 +34,20 @@ class TelemetryStore:
         self._latest[instance_id] = enriched
         self._last_received[instance_id] = now
         self._counts[instance_id] += 1
+        event_bus.publish("telemetry", enriched)
 
-        if supabase:
+        upstream = False
+        if supabase_configured():
             last_persist = self._last_persist.get(instance_id, 0)
             if now - last_persist >= 30:
                 self._last_persist[instance_id] = now
-                asyncio.create_task(self._persist(enriched))
+                upstream = True
+
+        if local_store.enabled:
+            # Write-behind local; o replicador sobe as amostras marcadas
+            local_store.add_telemetry(enriched, replicate=upstream)
+        elif upstream:
+            asyncio.create_task(self._persist(enriched))
 
         return {"status": "ok", "count": self._counts[instance_id]}
 
@@ -50,13 +61,16 @@ class TelemetryStore:
                 "raw_data": data,
             }
             loop = asyncio.get_event_loop()
-            await loop.run_in_executor(
-                None,
-                lambda: supabase.table("telemetry").insert(record).execute()
-            )
+            await loop.run_in_executor(None, self._insert, record)
         except Exception as e:
             logger.error(f"Supabase persist failed: {e}")
 
+    @staticmethod
+    def _insert(record: dict):
+        client = get_supabase()
+        if client is not None:
+            client.table("telemetry").insert(record).execute()
+
     def get_latest(self, instance_id: str) -> Optional[dict]:
         return self._latest.get(instance_id)
 
@@ -67,8 +81,18 @@ class TelemetryStore:
         now = time.time()
         return [iid for iid, ts in self._last_received.items() if ts > now - 300]
 
+    def dump(self) -> dict:
+        return {"latest": self._latest, "last_received": self._last_received,
+                "counts": dict(self._counts)}
+
+    def load(self, data: dict):
+        self._latest.update(data.get("latest", {}))
+        self._last_received.update(data.get("last_received", {}))
+        self._counts.update(data.get("counts", {}))
+
     def remove(self, instance_id: str):
-        self._latest.pop(instance_id, None)
+        if self._latest.pop(instance_id, None) is not None:
+            event_bus.publish("telemetry_removed", {"instance_id": instance_id})
         self._last_received.pop(instance_id, None)
 
 
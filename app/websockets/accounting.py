@@ -0,0 +1,140 @@
+"""
+OTS Hub — Accounting por conexão (tráfego, memória e tamanho de frame)
+
+Por conexão (ConnectionInfo.stats): mensagens e bytes de entrada e saída
+por type, maior frame, bytes enfileirados (fila conflacionada + envios em
+andamento) e tempo médio de envio. Exposto em /api/v1/status
+(`connections[].traffic`) e em /api/v1/metrics (`traffic.*`, `send_ms`).
+
+Tamanho máximo de frame de entrada por role (MAX_FRAME_BYTES_BY_ROLE,
+default MAX_FRAME_BYTES; "unknown" = antes do auth), em bytes UTF-8. No
+transporte stream o limite vale já no cabeçalho, antes de bufferizar o
+corpo. No WebSocket o servidor recusa antes de bufferizar tudo acima de
+`ws_max_size()` (maior limite configurado, passado ao uvicorn por
+`python -m app.main`); limites menores da role são checados no router.
+
+Orçamento global (MEMORY_BUDGET_BYTES, 0 = desligado) sobre os bytes que
+o Hub segura para entrega: acima dele, broadcasts de baixa prioridade
+(telemetry, e qualquer type para dashboards) são descartados até a fila
+baixar. Ordens, sinais e barras para processos seguem entregues.
+"""
+
+import logging
+from typing import Dict, List
+
+from app.core.config import settings
+from app.modules.metrics.service import metrics
+
+logger = logging.getLogger("hub.accounting")
+
+# Tráfego descartado primeiro quando o orçamento de memória estoura
+LOW_PRIORITY_TYPES = {"telemetry"}
+LOW_PRIORITY_ROLES = {"dashboard"}
+
+_TYPE_PREFIX = '{"type": "'
+
+
+def message_type(text: str) -> str:
+    """Type de um envelope do Hub (json.dumps mantém "type" como 1ª chave)."""
+    if text.startswith(_TYPE_PREFIX):
+        end = text.find('"', len(_TYPE_PREFIX))
+        if end > 0:
+            return text[len(_TYPE_PREFIX):end]
+    return "other"
+
+
+def frame_limit(role: str) -> int:
+    """Tamanho máximo de frame de entrada para a role."""
+    return int(settings.MAX_FRAME_BYTES_BY_ROLE.get(role) or settings.MAX_FRAME_BYTES)
+
+
+def ws_max_size() -> int:
+    """Limite de frame do servidor WebSocket (o maior entre as roles)."""
+    return max([settings.MAX_FRAME_BYTES,
+                *(int(v) for v in settings.MAX_FRAME_BYTES_BY_ROLE.values() if v)])
+
+
+class MemoryBudget:
+    """Bytes retidos para entrega em todas as conexões."""
+
+    def __init__(self):
+        self.queued: int = 0
+        self.peak: int = 0
+        self.shed: int = 0
+
+    def exceeded(self) -> bool:
+        return 0 < settings.MEMORY_BUDGET_BYTES < self.queued
+
+    def should_shed(self, role: str, msg_type: str) -> bool:
+        if not self.exceeded():
+            return False
+        return role in LOW_PRIORITY_ROLES or msg_type in LOW_PRIORITY_TYPES
+
+    def info(self) -> dict:
+        return {"budget_bytes": settings.MEMORY_BUDGET_BYTES, "queued_bytes": self.queued,
+                "peak_bytes": self.peak, "exceeded": self.exceeded(), "shed": self.shed}
+
+
+memory_budget = MemoryBudget()
+
+
+class ConnectionStats:
+    """Contadores de tráfego de uma conexão."""
+
+    __slots__ = ("inbound", "outbound", "largest_in", "largest_out",
+                 "queued_bytes", "send_seconds", "sends", "shed")
+
+    def __init__(self):
+        # type → [mensagens, bytes]
+        self.inbound: Dict[str, List[int]] = {}
+        self.outbound: Dict[str, List[int]] = {}
+        self.largest_in: int = 0
+        self.largest_out: int = 0
+        self.queued_bytes: int = 0
+        self.send_seconds: float = 0.0
+        self.sends: int = 0
+        self.shed: int = 0
+
+    def record_in(self, msg_type: str, size: int):
+        entry = self.inbound.get(msg_type)
+        if entry is None:
+            entry = self.inbound[msg_type] = [0, 0]
+        entry[0] += 1
+        entry[1] += size
+        if size > self.largest_in:
+            self.largest_in = size
+        metrics.incr("traffic.bytes_in", size)
+
+    def record_out(self, msg_type: str, size: int, seconds: float):
+        entry = self.outbound.get(msg_type)
+        if entry is None:
+            entry = self.outbound[msg_type] = [0, 0]
+        entry[0] += 1
+        entry[1] += size
+        if size > self.largest_out:
+            self.largest_out = size
+        self.sends += 1
+        self.send_seconds += seconds
+        metrics.incr("traffic.bytes_out", size)
+        metrics.observe("send_ms", seconds * 1000.0)
+
+    def queue(self, size: int):
+        self.queued_bytes += size
+        memory_budget.queued += size
+        if memory_budget.queued > memory_budget.peak:
+            memory_budget.peak = memory_budget.queued
+
+    def dequeue(self, size: int):
+        self.queued_bytes -= size
+        memory_budget.queued -= size
+
+    def info(self) -> dict:
+        return {
+            "in": {t: {"messages": c, "bytes": b} for t, (c, b) in self.inbound.items()},
+            "out": {t: {"messages": c, "bytes": b} for t, (c, b) in self.outbound.items()},
+            "largest_in": self.largest_in,
+            "largest_out": self.largest_out,
+            "queued_bytes": self.queued_bytes,
+            "avg_send_ms": round(self.send_seconds / self.sends * 1000.0, 3) if self.sends else None,
+            "shed": self.shed,
+        }
@@ -0,0 +1,115 @@
+"""
+OTS Hub — Admission Control
+
+Limita handshakes simultâneos (accept + auth + snapshot de late-join) a
+HANDSHAKE_CONCURRENCY. Depois de um restart ou de uma queda do túnel
+todos os processos reconectam ao mesmo tempo; sem limite, o event loop
+atrasa os accepts e clientes estouram o AUTH_TIMEOUT e tentam de novo,
+piorando a tempestade.
+
+Os excedentes esperam numa fila por prioridade de role (connector e
+executor primeiro, dashboard por último), FIFO dentro da mesma
+prioridade. Quem espera mais que ADMISSION_WAIT_S é recusado com 1013
+(Try Again Later).
+
+A role vem antes do auth, do resume ticket válido (`?resume=` no
+WebSocket ou `payload.resume` no transporte stream). Sem ticket a role
+não é verificada — qualquer socket poderia se dizer connector e ocupar
+os slots até o AUTH_TIMEOUT —, então o handshake entra com a menor
+prioridade.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+from app.modules.auth.service import verify_resume_ticket
+from app.modules.metrics.service import metrics
+
+logger = logging.getLogger("hub.admission")
+
+# Menor = admitido primeiro
+ROLE_PRIORITY = {
+    "connector": 0,
+    "executor": 0,
+    "preditor": 1,
+    "admin": 2,
+    "bot": 2,
+    "dashboard": 3,
+}
+# Sem resume ticket válido (role não verificada)
+UNVERIFIED_PRIORITY = 4
+
+
+def role_hint(instance_id: str, resume: Optional[str] = None) -> Optional[str]:
+    """Role para priorizar o handshake: a do ticket, se válido; senão None."""
+    if resume:
+        return verify_resume_ticket(resume, instance_id)
+    return None
+
+
+class AdmissionController:
+    """Semáforo com fila de prioridade para handshakes."""
+
+    def __init__(self):
+        self.active: int = 0
+        self.admitted: int = 0
+        self.rejected: int = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    async def acquire(self, role: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """Ocupa um slot de handshake. False se não conseguir em `timeout` segundos."""
+        if self.active < settings.HANDSHAKE_CONCURRENCY and not self.queued:
+            self.active += 1
+            self.admitted += 1
+            return True
+
+        t0 = time.monotonic()
+        priority = ROLE_PRIORITY.get(role, UNVERIFIED_PRIORITY)
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # Slot concedido no mesmo instante do timeout: devolve
+                self.release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.rejected += 1
+            metrics.incr("admission.rejected")
+            logger.warning(f"Handshake admission timed out (role={role}, queued={self.queued})")
+            return False
+        self.admitted += 1
+        metrics.observe("admission.wait_ms", (time.monotonic() - t0) * 1000)
+        return True
+
+    def release(self):
+        # O slot passa direto ao próximo da fila (active não muda)
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(True)
+                return
+        self.active = max(self.active - 1, 0)
+
+    def info(self) -> dict:
+        return {
+            "limit": settings.HANDSHAKE_CONCURRENCY,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+admission = AdmissionController()
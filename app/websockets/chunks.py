@@ -0,0 +1,115 @@
+"""
+OTS Hub — Transferências em chunks
+
+Protocolo para respostas volumosas (ex: histórico com milhares de barras),
+repassadas aos preditors à medida que chegam:
+
+  history_chunk_start  {transfer_id, ...metadados (symbol, timeframe, total_chunks)}
+  history_chunk        {transfer_id, seq, data}   data = string JSON (ex: lista de barras)
+  history_chunk_end    {transfer_id, chunks, crc32}
+
+`seq` começa em 0 e é estritamente sequencial. `crc32` é o zlib.crc32
+acumulado dos `data` (UTF-8) na ordem. O Hub valida ordem e checksum e
+anota o trailer repassado com `verified`.
+"""
+
+import logging
+import time
+import zlib
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger("hub.chunks")
+
+CHUNK_TYPES = {"history_chunk_start", "history_chunk", "history_chunk_end"}
+
+# Máximo de transferências simultâneas por publicador
+MAX_TRANSFERS_PER_OWNER = 8
+
+
+class _Transfer:
+    __slots__ = ("owner", "next_seq", "crc", "bytes", "started_at", "updated_at")
+
+    def __init__(self, owner: str, now: float):
+        self.owner = owner
+        self.next_seq = 0
+        self.crc = 0
+        self.bytes = 0
+        self.started_at = now
+        self.updated_at = now
+
+
+class ChunkTransfers:
+    """Estado das transferências em andamento (ordem + checksum)."""
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._transfers: Dict[Tuple[str, str], _Transfer] = {}
+
+    def process(self, msg_type: str, owner: str, payload: dict) -> Tuple[Optional[dict], Optional[str]]:
+        """
+        Valida um frame de chunk.
+
+        Returns:
+            (payload a repassar, erro). Com erro, a transferência é abortada
+            e o payload repassado é um history_chunk_end com `aborted`.
+        """
+        now = time.time()
+        self._expire(now)
+        transfer_id = str(payload.get("transfer_id") or "")
+        if not transfer_id:
+            return None, "Chunk frame requires 'transfer_id'"
+        key = (owner, transfer_id)
+
+        if msg_type == "history_chunk_start":
+            if key in self._transfers:
+                return None, f"Transfer {transfer_id} already started"
+            if sum(1 for k in self._transfers if k[0] == owner) >= MAX_TRANSFERS_PER_OWNER:
+                return None, "Too many concurrent transfers"
+            self._transfers[key] = _Transfer(owner, now)
+            return payload, None
+
+        transfer = self._transfers.get(key)
+        if not transfer:
+            return None, f"Unknown transfer {transfer_id}"
+        transfer.updated_at = now
+
+        if msg_type == "history_chunk":
+            seq = payload.get("seq")
+            data = payload.get("data")
+            if seq != transfer.next_seq or not isinstance(data, str):
+                self._transfers.pop(key, None)
+                reason = f"Out of order chunk (expected seq {transfer.next_seq}, got {seq})" \
+                    if seq != transfer.next_seq else "Chunk 'data' must be a string"
+                return {"transfer_id": transfer_id, "aborted": True, "reason": reason}, reason
+            encoded = data.encode()
+            transfer.crc = zlib.crc32(encoded, transfer.crc)
+            transfer.bytes += len(encoded)
+            transfer.next_seq += 1
+            return payload, None
+
+        # history_chunk_end
+        self._transfers.pop(key, None)
+        chunks_ok = payload.get("chunks", transfer.next_seq) == transfer.next_seq
+        crc_ok = payload.get("crc32") is None or payload.get("crc32") == transfer.crc
+        verified = chunks_ok and crc_ok
+        if not verified:
+            logger.warning(f"Transfer {transfer_id} from {owner} failed verification "
+                           f"(chunks_ok={chunks_ok}, crc_ok={crc_ok})")
+        return {**payload, "verified": verified, "bytes": transfer.bytes}, None
+
+    def drop_owner(self, owner: str):
+        for key in [k for k in self._transfers if k[0] == owner]:
+            self._transfers.pop(key, None)
+
+    def _expire(self, now: float):
+        expired = [k for k, t in self._transfers.items() if now - t.updated_at > self.ttl]
+        for key in expired:
+            logger.warning(f"Transfer {key[1]} from {key[0]} expired")
+            self._transfers.pop(key, None)
+
+    @property
+    def active(self) -> int:
+        return len(self._transfers)
+
+
+chunk_transfers = ChunkTransfers()
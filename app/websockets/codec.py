@@ -0,0 +1,83 @@
+"""
+OTS Hub — Codec off-loop
+
+Decodificação/recodificação de frames grandes fora do event loop.
+
+`json.loads`/`json.dumps` em C não liberam o GIL, então uma thread não
+ajuda: frames acima de OFFLOAD_FRAME_BYTES vão para um pool de processos.
+Para history_response o worker também extrai as colunas OHLCV (arrays),
+de modo que o event loop não cria objetos por barra.
+Este módulo (e bars.service) só dependem da stdlib para que os workers
+(spawn) subam rápido.
+"""
+
+import asyncio
+import json
+import logging
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+from app.modules.bars.service import history_columns
+
+logger = logging.getLogger("hub.codec")
+
+# Types cujo payload o Hub só repassa: o worker já devolve o envelope pronto
+PASSTHROUGH_TYPES = {"history_response"}
+
+_pool: Optional["ProcessPoolExecutor"] = None
+
+
+def decode_frame(raw_data: str, from_id: str,
+                 timestamp: float) -> Tuple[dict, Optional[str], Optional[dict]]:
+    """
+    Executa no worker. Retorna (data, envelope, history):
+      - types passthrough: data sem payload + envelope de forward pronto
+        + colunas do histórico (ver bars.history_columns)
+      - demais: data completo, envelope e history None
+    Levanta ValueError se o JSON for inválido.
+    """
+    data = json.loads(raw_data)
+    if not isinstance(data, dict):
+        raise ValueError("Frame must be a JSON object")
+    msg_type = data.get("type")
+    if msg_type not in PASSTHROUGH_TYPES:
+        return data, None, None
+    envelope = json.dumps({
+        "type": msg_type,
+        "from": from_id,
+        "payload": data.get("payload", {}),
+        "timestamp": timestamp,
+    })
+    header = {k: v for k, v in data.items() if k != "payload"}
+    return header, envelope, history_columns(data.get("payload"))
+
+
+def _get_pool(workers: int) -> "ProcessPoolExecutor":
+    global _pool
+    if _pool is None:
+        # Import tardio: só paga multiprocessing quando chega o 1º frame grande
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        logger.info(f"Decode pool started ({workers} workers)")
+    return _pool
+
+
+async def decode_offloaded(raw_data: str, from_id: str, timestamp: float,
+                           workers: int = 1) -> Tuple[dict, Optional[str], Optional[dict]]:
+    """Decodifica frame grande no pool de processos (ou thread se workers=0)."""
+    loop = asyncio.get_running_loop()
+    executor = _get_pool(workers) if workers > 0 else None
+    return await loop.run_in_executor(executor, decode_frame, raw_data, from_id, timestamp)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,135 @@
+"""
+OTS Hub — Compressão seletiva por mensagem
+
+Negociada no auth (`"compression": ["zstd", "zlib"]`, em ordem de
+preferência). Só types volumosos (ver COMPRESSIBLE_TYPES) acima de
+COMPRESS_MIN_BYTES vão comprimidos, como frame binário contendo o JSON
+comprimido com o codec negociado. Mensagens pequenas e do caminho de
+ordens (bar, signal, order_*) continuam como texto.
+
+A forma comprimida é cacheada no `Outbound`; o router monta um único
+`Outbound` por mensagem e o passa a todos os broadcasts (uma role por
+vez), então cada codec comprime a mensagem uma única vez para todos os
+destinatários.
+
+Acima de COMPRESS_OFFLOAD_BYTES a compressão roda em `asyncio.to_thread`
+(zlib e zstandard liberam o GIL), para history_response/state_snapshot
+grandes não travarem o event loop; envios concorrentes do mesmo
+`Outbound` aguardam a mesma compressão em andamento.
+
+zstd é opcional (pacote `zstandard`); zlib está sempre disponível.
+"""
+
+import asyncio
+import logging
+import time
+import zlib
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.modules.metrics.service import metrics
+
+logger = logging.getLogger("hub.compression")
+
+COMPRESSIBLE_TYPES = {
+    "history_response", "history_chunk", "telemetry", "state_snapshot",
+}
+
+_zstd_compressor = None
+
+
+def _zstd():
+    global _zstd_compressor
+    if _zstd_compressor is None:
+        import zstandard
+        _zstd_compressor = zstandard.ZstdCompressor(level=settings.COMPRESS_LEVEL)
+    return _zstd_compressor
+
+
+def available_codecs() -> list:
+    codecs = []
+    try:
+        _zstd()
+        codecs.append("zstd")
+    except ImportError:
+        pass
+    codecs.append("zlib")
+    return codecs
+
+
+def negotiate(requested) -> Optional[str]:
+    """Escolhe o primeiro codec pedido pelo cliente que o Hub suporta."""
+    if not requested:
+        return None
+    if isinstance(requested, str):
+        requested = [requested]
+    supported = available_codecs()
+    for codec in requested:
+        if codec in supported:
+            return codec
+    return None
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return _zstd().compress(data)
+    return zlib.compress(data, settings.COMPRESS_LEVEL)
+
+
+class Outbound:
+    """Mensagem de saída com cache da forma comprimida por codec."""
+
+    __slots__ = ("text", "compressible", "deadline", "delivered", "_compressed", "_pending")
+
+    def __init__(self, text: str, compressible: bool = False, deadline: Optional[float] = None):
+        self.text = text
+        self.compressible = compressible
+        # Prazo de validade (epoch s, ver app/websockets/ttl.py); None = sem TTL
+        self.deadline = deadline
+        # Envios diretos concluídos (não conta filas conflacionadas)
+        self.delivered: int = 0
+        self._compressed: Dict[str, bytes] = {}
+        # Compressões em andamento numa thread, por codec
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.time() >= self.deadline
+
+    async def frame_for(self, codec: Optional[str]) -> Optional[bytes]:
+        """Bytes comprimidos para `codec`, ou None se deve ir como texto."""
+        if not codec or not self.compressible or len(self.text) < settings.COMPRESS_MIN_BYTES:
+            return None
+        data = self._compressed.get(codec)
+        if data is not None:
+            return data
+        pending = self._pending.get(codec)
+        if pending is None:
+            raw = self.text.encode()
+            if len(raw) < settings.COMPRESS_OFFLOAD_BYTES:
+                return self._store(codec, len(raw), compress(raw, codec))
+            pending = self._pending[codec] = asyncio.ensure_future(
+                asyncio.to_thread(compress, raw, codec))
+            pending.add_done_callback(lambda f: self._settle(codec, len(raw), f))
+        # shield: cancelar um envio não cancela a compressão que outros aguardam
+        return await asyncio.shield(pending)
+
+    def _store(self, codec: str, size_in: int, data: bytes) -> bytes:
+        self._compressed[codec] = data
+        metrics.incr("compression.bytes_in", size_in)
+        metrics.incr("compression.bytes_out", len(data))
+        return data
+
+    def _settle(self, codec: str, size_in: int, future: asyncio.Future):
+        self._pending.pop(codec, None)
+        if not future.cancelled() and future.exception() is None:
+            self._store(codec, size_in, future.result())
+
+
+async def send_outbound(websocket, codec: Optional[str], out: Outbound) -> int:
+    """Envia como texto ou frame comprimido. Retorna o tamanho enviado."""
+    data = await out.frame_for(codec)
+    if data is None:
+        await websocket.send_text(out.text)
+        return len(out.text)
+    await websocket.send_bytes(data)
+    return len(data)
@@ -0,0 +1,114 @@
+"""
+OTS Hub — Dedup (roteamento idempotente de ordens)
+
+Executors reenviam `order_command` após reconectar; sem dedup, cada
+cópia vai para todos os connectors e vira outra chamada na corretora.
+
+Índice limitado por TTL (ORDER_DEDUP_TTL_S) e tamanho (ORDER_DEDUP_MAX),
+chaveado por (remetente, idempotency_key ou id da mensagem):
+
+- order_command repetido não é reenviado: o remetente recebe o
+  order_result já visto (se o connector respondeu com `ref_id`) ou um
+  ack `duplicate` enquanto a ordem está em andamento
+- order_command que não chegou a nenhum connector (nenhum conectado,
+  expirado por TTL) não fica registrado: o retry é roteado normalmente
+- order_result repetido (mesmo id do mesmo connector) é descartado
+
+O order_result só se liga à ordem pelos escopos (namespace, connector)
+que de fato a receberam, então ids iguais de executors diferentes não
+se misturam.
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger("hub.dedup")
+
+
+class DedupEntry:
+    __slots__ = ("ref_id", "seen_at", "result", "hits", "refs")
+
+    def __init__(self, ref_id: Optional[str], seen_at: float):
+        self.ref_id = ref_id
+        self.seen_at = seen_at
+        self.result: Optional[str] = None
+        self.hits: int = 0
+        # Chaves (escopo, ref_id) em DedupIndex._refs
+        self.refs: list = []
+
+
+class DedupIndex:
+    """Chaves vistas recentemente, em ordem de chegada (expiração pela frente)."""
+
+    def __init__(self):
+        self._entries: "OrderedDict[Hashable, DedupEntry]" = OrderedDict()
+        # (escopo de quem responde, id da ordem = ref_id do order_result) → chave
+        self._refs: Dict[Tuple[Hashable, str], Hashable] = {}
+        self.duplicates: int = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float):
+        cutoff = now - settings.ORDER_DEDUP_TTL_S
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.seen_at >= cutoff and len(self._entries) <= settings.ORDER_DEDUP_MAX:
+                break
+            self._entries.popitem(last=False)
+            self._unref(key, entry)
+
+    def _unref(self, key: Hashable, entry: DedupEntry):
+        for ref in entry.refs:
+            if self._refs.get(ref) == key:
+                del self._refs[ref]
+
+    def check(self, key: Hashable, ref_id: Optional[str] = None,
+              now: Optional[float] = None) -> Optional[DedupEntry]:
+        """Entrada existente se `key` é duplicada; senão registra e retorna None."""
+        now = time.time() if now is None else now
+        self._expire(now)
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.hits += 1
+            self.duplicates += 1
+            return entry
+        self._entries[key] = DedupEntry(ref_id, now)
+        self._expire(now)
+        return None
+
+    def bind(self, key: Hashable, scopes: Iterable[Hashable]):
+        """Liga o ref_id da entrada aos escopos (ex.: (namespace, connector)) que receberam a ordem."""
+        entry = self._entries.get(key)
+        if entry is None or not entry.ref_id:
+            return
+        for scope in scopes:
+            ref = (scope, entry.ref_id)
+            self._refs[ref] = key
+            entry.refs.append(ref)
+
+    def discard(self, key: Hashable):
+        """Esquece `key` (ordem não entregue: o retry deve seguir)."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unref(key, entry)
+
+    def attach_result(self, scope: Hashable, ref_id: str, result: str) -> bool:
+        """Guarda o order_result (envelope pronto) da ordem `ref_id` respondida por `scope`."""
+        key = self._refs.get((scope, ref_id))
+        entry = self._entries.get(key) if key is not None else None
+        if entry is None:
+            return False
+        entry.result = result
+        return True
+
+    def info(self) -> dict:
+        return {"entries": len(self._entries), "duplicates": self.duplicates,
+                "ttl_s": settings.ORDER_DEDUP_TTL_S, "max": settings.ORDER_DEDUP_MAX}
+
+
+order_dedup = DedupIndex()
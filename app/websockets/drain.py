@@ -0,0 +1,88 @@
+"""
+OTS Hub — Drain (restart sem downtime)
+
+Sequência antes de um restart:
+1. Para de aceitar conexões (WebSocket e stream)
+2. Esvazia as filas de saída (conflação) até DRAIN_FLUSH_TIMEOUT_S
+3. Grava o snapshot do estado (app/modules/snapshot)
+4. Envia `reconnect_after` com atraso + jitter a cada cliente e fecha
+   com 1012 (Service Restart), espalhando as reconexões no processo novo
+
+Disparado por POST /api/v1/admin/drain (antes do systemctl restart) ou,
+como fallback, no shutdown — quando o uvicorn já fechou os sockets e só
+resta gravar o snapshot.
+"""
+
+import json
+import logging
+import random
+import time
+from typing import Optional
+
+from app.core.config import settings
+from app.modules.snapshot.service import hub_snapshot
+from app.websockets.manager import manager
+from app.websockets.stream import stream_servers
+
+logger = logging.getLogger("hub.drain")
+
+RESTART_CLOSE_CODE = 1012
+
+
+def reconnect_hint(reason: str) -> str:
+    delay_ms = settings.RECONNECT_BASE_MS + random.randint(0, max(settings.RECONNECT_JITTER_MS, 0))
+    return json.dumps({
+        "type": "reconnect_after",
+        "payload": {"delay_ms": delay_ms, "reason": reason},
+        "timestamp": time.time(),
+    })
+
+
+class HubDrain:
+    """Executa o drain uma única vez por processo."""
+
+    def __init__(self):
+        self.result: Optional[dict] = None
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    async def run(self, reason: str = "restart", abort_on_failure: bool = True) -> dict:
+        """
+        Drena o hub. Se o snapshot falhar (e `abort_on_failure`), o drain é
+        abortado: o hub volta a aceitar conexões e um novo drain pode ser
+        tentado — fechar os clientes agora perderia o estado no restart.
+        """
+        if self.result is not None:
+            return self.result
+        t0 = time.monotonic()
+        manager.draining = True
+        stream_servers.stop_accepting()
+
+        await manager.flush(settings.DRAIN_FLUSH_TIMEOUT_S)
+        try:
+            snapshot = await hub_snapshot.write()
+        except Exception as e:
+            logger.error(f"Hub snapshot failed: {e}")
+            snapshot = False
+        if not snapshot and settings.HUB_SNAPSHOT_PATH and abort_on_failure:
+            manager.draining = False
+            await stream_servers.resume_accepting()
+            logger.error("Drain aborted: hub snapshot failed, accepting connections again")
+            return {"reason": reason, "snapshot": False, "aborted": True, "closed": 0,
+                    "duration_ms": round((time.monotonic() - t0) * 1000, 1)}
+        closed = await manager.close_all(
+            lambda conn: reconnect_hint(reason), RESTART_CLOSE_CODE, "Service restart")
+
+        self.result = {
+            "reason": reason,
+            "snapshot": snapshot,
+            "closed": closed,
+            "duration_ms": round((time.monotonic() - t0) * 1000, 1),
+        }
+        logger.info(f"Drained: {self.result}")
+        return self.result
+
+
+hub_drain = HubDrain()
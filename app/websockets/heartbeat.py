@@ -0,0 +1,173 @@
+"""
+OTS Hub — Heartbeat
+
+Ping/pong dirigido pelo Hub, com medição de RTT e estimativa do offset
+do relógio de cada cliente. A expiração por silêncio é guiada por um
+índice de deadlines (heap) — sem varrer todas as conexões.
+
+Protocolo:
+  Hub → cliente: {"type": "ping", "id": "<id>", "timestamp": t0}
+  cliente → Hub: {"type": "pong", "timestamp": tc, "payload": {"ref_id": "<id>"}}
+
+  rtt    = t1 - t0
+  offset = tc - (t0 + rtt / 2)     (positivo: relógio do cliente adiantado)
+
+Qualquer mensagem recebida conta como sinal de vida. O timeout curto
+(HEARTBEAT_TIMEOUT_S) só vale depois que o cliente respondeu um pong;
+clientes que não implementam pong (dashboards, preditors H1 antigos)
+seguem com HEARTBEAT_LEGACY_TIMEOUT_S.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from typing import List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.modules.metrics.service import metrics
+from app.websockets.manager import ConnectionInfo, manager
+
+logger = logging.getLogger("hub.heartbeat")
+
+# Peso da amostra nova nas médias móveis (EWMA) de RTT e offset
+_EWMA_ALPHA = 0.2
+
+# Avanço mínimo do próximo check: garante que run_due() termina
+_MIN_STEP_S = 0.001
+
+
+def record_pong(conn: ConnectionInfo, payload: dict, client_ts: Optional[float],
+                now: Optional[float] = None) -> Optional[float]:
+    """
+    Processa um pong e atualiza RTT/offset da conexão.
+
+    Returns:
+        RTT em ms, ou None se o pong não corresponde ao último ping.
+    """
+    now = now or time.time()
+    ref_id = payload.get("ref_id")
+    if not ref_id or ref_id != conn.ping_id or not conn.last_ping_at:
+        return None
+    conn.ping_id = None
+
+    rtt = max(0.0, now - conn.last_ping_at)
+    rtt_ms = rtt * 1000.0
+    conn.rtt_ms = rtt_ms if conn.rtt_ms is None else (
+        (1 - _EWMA_ALPHA) * conn.rtt_ms + _EWMA_ALPHA * rtt_ms)
+
+    client_ts = payload.get("client_ts", client_ts)
+    if isinstance(client_ts, (int, float)):
+        offset_ms = (client_ts - (conn.last_ping_at + rtt / 2)) * 1000.0
+        conn.clock_offset_ms = offset_ms if conn.clock_offset_ms is None else (
+            (1 - _EWMA_ALPHA) * conn.clock_offset_ms + _EWMA_ALPHA * offset_ms)
+
+    metrics.observe("heartbeat.rtt_ms", rtt_ms)
+    metrics.observe(f"heartbeat.rtt_ms.{conn.role}", rtt_ms)
+    return rtt_ms
+
+
+class HeartbeatMonitor:
+    """Agenda pings e expira conexões silenciosas via heap de deadlines."""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, ConnectionInfo]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Pings em envio (referência forte até concluírem)
+        self._sends: Set[asyncio.Task] = set()
+
+    @property
+    def interval(self) -> float:
+        return float(settings.HEARTBEAT_INTERVAL_S)
+
+    @property
+    def timeout(self) -> float:
+        return float(settings.HEARTBEAT_TIMEOUT_S)
+
+    def timeout_for(self, conn: ConnectionInfo) -> float:
+        """Timeout de silêncio: curto só para quem já respondeu um pong."""
+        if conn.rtt_ms is None:
+            return float(settings.HEARTBEAT_LEGACY_TIMEOUT_S)
+        return self.timeout
+
+    def track(self, instance_id: str):
+        """Passa a monitorar a conexão (chamado após o auth)."""
+        conn = manager.get(instance_id)
+        if not conn:
+            return
+        last_seen = max(conn.last_message_at, conn.connected_at)
+        self._push(last_seen + min(self.interval, self.timeout), conn)
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _push(self, due: float, conn: ConnectionInfo):
+        heapq.heappush(self._heap, (due, next(self._seq), conn))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await self.run_due(time.time())
+            delay = (self._heap[0][0] - time.time()) if self._heap else self.interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0.01))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def run_due(self, now: float):
+        """Processa todas as entradas vencidas do heap."""
+        while self._heap and self._heap[0][0] <= now:
+            _, _, conn = heapq.heappop(self._heap)
+            # Entrada obsoleta: conexão removida ou substituída
+            if manager.get(conn.instance_id) is not conn:
+                continue
+            await self._check(conn, now)
+
+    async def _check(self, conn: ConnectionInfo, now: float):
+        last_seen = max(conn.last_message_at, conn.connected_at)
+        timeout = self.timeout_for(conn)
+        if now - last_seen >= timeout:
+            await self._evict(conn, now - last_seen)
+            return
+
+        if now - conn.last_ping_at >= self.interval:
+            conn.ping_id = f"hb-{next(self._seq)}"
+            conn.last_ping_at = now
+            ping = json.dumps({"type": "ping", "id": conn.ping_id, "timestamp": now})
+            task = asyncio.create_task(manager.send(conn.instance_id, ping))
+            self._sends.add(task)
+            task.add_done_callback(self._send_done)
+
+        # Sempre estritamente no futuro (arredondamento de last_seen + timeout)
+        due = min(last_seen + timeout, conn.last_ping_at + self.interval)
+        self._push(max(due, now + _MIN_STEP_S), conn)
+
+    def _send_done(self, task: asyncio.Task):
+        self._sends.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Ping send failed: {task.exception()}")
+
+    async def _evict(self, conn: ConnectionInfo, silence: float):
+        logger.warning(f"Heartbeat timeout: {conn.instance_id} (silent {silence:.0f}s), closing")
+        metrics.incr("heartbeat.evicted")
+        manager.disconnect(conn.instance_id)
+        try:
+            await conn.websocket.close(code=4002, reason="Heartbeat timeout")
+        except Exception:
+            pass
+
+
+heartbeat = HeartbeatMonitor()
@@ -2,21 +2,131 @@
 OTS Hub — WebSocket Connection Manager
 
 Gerencia conexões ativas, tracking de auth e roteamento de mensagens.
+
+Conexões autenticadas ficam indexadas por (namespace, role): broadcasts
+de um namespace percorrem só as conexões dele (ver namespaces.py).
 """
 
+import asyncio
 import logging
 import time
-from typing import Dict, Optional
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, Optional, Tuple, Union
 from fastapi import WebSocket
 
+from app.core.config import settings
+from app.core.startup import startup_timer
+from app.modules.auth.service import DEFAULT_NAMESPACE
+from app.modules.events.service import event_bus
+from app.modules.metrics.service import metrics
+from app.websockets.accounting import (
+    ConnectionStats, frame_limit, memory_budget, message_type,
+)
+from app.websockets.compression import Outbound, send_outbound
+
 logger = logging.getLogger("hub.ws")
 
 
+class ConflatingSender:
+    """
+    Entrega conflacionada para consumidores lentos (ex: dashboards).
+
+    Mantém no máximo uma mensagem pendente por chave. Se um valor mais
+    novo chega antes do anterior ser enviado, substitui-o no lugar
+    (preservando a posição na fila). Uma task dedicada drena a fila
+    respeitando um intervalo mínimo entre envios (`interval=None` segue
+    settings.CONFLATE_INTERVAL_MS, lido a cada envio).
+    """
+
+    def __init__(self, websocket: WebSocket, instance_id: str,
+                 interval: Optional[float] = 0.0,
+                 on_dead: Optional[Callable[[str], None]] = None,
+                 compression: Optional[str] = None,
+                 stats: Optional[ConnectionStats] = None):
+        self.websocket = websocket
+        self.instance_id = instance_id
+        self.interval = interval
+        self.compression = compression
+        self.stats = stats or ConnectionStats()
+        self.sent: int = 0
+        self.replaced: int = 0
+        self._on_dead = on_dead
+        self._pending: "OrderedDict[Hashable, Outbound]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def offer(self, key: Hashable, message: Outbound):
+        old = self._pending.get(key)
+        if old is not None:
+            self.replaced += 1
+            self.stats.dequeue(len(old.text))
+        self._pending[key] = message
+        self.stats.queue(len(message.text))
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                _, message = self._pending.popitem(last=False)
+                if message.expired():
+                    self.stats.dequeue(len(message.text))
+                    metrics.incr("ttl.expired_sends")
+                    continue
+                started = time.perf_counter()
+                try:
+                    size = await send_outbound(self.websocket, self.compression, message)
+                    self.sent += 1
+                except Exception as e:
+                    logger.error(f"Conflated send to {self.instance_id} failed: {e}")
+                    self.stats.dequeue(len(message.text))
+                    self._clear()
+                    if self._on_dead:
+                        self._on_dead(self.instance_id)
+                    return
+                self.stats.dequeue(len(message.text))
+                self.stats.record_out(message_type(message.text), size,
+                                      time.perf_counter() - started)
+                interval = self.interval
+                if interval is None:
+                    interval = settings.CONFLATE_INTERVAL_MS / 1000.0
+                if interval > 0:
+                    await asyncio.sleep(interval)
+
+    async def flush(self, timeout: float):
+        """Espera a fila esvaziar (até `timeout` segundos)."""
+        deadline = time.monotonic() + timeout
+        while self._pending and self._task and not self._task.done():
+            if time.monotonic() >= deadline:
+                return
+            await asyncio.sleep(0.01)
+
+    def _clear(self):
+        for message in self._pending.values():
+            self.stats.dequeue(len(message.text))
+        self._pending.clear()
+
+    def close(self):
+        self._clear()
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+
 class ConnectionInfo:
     """Metadados de uma conexão."""
 
     __slots__ = ("websocket", "instance_id", "role", "authenticated",
-                 "connected_at", "last_message_at")
+                 "connected_at", "last_message_at", "conflater",
+                 "last_ping_at", "ping_id", "rtt_ms", "clock_offset_ms",
+                 "limiter", "compression", "shm_bars", "namespace", "stats")
 
     def __init__(self, websocket: WebSocket, instance_id: str):
         self.websocket = websocket
@@ -25,6 +135,22 @@ class ConnectionInfo:
         self.authenticated: bool = False
         self.connected_at: float = time.time()
         self.last_message_at: float = 0.0
+        self.conflater: Optional[ConflatingSender] = None
+        # Heartbeat (ver app/websockets/heartbeat.py)
+        self.last_ping_at: float = 0.0
+        self.ping_id: Optional[str] = None
+        self.rtt_ms: Optional[float] = None
+        self.clock_offset_ms: Optional[float] = None
+        # Rate limiting (ver app/websockets/ratelimit.py)
+        self.limiter = None
+        # Codec negociado no auth (ver app/websockets/compression.py)
+        self.compression: Optional[str] = None
+        # Lê barras do ring em memória compartilhada (ver app/modules/bars/shm.py)
+        self.shm_bars: bool = False
+        # Namespace escolhido no auth (ver app/websockets/namespaces.py)
+        self.namespace: str = DEFAULT_NAMESPACE
+        # Tráfego e bytes enfileirados (ver app/websockets/accounting.py)
+        self.stats = ConnectionStats()
 
 
 class ConnectionManager:
@@ -32,6 +158,10 @@ class ConnectionManager:
 
     def __init__(self):
         self._connections: Dict[str, ConnectionInfo] = {}
+        # (namespace, role) → conexões autenticadas
+        self._index: Dict[Tuple[str, str], Dict[str, ConnectionInfo]] = {}
+        # True durante o drain de restart: novas conexões são recusadas
+        self.draining: bool = False
 
     async def connect(self, websocket: WebSocket, instance_id: str) -> ConnectionInfo:
         # Close stale connection if exists (e.g. client reconnected)
@@ -42,24 +172,69 @@ class ConnectionManager:
             except Exception:
                 pass
             logger.info(f"Replaced stale connection: {instance_id}")
+        if old:
+            self._unindex(old)
 
         await websocket.accept()
+        startup_timer.mark("first_accept")
         info = ConnectionInfo(websocket, instance_id)
+        if hasattr(websocket, "stats"):
+            # Transporte em shard: bytes ainda na fila do shard contam na conexão
+            websocket.stats = info.stats
         self._connections[instance_id] = info
         logger.info(f"Connected: {instance_id} (total={len(self._connections)})")
+        event_bus.publish("connection", {"instance_id": instance_id, "state": "connected"})
         return info
 
     def disconnect(self, instance_id: str):
         if instance_id in self._connections:
-            del self._connections[instance_id]
+            conn = self._connections.pop(instance_id)
+            self._unindex(conn)
+            if conn.conflater:
+                conn.conflater.close()
             logger.info(f"Disconnected: {instance_id} (total={len(self._connections)})")
+            event_bus.publish("connection", {"instance_id": instance_id, "state": "disconnected"})
 
-    def authenticate(self, instance_id: str, role: str = "bot"):
+    def _unindex(self, conn: ConnectionInfo):
+        members = self._index.get((conn.namespace, conn.role))
+        if members is not None and members.get(conn.instance_id) is conn:
+            del members[conn.instance_id]
+            if not members:
+                del self._index[(conn.namespace, conn.role)]
+
+    def authenticate(self, instance_id: str, role: str = "bot", conflate: bool = False,
+                     compression: Optional[str] = None, shm_bars: bool = False,
+                     namespace: str = DEFAULT_NAMESPACE):
         if instance_id in self._connections:
             conn = self._connections[instance_id]
+            self._unindex(conn)
             conn.authenticated = True
             conn.role = role
-            logger.info(f"Authenticated: {instance_id} (role={role})")
+            conn.namespace = namespace
+            self._index.setdefault((namespace, role), {})[instance_id] = conn
+            conn.compression = compression
+            conn.shm_bars = shm_bars
+            if conflate and conn.conflater is None:
+                conn.conflater = ConflatingSender(
+                    conn.websocket, instance_id,
+                    interval=None,
+                    on_dead=self._drop_dead,
+                    compression=compression,
+                    stats=conn.stats,
+                )
+            if hasattr(conn.websocket, "max_frame_bytes"):
+                # Transporte stream: limite aplicado no cabeçalho do frame
+                conn.websocket.max_frame_bytes = frame_limit(role)
+            logger.info(f"Authenticated: {instance_id} (role={role}, namespace={namespace}, "
+                        f"conflate={conflate}, compression={compression})")
+            event_bus.publish("connection", {
+                "instance_id": instance_id, "state": "authenticated", "role": role,
+                "namespace": namespace,
+            })
+
+    def _drop_dead(self, instance_id: str):
+        logger.warning(f"Removing dead connection: {instance_id}")
+        self.disconnect(instance_id)
 
     def is_authenticated(self, instance_id: str) -> bool:
         conn = self._connections.get(instance_id)
@@ -68,64 +243,193 @@ class ConnectionManager:
     def get(self, instance_id: str) -> Optional[ConnectionInfo]:
         return self._connections.get(instance_id)
 
-    async def send(self, instance_id: str, message: str) -> bool:
+    async def send(self, instance_id: str, message: str, compressible: bool = False) -> bool:
         conn = self._connections.get(instance_id)
         if not conn:
             return False
         try:
-            await conn.websocket.send_text(message)
+            await self._deliver(conn, Outbound(message, compressible))
             return True
         except Exception as e:
             logger.error(f"Send to {instance_id} failed: {e}")
             return False
 
-    async def broadcast(self, message: str, role: Optional[str] = None,
-                        exclude: Optional[str] = None):
+    async def reply(self, websocket, instance_id: str, message: str):
+        """Resposta direta ao remetente (levanta em falha), com accounting da conexão."""
+        conn = self._connections.get(instance_id)
+        if conn is None or conn.websocket is not websocket:
+            await websocket.send_text(message)
+            return
+        await self._deliver(conn, Outbound(message))
+
+    async def broadcast(self, message: Union[str, Outbound], role: Optional[str] = None,
+                        exclude: Optional[str] = None,
+                        conflate_key: Optional[Hashable] = None,
+                        compressible: bool = False,
+                        predicate: Optional[Callable[[ConnectionInfo], bool]] = None,
+                        targets: Optional[Iterable[str]] = None,
+                        deadline: Optional[float] = None,
+                        namespace: Optional[str] = None) -> int:
         """
         Broadcast para conexões autenticadas.
         Itera sobre snapshot do dict para evitar RuntimeError se
         conexões são adicionadas/removidas durante o broadcast.
+
+        Com `conflate_key`, conexões em modo conflacionado recebem a
+        mensagem via fila (só o valor mais recente por chave).
+
+        Com `compressible`, conexões que negociaram compressão recebem
+        frame binário (comprimido uma vez por codec para todos). Para
+        fan-out em várias roles, passe o mesmo `Outbound` (já com
+        compressible/deadline) a cada broadcast: a compressão é feita uma
+        vez por mensagem, não por role.
+
+        `predicate` filtra destinatários adicionais (True = envia).
+
+        `targets` restringe aos instance_ids dados (roteamento indexado,
+        sem percorrer todas as conexões).
+
+        `namespace` restringe às conexões do namespace; com `role`, usa o
+        índice (namespace, role) — custo proporcional ao namespace.
+
+        Com `deadline` (ver app/websockets/ttl.py), destinatários alcançados
+        depois do prazo não recebem a mensagem. Retorna quantos foram
+        descartados assim.
         """
         # Snapshot — evita "dictionary changed size during iteration"
-        targets = list(self._connections.items())
+        if targets is not None:
+            conns = [(iid, self._connections[iid]) for iid in targets if iid in self._connections]
+        elif namespace is not None and role:
+            conns = list(self._index.get((namespace, role), {}).items())
+        else:
+            conns = list(self._connections.items())
         dead = []
+        expired = shed = 0
+        if isinstance(message, Outbound):
+            out = message
+            deadline = out.deadline
+        else:
+            out = Outbound(message, compressible, deadline)
+        msg_type = message_type(out.text)
 
-        for iid, conn in targets:
+        for iid, conn in conns:
             if not conn.authenticated:
                 continue
             if exclude and iid == exclude:
                 continue
             if role and conn.role != role:
                 continue
+            if namespace is not None and conn.namespace != namespace:
+                continue
+            if predicate and not predicate(conn):
+                continue
+            if memory_budget.should_shed(conn.role, msg_type):
+                conn.stats.shed += 1
+                shed += 1
+                continue
+            if conflate_key is not None and conn.conflater:
+                conn.conflater.offer(conflate_key, out)
+                continue
+            if deadline is not None and out.expired():
+                expired += 1
+                continue
             try:
-                await conn.websocket.send_text(message)
+                await self._deliver(conn, out, msg_type)
             except Exception as e:
                 logger.error(f"Broadcast to {iid} failed: {e}")
                 dead.append(iid)
 
         # Remove conexões mortas detectadas durante broadcast
         for iid in dead:
-            logger.warning(f"Removing dead connection: {iid}")
-            self._connections.pop(iid, None)
+            self._drop_dead(iid)
+        if expired:
+            metrics.incr("ttl.expired_sends", expired)
+        if shed:
+            memory_budget.shed += shed
+            metrics.incr("memory.shed", shed)
+        return expired
+
+    @staticmethod
+    async def _deliver(conn: ConnectionInfo, out: Outbound, msg_type: Optional[str] = None):
+        """Envia direto, contando bytes em andamento e tempo de envio."""
+        pending = len(out.text)
+        conn.stats.queue(pending)
+        started = time.perf_counter()
+        try:
+            size = await send_outbound(conn.websocket, conn.compression, out)
+        finally:
+            conn.stats.dequeue(pending)
+        out.delivered += 1
+        conn.stats.record_out(msg_type or message_type(out.text), size,
+                              time.perf_counter() - started)
+
+    async def flush(self, timeout: float):
+        """Espera as filas conflacionadas esvaziarem (até `timeout` segundos)."""
+        flushes = [c.conflater.flush(timeout) for c in self._connections.values() if c.conflater]
+        if flushes:
+            await asyncio.gather(*flushes)
 
-    def list_connections(self) -> list:
+    async def close_all(self, message_for: Callable[[ConnectionInfo], str],
+                        code: int, reason: str) -> int:
+        """Envia uma última mensagem a cada conexão e a fecha. Retorna quantas."""
+        conns = list(self._connections.values())
+        for conn in conns:
+            try:
+                await conn.websocket.send_text(message_for(conn))
+                await conn.websocket.close(code=code, reason=reason)
+            except Exception as e:
+                logger.debug(f"Close of {conn.instance_id} failed: {e}")
+        return len(conns)
+
+    def list_connections(self, counters: bool = True) -> list:
+        """Conexões; `counters=False` omite os campos que mudam a cada frame."""
+        if not counters:
+            return [
+                {
+                    "instance_id": iid,
+                    "role": conn.role,
+                    "namespace": conn.namespace,
+                    "authenticated": conn.authenticated,
+                    "connected_at": conn.connected_at,
+                    "compression": conn.compression,
+                    "delivery": "conflate" if conn.conflater else "direct",
+                }
+                for iid, conn in self._connections.items()
+            ]
         return [
             {
                 "instance_id": iid,
                 "role": conn.role,
+                "namespace": conn.namespace,
                 "authenticated": conn.authenticated,
                 "connected_at": conn.connected_at,
                 "last_message_at": conn.last_message_at,
+                "rtt_ms": round(conn.rtt_ms, 2) if conn.rtt_ms is not None else None,
+                "clock_offset_ms": (round(conn.clock_offset_ms, 2)
+                                    if conn.clock_offset_ms is not None else None),
+                "rate_limited": conn.limiter.hits if conn.limiter else 0,
+                "compression": conn.compression,
+                "delivery": "conflate" if conn.conflater else "direct",
+                "traffic": conn.stats.info(),
+                **({"conflate_pending": conn.conflater.pending,
+                    "conflate_replaced": conn.conflater.replaced}
+                   if conn.conflater else {}),
             }
             for iid, conn in self._connections.items()
         ]
 
-    def get_by_role(self, role: str) -> list:
+    def get_by_role(self, role: str, namespace: Optional[str] = None) -> list:
+        if namespace is not None:
+            return list(self._index.get((namespace, role), ()))
         return [
             iid for iid, conn in self._connections.items()
             if conn.authenticated and conn.role == role
         ]
 
+    def count_in(self, namespace: str) -> int:
+        """Conexões autenticadas no namespace."""
+        return sum(len(members) for (ns, _), members in self._index.items() if ns == namespace)
+
     @property
     def count(self) -> int:
         return len(self._connections)
@@ -0,0 +1,159 @@
+"""
+OTS Hub — Namespaces (isolamento de estratégias/contas)
+
+Um Hub, vários conjuntos independentes de preditor/executor/connector.
+O namespace é escolhido no auth e validado pelo token do namespace
+(NAMESPACE_TOKENS; sem namespace = `default`, com ORACLE_TOKEN):
+
+    {"type": "auth", "payload": {"token": "...", "role": "executor",
+                                 "namespace": "scalper-eu"}}
+
+Por namespace:
+- índice de roteamento (namespace, role) no ConnectionManager: broadcasts
+  percorrem só o namespace
+- ownership de conta/symbol, telemetria, estado de conta/posições,
+  command router, séries de barras, reamostragem e rings SHM próprios
+  (o mesmo symbol em dois namespaces não se mistura)
+- limites (NAMESPACE_LIMITS: max_connections, max_pending_commands);
+  comandos sem ack expiram em COMMAND_ACK_TIMEOUT_S (`expire_commands`)
+- métricas (mensagens por type, recusas por limite)
+
+O namespace `default` usa os singletons dos módulos.
+"""
+
+import logging
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.modules.auth.service import DEFAULT_NAMESPACE
+from app.modules.bars.service import BarResampler, BarStore, bar_resampler, bar_store
+from app.modules.bars.shm import SharedBarRings, shared_bar_rings
+from app.modules.commands.service import CommandRouter, command_router
+from app.modules.metrics.service import Metrics
+from app.modules.state.service import StateStore, state_store
+from app.modules.telemetry.service import TelemetryStore, telemetry_store
+from app.websockets.manager import manager
+from app.websockets.ownership import OwnershipIndex, ownership
+
+logger = logging.getLogger("hub.namespaces")
+
+
+class Namespace:
+    """Stores, índices, limites e métricas de um namespace."""
+
+    def __init__(self, name: str, telemetry: Optional[TelemetryStore] = None,
+                 commands: Optional[CommandRouter] = None,
+                 owners: Optional[OwnershipIndex] = None,
+                 state: Optional[StateStore] = None,
+                 bars: Optional[BarStore] = None,
+                 resampler: Optional[BarResampler] = None,
+                 bar_rings: Optional[SharedBarRings] = None):
+        self.name = name
+        self.telemetry = telemetry or TelemetryStore()
+        self.state = state or StateStore()
+        self.bars = bars or BarStore()
+        self.resampler = resampler or BarResampler()
+        self.bar_rings = bar_rings or SharedBarRings(name)
+        self.commands = commands or CommandRouter()
+        self.ownership = owners or OwnershipIndex()
+        self.metrics = Metrics()
+
+    def limit(self, key: str) -> int:
+        """Limite configurado (0 = sem limite); "*" vale para todos os namespaces."""
+        limits = settings.NAMESPACE_LIMITS
+        value = limits.get(self.name, {}).get(key, limits.get("*", {}).get(key, 0))
+        return int(value or 0)
+
+    def admits(self, instance_id: str) -> bool:
+        """Cabe mais uma conexão (re-auth de quem já está no namespace sempre cabe)."""
+        limit = self.limit("max_connections")
+        if limit <= 0:
+            return True
+        conn = manager.get(instance_id)
+        if conn and conn.authenticated and conn.namespace == self.name:
+            return True
+        return manager.count_in(self.name) < limit
+
+    def accepts_command(self) -> bool:
+        limit = self.limit("max_pending_commands")
+        return limit <= 0 or self.commands.pending_count < limit
+
+    def info(self) -> dict:
+        return {
+            "connections": manager.count_in(self.name),
+            "pending_commands": self.commands.pending_count,
+            "telemetry_instances": len(self.telemetry.get_all_latest()),
+            "bar_subscriptions": self.resampler.get_subscriptions(),
+            "limits": {key: self.limit(key) for key in ("max_connections", "max_pending_commands")},
+            "metrics": self.metrics.snapshot()["counters"],
+        }
+
+
+class Namespaces:
+    """Registro de namespaces, criados no primeiro auth aceito."""
+
+    def __init__(self):
+        self._spaces: Dict[str, Namespace] = {
+            DEFAULT_NAMESPACE: Namespace(DEFAULT_NAMESPACE, telemetry_store, command_router,
+                                         ownership, state_store, bar_store, bar_resampler,
+                                         shared_bar_rings),
+        }
+
+    def get(self, name: Optional[str] = None) -> Namespace:
+        name = name or DEFAULT_NAMESPACE
+        space = self._spaces.get(name)
+        if space is None:
+            space = self._spaces[name] = Namespace(name)
+            logger.info(f"Namespace created: {name}")
+        return space
+
+    def find(self, name: Optional[str] = None) -> Optional[Namespace]:
+        """Namespace existente (sem criar), para consultas REST."""
+        return self._spaces.get(name or DEFAULT_NAMESPACE)
+
+    def of(self, instance_id: str) -> Namespace:
+        """Namespace da conexão (default se desconectada)."""
+        conn = manager.get(instance_id)
+        return self.get(conn.namespace if conn else DEFAULT_NAMESPACE)
+
+    def find_telemetry(self, instance_id: str) -> Optional[dict]:
+        for space in self._spaces.values():
+            data = space.telemetry.get_latest(instance_id)
+            if data is not None:
+                return data
+        return None
+
+    def find_state(self, instance_id: str) -> Optional[dict]:
+        for space in self._spaces.values():
+            data = space.state.get(instance_id)
+            if data:
+                return data
+        return None
+
+    def all(self) -> list:
+        return list(self._spaces.values())
+
+    def expire_commands(self) -> None:
+        """Expira comandos sem ack (libera o limite max_pending_commands)."""
+        for space in list(self._spaces.values()):
+            space.commands.cleanup_stale(settings.COMMAND_ACK_TIMEOUT_S)
+
+    def dump(self) -> dict:
+        # O default já vai no snapshot pelos próprios stores
+        return {name: {"telemetry": space.telemetry.dump(), "commands": space.commands.dump(),
+                       "state": space.state.dump(), "bars": space.bars.dump()}
+                for name, space in self._spaces.items() if name != DEFAULT_NAMESPACE}
+
+    def load(self, data: dict):
+        for name, stores in data.items():
+            space = self.get(name)
+            space.telemetry.load(stores.get("telemetry", {}))
+            space.commands.load(stores.get("commands", {}))
+            space.state.load(stores.get("state", {}))
+            space.bars.load(stores.get("bars", []))
+
+    def info(self) -> dict:
+        return {name: space.info() for name, space in self._spaces.items()}
+
+
+namespaces = Namespaces()
@@ -0,0 +1,155 @@
+"""
+OTS Hub — Ownership (roteamento por conta/symbol)
+
+Connectors declaram no auth as contas e symbols que possuem; executors,
+os que operam:
+
+    {"type": "auth", "payload": {"token": "...", "role": "connector",
+                                 "accounts": ["123456"], "symbols": ["EURUSD"]}}
+
+- order_command vai ponto a ponto ao dono da conta (ou, sem conta, do
+  symbol). Sem dono, vai aos connectors que não declararam posse (legado)
+- order_result / position_event / account_update vão só aos executors
+  interessados (conta ou symbol) e aos que não declararam nada. Se nenhum
+  executor declarou, segue o broadcast para todos
+
+Conflito: dois connectors reivindicando a mesma conta/symbol. O primeiro
+continua dono, o conflito é logado, publicado no event bus e devolvido
+no ack de auth; quando o dono sai, o próximo reivindicante assume.
+"""
+
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.modules.events.service import event_bus
+from app.modules.metrics.service import metrics
+
+logger = logging.getLogger("hub.ownership")
+
+_KINDS = ("account", "symbol")
+
+
+def _normalize(kind: str, values: Optional[Iterable]) -> Set[str]:
+    if not isinstance(values, (list, tuple, set)):
+        return set()
+    out = {str(v).strip() for v in values if v is not None and str(v).strip()}
+    return {v.upper() for v in out} if kind == "symbol" else out
+
+
+def _key(kind: str, value) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    value = str(value).strip()
+    return value.upper() if kind == "symbol" else value
+
+
+class OwnershipIndex:
+    """Índices conta/symbol → connectors (em ordem de reivindicação) e → executors."""
+
+    def __init__(self):
+        # kind → valor → connectors na ordem em que reivindicaram (o 1º é o dono)
+        self._claims: Dict[str, Dict[str, List[str]]] = {k: {} for k in _KINDS}
+        # kind → valor → executors interessados
+        self._interest: Dict[str, Dict[str, Set[str]]] = {k: {} for k in _KINDS}
+        # instance_id → {"role", "account": set, "symbol": set}
+        self._declared: Dict[str, dict] = {}
+        # Executors autenticados sem declaração (recebem tudo)
+        self._wildcard_executors: Set[str] = set()
+
+    def declare(self, instance_id: str, role: str, accounts=None, symbols=None) -> List[dict]:
+        """Registra a declaração do auth. Retorna os conflitos gerados."""
+        self.remove(instance_id)
+        declared = {"role": role, "account": _normalize("account", accounts),
+                    "symbol": _normalize("symbol", symbols)}
+        if role == "executor" and not (declared["account"] or declared["symbol"]):
+            self._wildcard_executors.add(instance_id)
+            return []
+        if role not in ("connector", "executor") or not (declared["account"] or declared["symbol"]):
+            return []
+        self._declared[instance_id] = declared
+
+        conflicts = []
+        for kind in _KINDS:
+            for value in declared[kind]:
+                if role == "executor":
+                    self._interest[kind].setdefault(value, set()).add(instance_id)
+                    continue
+                claimants = self._claims[kind].setdefault(value, [])
+                if claimants:
+                    conflicts.append({"kind": kind, "value": value,
+                                      "owner": claimants[0], "claimant": instance_id})
+                claimants.append(instance_id)
+
+        for conflict in conflicts:
+            logger.warning(f"Ownership conflict: {conflict['kind']} {conflict['value']} owned by "
+                           f"{conflict['owner']}, also claimed by {conflict['claimant']}")
+            metrics.incr("ownership.conflicts")
+            event_bus.publish("ownership_conflict", conflict)
+        return conflicts
+
+    def remove(self, instance_id: str):
+        self._wildcard_executors.discard(instance_id)
+        declared = self._declared.pop(instance_id, None)
+        if declared is None:
+            return
+        index = self._interest if declared["role"] == "executor" else self._claims
+        for kind in _KINDS:
+            for value in declared[kind]:
+                holders = index[kind].get(value)
+                if holders is None:
+                    continue
+                if isinstance(holders, list):
+                    holders.remove(instance_id)
+                else:
+                    holders.discard(instance_id)
+                if not holders:
+                    del index[kind][value]
+
+    # ── Consultas (O(1) por mensagem) ─────────────────────
+
+    def owner_of(self, account=None, symbol=None) -> Optional[str]:
+        """Connector dono da conta (preferência) ou do symbol."""
+        for kind, value in (("account", account), ("symbol", symbol)):
+            key = _key(kind, value)
+            claimants = self._claims[kind].get(key) if key else None
+            if claimants:
+                return claimants[0]
+        return None
+
+    def is_claimant(self, instance_id: str) -> bool:
+        declared = self._declared.get(instance_id)
+        return bool(declared and declared["role"] == "connector")
+
+    def executors_for(self, connector_id: str, payload: dict) -> Optional[Set[str]]:
+        """Executors que devem receber tráfego do connector; None = broadcast."""
+        if not self._interest["account"] and not self._interest["symbol"]:
+            return None
+        accounts = {_key("account", payload.get("account") or payload.get("login"))}
+        connector = self._declared.get(connector_id)
+        if connector and not payload.get("account"):
+            accounts |= connector["account"]
+        targets = set(self._wildcard_executors)
+        for account in accounts:
+            targets |= self._interest["account"].get(account, set())
+        symbol = _key("symbol", payload.get("symbol"))
+        if symbol:
+            targets |= self._interest["symbol"].get(symbol, set())
+        return targets
+
+    def conflicts(self) -> List[dict]:
+        return [{"kind": kind, "value": value, "owner": claimants[0], "claimants": claimants[1:]}
+                for kind in _KINDS for value, claimants in self._claims[kind].items()
+                if len(claimants) > 1]
+
+    def info(self) -> dict:
+        return {
+            "accounts": {v: c[0] for v, c in self._claims["account"].items()},
+            "symbols": {v: c[0] for v, c in self._claims["symbol"].items()},
+            "executors": {iid: {k: sorted(d[k]) for k in _KINDS}
+                          for iid, d in self._declared.items() if d["role"] == "executor"},
+            "wildcard_executors": sorted(self._wildcard_executors),
+            "conflicts": self.conflicts(),
+        }
+
+
+ownership = OwnershipIndex()
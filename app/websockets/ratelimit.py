@@ -0,0 +1,155 @@
+"""
+OTS Hub — Rate Limiting
+
+Token buckets por conexão e por type de mensagem, configuráveis por role.
+
+Ações ao estourar o limite:
+  soft — descarta a mensagem e avisa o cliente (no máx. 1 aviso/s)
+  hard — desconecta o cliente (código 4029)
+  slow — atrasa o processamento; como o loop do endpoint só lê o próximo
+         frame depois que route_message retorna, o socket deixa de ser
+         lido e o TCP aplica backpressure no cliente
+
+Configuração (RATE_LIMITS, JSON), sobrepõe DEFAULT_RATE_LIMITS por role:
+  {"connector": {"action": "slow", "*": [500, 1000], "bar": [200, 400]}}
+onde "*" é o bucket da conexão e [rate/s, burst] os parâmetros do bucket.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.modules.metrics.service import metrics
+
+logger = logging.getLogger("hub.ratelimit")
+
+SOFT, HARD, SLOW = "soft", "hard", "slow"
+
+DEFAULT_RATE_LIMITS: Dict[str, dict] = {
+    # Antes do auth: poucos frames bastam
+    "unknown":   {"action": HARD, "*": [5, 10]},
+    "connector": {"action": SLOW, "*": [500, 1000]},
+    "preditor":  {"action": SOFT, "*": [200, 400]},
+    "executor":  {"action": SOFT, "*": [200, 400], "order_command": [50, 100]},
+    "dashboard": {"action": SOFT, "*": [20, 50], "command": [5, 10]},
+    "admin":     {"action": SOFT, "*": [50, 100], "command": [10, 20]},
+    "bot":       {"action": SOFT, "*": [100, 200]},
+}
+
+# Atraso máximo aplicado por mensagem no modo slow
+_MAX_SLOW_WAIT = 5.0
+
+
+class TokenBucket:
+    """Token bucket clássico: `rate` tokens/s, capacidade `burst`."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def deficit(self, now: float) -> float:
+        """Segundos até haver 1 token (0 se disponível agora)."""
+        self._refill(now)
+        # Tolerância para o erro de ponto flutuante do refill (ex.: 0.1 s × 10/s)
+        if self.tokens >= 1.0 - 1e-9:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self):
+        # Pode ficar negativo no modo slow (reserva de tokens futuros)
+        self.tokens -= 1.0
+
+
+def limits_for(role: str) -> dict:
+    base = DEFAULT_RATE_LIMITS.get(role, DEFAULT_RATE_LIMITS["bot"])
+    override = (settings.RATE_LIMITS or {}).get(role, {})
+    return {**base, **override}
+
+
+class ConnectionLimiter:
+    """Buckets de uma conexão (um por conexão + um por type configurado)."""
+
+    __slots__ = ("role", "action", "_limits", "_buckets", "hits", "_last_warn")
+
+    def __init__(self, role: str):
+        self.role = role
+        self._limits = limits_for(role)
+        self.action: str = self._limits.get("action", SOFT)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.hits: int = 0
+        self._last_warn: float = 0.0
+
+    def _bucket(self, key: str) -> Optional[TokenBucket]:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            params = self._limits.get(key)
+            if not params:
+                return None
+            bucket = self._buckets[key] = TokenBucket(*params)
+        return bucket
+
+    def check(self, msg_type: str, now: float) -> Tuple[float, list]:
+        """Retorna (espera necessária em s, buckets envolvidos)."""
+        buckets = [b for b in (self._bucket("*"), self._bucket(msg_type or "")) if b]
+        wait = max((b.deficit(now) for b in buckets), default=0.0)
+        return wait, buckets
+
+    def should_warn(self, now: float) -> bool:
+        if now - self._last_warn >= 1.0:
+            self._last_warn = now
+            return True
+        return False
+
+
+async def admit(conn, msg_type: str) -> Optional[str]:
+    """
+    Aplica o rate limit da conexão para uma mensagem.
+
+    Returns:
+        None se a mensagem deve ser processada; SOFT se deve ser
+        descartada com aviso; "" se descartada silenciosamente;
+        HARD se a conexão deve ser encerrada.
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return None
+
+    limiter = conn.limiter
+    if limiter is None or limiter.role != conn.role:
+        limiter = conn.limiter = ConnectionLimiter(conn.role)
+
+    now = time.monotonic()
+    wait, buckets = limiter.check(msg_type, now)
+    if wait <= 0:
+        for b in buckets:
+            b.consume()
+        return None
+
+    limiter.hits += 1
+    metrics.incr(f"ratelimit.{limiter.action}")
+    metrics.incr(f"ratelimit.role.{conn.role}")
+
+    if limiter.action == SLOW and wait <= _MAX_SLOW_WAIT:
+        for b in buckets:
+            b.consume()
+        await asyncio.sleep(wait)
+        return None
+
+    if limiter.action == HARD:
+        logger.warning(f"Rate limit (hard) for {conn.instance_id} on '{msg_type}', disconnecting")
+        return HARD
+
+    if limiter.should_warn(now):
+        logger.warning(f"Rate limit (soft) for {conn.instance_id} on '{msg_type}', dropping")
+        return SOFT
+    return ""
@@ -5,27 +5,69 @@ Dispatcher central: parseia JSON, roteia por type.
 
 Roteamento v3 (processos independentes):
   bar            → connector publica,  preditor recebe
+                   (+ barras derivadas M5/H1/... para quem fez bar_subscribe)
   signal         → preditor publica,   executor + dashboard recebe
   order_command  → executor publica,   connector recebe
   order_result   → connector publica,  executor + dashboard recebe
   position_event → connector publica,  executor + dashboard recebe
   account_update → connector publica,  executor + dashboard recebe
   history_response → connector publica, preditor recebe
+  history_chunk_*  → connector publica, preditor recebe (ver chunks.py)
 
 Roles: preditor, executor, connector, dashboard, admin, bot (legacy)
+
+Namespaces (escolhido no auth — ver namespaces.py): todo roteamento fica
+  dentro do namespace do remetente.
+
+Ownership (opcional, declarado no auth — ver ownership.py):
+  order_command vai só ao connector dono da conta/symbol; order_result,
+  position_event e account_update só aos executors interessados.
+
+Entrega conflacionada (opt-in no auth com "conflate": true):
+  account_update, position_event e telemetry são entregues apenas com o
+  valor mais recente por (type, from, symbol) para o assinante.
+
+TTL por type (ver ttl.py): mensagens velhas não são repassadas.
 """
 
 import json
 import logging
 import time
-
-from app.modules.auth.service import validate_token
-from app.modules.telemetry.service import telemetry_store
-from app.modules.commands.service import command_router
+from typing import Optional
+
+from app.core.config import settings
+from app.modules.auth.service import (
+    DEFAULT_NAMESPACE, issue_resume_ticket, validate_token, verify_resume_ticket,
+)
+from app.modules.bars.service import history_columns
+from app.modules.metrics.service import metrics
+from app.websockets.accounting import frame_limit
+from app.websockets.chunks import CHUNK_TYPES, chunk_transfers
+from app.websockets.codec import decode_offloaded
+from app.websockets.compression import COMPRESSIBLE_TYPES, Outbound, negotiate
+from app.websockets.dedup import order_dedup
+from app.websockets.heartbeat import record_pong
 from app.websockets.manager import manager
+from app.websockets.namespaces import namespaces
+from app.websockets.ratelimit import HARD, SOFT, admit
+from app.websockets.ttl import Expiry, expiry_for
 
 logger = logging.getLogger("hub.router")
 
+# Types cujo estado mais recente substitui os anteriores (conflacionáveis)
+CONFLATABLE_TYPES = {"account_update", "position_event", "telemetry"}
+
+# Roles que recebem state_snapshot logo após o ack de auth
+SNAPSHOT_ROLES = {"executor", "dashboard", "admin"}
+
+# Types roteados; os demais (vindos do cliente) contam como "other" em
+# métricas e accounting, para não criar uma chave por type inventado
+ROUTED_TYPES = {
+    "auth", "pong", "bar", "bar_subscribe", "bar_unsubscribe", "signal",
+    "order_command", "order_result", "position_event", "account_update",
+    "history_response", "telemetry", "ack", "command",
+} | CHUNK_TYPES
+
 
 async def route_message(raw_data: str, instance_id: str) -> str:
     """
@@ -34,26 +76,91 @@ async def route_message(raw_data: str, instance_id: str) -> str:
     Returns:
         JSON string com resposta, ou "" se fire-and-forget.
     """
+    conn = manager.get(instance_id)
+    limit = frame_limit(conn.role if conn else "unknown")
+    # Tamanho em caracteres; UTF-8 usa até 4 bytes por caractere, então só
+    # codifica (cópia do frame) quando ele pode passar do limite
+    size = len(raw_data)
+    if size * 4 > limit:
+        size = len(raw_data.encode())
+    if size > limit:
+        metrics.incr("frames.oversized")
+        if conn:
+            conn.stats.record_in("oversized", size)
+        logger.warning(f"Oversized frame from {instance_id}: {size} bytes")
+        return _error(f"Frame too large ({size} > {limit})", code=4009)
+
+    # Frames grandes: decode (e envelope de forward) fora do event loop
+    forward = history = None
     try:
-        data = json.loads(raw_data)
-    except json.JSONDecodeError:
+        if size > settings.OFFLOAD_FRAME_BYTES:
+            metrics.incr("frames.offloaded")
+            data, forward, history = await decode_offloaded(
+                raw_data, instance_id, time.time(), workers=settings.DECODE_WORKERS)
+        else:
+            data = json.loads(raw_data)
+    except ValueError:
         return _error("Invalid JSON")
 
     msg_type = data.get("type")
     payload = data.get("payload", {})
     msg_id = data.get("id", "")
+    counted_type = msg_type if msg_type in ROUTED_TYPES else "other"
 
     conn = manager.get(instance_id)
     if conn:
+        conn.stats.record_in(counted_type, size)
         conn.last_message_at = time.time()
+        _observe_inbound_latency(conn, data.get("timestamp"))
+
+        verdict = await admit(conn, msg_type)
+        if verdict == HARD:
+            await _disconnect_flooder(instance_id)
+            return ""
+        if verdict == SOFT:
+            return _error("Rate limit exceeded", ref_id=msg_id, code=4029)
+        if verdict is not None:
+            return ""
 
     # ── AUTH ──────────────────────────────────────────────
     if msg_type == "auth":
         token = payload.get("token", "")
-        role = payload.get("role", "bot")
-        if validate_token(token):
-            manager.authenticate(instance_id, role)
-            return _ack(msg_id, "authenticated", {"instance_id": instance_id, "role": role})
+        namespace = str(payload.get("namespace") or DEFAULT_NAMESPACE)
+        # Resume ticket (re-auth rápida): role vem do ticket assinado
+        resume = payload.get("resume")
+        resumed_role = verify_resume_ticket(resume, instance_id, namespace) if resume else None
+        role = resumed_role or payload.get("role", "bot")
+        if resumed_role or validate_token(token, namespace):
+            space = namespaces.get(namespace)
+            if not space.admits(instance_id):
+                space.metrics.incr("auth.rejected_limit")
+                return _error(f"Namespace {namespace} connection limit reached",
+                              ref_id=msg_id, code=4013)
+            if resumed_role:
+                metrics.incr("auth.resumed")
+            if conn and conn.authenticated and conn.namespace != namespace:
+                previous = namespaces.get(conn.namespace)
+                previous.ownership.remove(instance_id)
+                previous.resampler.remove(instance_id)
+            codec = negotiate(payload.get("compression"))
+            shm_bars = bool(payload.get("shm_bars", False)) and settings.SHM_BARS_ENABLED
+            manager.authenticate(instance_id, role, conflate=bool(payload.get("conflate", False)),
+                                 compression=codec, shm_bars=shm_bars, namespace=namespace)
+            result = {"instance_id": instance_id, "role": role}
+            if namespace != DEFAULT_NAMESPACE:
+                result["namespace"] = namespace
+            conflicts = space.ownership.declare(instance_id, role, payload.get("accounts"),
+                                                payload.get("symbols"))
+            if conflicts:
+                result["conflicts"] = conflicts
+            if codec:
+                result["compression"] = codec
+            if shm_bars:
+                result["shm_bars"] = True
+            ticket = issue_resume_ticket(instance_id, role, namespace)
+            if ticket:
+                result["resume_ticket"], result["resume_expires_at"] = ticket
+            return _ack(msg_id, "authenticated", result)
         else:
             return _error("Invalid token", ref_id=msg_id, code=4001)
 
@@ -61,52 +168,160 @@ async def route_message(raw_data: str, instance_id: str) -> str:
     if not manager.is_authenticated(instance_id):
         return _error("Not authenticated. Send 'auth' first.", ref_id=msg_id, code=4001)
 
+    space = namespaces.get(conn.namespace)
+    space.metrics.incr(f"messages.{counted_type}")
+    ns = space.name
+
+    # ── PONG (resposta ao heartbeat do Hub) ──────────────
+    if msg_type == "pong":
+        record_pong(conn, payload, data.get("timestamp"))
+        return ""
+
+    # TTL: prazo de validade do forward (None = type sem TTL)
+    expiry = expiry_for(msg_type, data, conn.last_message_at, conn.clock_offset_ms)
+    deadline = expiry.deadline if expiry else None
+    stale = expiry is not None and expiry.passed()
+    if stale:
+        metrics.incr(f"ttl.expired.{msg_type}")
+
     # =================================================================
     # PIPELINE v3 — processos se comunicam via Hub
     # =================================================================
 
     # ── BAR (connector → preditor) ────────────────────────
     if msg_type == "bar":
-        await manager.broadcast(_envelope("bar", instance_id, payload), role="preditor")
-        return ""
+        dropped = 0
+        in_shm = settings.SHM_BARS_ENABLED and space.bar_rings.publish(
+            payload, settings.SHM_RING_CAPACITY)
+        if not stale:
+            dropped = await manager.broadcast(
+                _envelope("bar", instance_id, payload), role="preditor", namespace=ns,
+                predicate=_not_shm_reader if in_shm else None, deadline=deadline)
+        space.bars.add_bar(payload)
+        for derived, subscribers in space.resampler.process(instance_id, payload):
+            space.bars.add_bar(derived)
+            if settings.SHM_BARS_ENABLED:
+                space.bar_rings.publish(derived, settings.SHM_RING_CAPACITY)
+            fwd = _envelope("bar", instance_id, derived)
+            for sub_id in list(subscribers):
+                await manager.send(sub_id, fwd)
+        return _expired(msg_id, expiry, stale, dropped)
+
+    # ── BAR_SUBSCRIBE / BAR_UNSUBSCRIBE (timeframes derivados) ──
+    if msg_type == "bar_subscribe":
+        symbol = payload.get("symbol")
+        if not symbol:
+            return _error("bar_subscribe requires 'symbol'", ref_id=msg_id)
+        accepted = space.resampler.subscribe(instance_id, symbol, payload.get("timeframes", []))
+        return _ack(msg_id, "subscribed", {"symbol": symbol, "timeframes": accepted})
+
+    if msg_type == "bar_unsubscribe":
+        space.resampler.unsubscribe(instance_id, payload.get("symbol"), payload.get("timeframes"))
+        return _ack(msg_id, "unsubscribed")
 
     # ── SIGNAL (preditor → executor + dashboard) ──────────
     if msg_type == "signal":
-        fwd = _envelope("signal", instance_id, payload)
-        await manager.broadcast(fwd, role="executor")
-        await manager.broadcast(fwd, role="dashboard")
-        await manager.broadcast(fwd, role="admin")
-        return ""
+        if stale:
+            return _expired(msg_id, expiry, stale)
+        fwd = Outbound(_envelope("signal", instance_id, payload), deadline=deadline)
+        dropped = 0
+        for role in ("executor", "dashboard", "admin"):
+            dropped += await manager.broadcast(fwd, role=role, namespace=ns)
+        return _expired(msg_id, expiry, stale, dropped)
 
     # ── ORDER_COMMAND (executor → connector) ──────────────
     if msg_type == "order_command":
-        await manager.broadcast(_envelope("order_command", instance_id, payload), role="connector")
-        return ""
+        # Retry do executor (reconexão): responde com o resultado já visto
+        key = payload.get("idempotency_key") or msg_id
+        dedup_key = (instance_id, key)
+        if key:
+            seen = order_dedup.check(dedup_key, msg_id or key)
+            if seen is not None:
+                metrics.incr("dedup.order_command")
+                if seen.result:
+                    return seen.result
+                return _ack(msg_id, "duplicate", {"ref_id": seen.ref_id, "state": "in_flight"})
+        if stale:
+            order_dedup.discard(dedup_key)
+            return _expired(msg_id, expiry, stale)
+        fwd = Outbound(_envelope("order_command", instance_id, payload, msg_id=msg_id),
+                       deadline=deadline)
+        owner = space.ownership.owner_of(payload.get("account"), payload.get("symbol"))
+        if owner:
+            targets = [owner]
+        else:
+            # Sem dono declarado: connectors legados (que não declararam posse)
+            targets = [iid for iid in manager.get_by_role("connector", ns)
+                       if not space.ownership.is_claimant(iid)]
+        dropped = await manager.broadcast(fwd, role="connector", namespace=ns, targets=targets)
+        if key:
+            # Só fica registrada a ordem que chegou a algum connector
+            if fwd.delivered:
+                order_dedup.bind(dedup_key, ((ns, iid) for iid in targets))
+            else:
+                order_dedup.discard(dedup_key)
+        return _expired(msg_id, expiry, stale, dropped)
 
     # ── ORDER_RESULT (connector → executor + dashboard) ───
     if msg_type == "order_result":
+        if msg_id and order_dedup.check((instance_id, "order_result", msg_id)) is not None:
+            metrics.incr("dedup.order_result")
+            return ""
+        space.state.apply("order_result", instance_id, payload)
         fwd = _envelope("order_result", instance_id, payload)
-        await manager.broadcast(fwd, role="executor")
-        await manager.broadcast(fwd, role="dashboard")
-        return ""
+        if payload.get("ref_id"):
+            order_dedup.attach_result((ns, instance_id), payload["ref_id"], fwd)
+        if stale:
+            return _expired(msg_id, expiry, stale)
+        out = Outbound(fwd, deadline=deadline)
+        dropped = await manager.broadcast(
+            out, role="executor", namespace=ns,
+            targets=space.ownership.executors_for(instance_id, payload))
+        dropped += await manager.broadcast(out, role="dashboard", namespace=ns)
+        return _expired(msg_id, expiry, stale, dropped)
 
     # ── POSITION_EVENT (connector → executor + dashboard) ─
     if msg_type == "position_event":
-        fwd = _envelope("position_event", instance_id, payload)
-        await manager.broadcast(fwd, role="executor")
-        await manager.broadcast(fwd, role="dashboard")
-        return ""
+        space.state.apply("position_event", instance_id, payload)
+        if stale:
+            return _expired(msg_id, expiry, stale)
+        fwd = Outbound(_envelope("position_event", instance_id, payload), deadline=deadline)
+        key = _conflation_key("position_event", instance_id, payload)
+        dropped = await manager.broadcast(
+            fwd, role="executor", namespace=ns, conflate_key=key,
+            targets=space.ownership.executors_for(instance_id, payload))
+        dropped += await manager.broadcast(fwd, role="dashboard", namespace=ns, conflate_key=key)
+        return _expired(msg_id, expiry, stale, dropped)
 
     # ── ACCOUNT_UPDATE (connector → executor + dashboard) ─
     if msg_type == "account_update":
-        fwd = _envelope("account_update", instance_id, payload)
-        await manager.broadcast(fwd, role="executor")
-        await manager.broadcast(fwd, role="dashboard")
-        return ""
+        space.state.apply("account_update", instance_id, payload)
+        if stale:
+            return _expired(msg_id, expiry, stale)
+        fwd = Outbound(_envelope("account_update", instance_id, payload), deadline=deadline)
+        key = _conflation_key("account_update", instance_id, payload)
+        dropped = await manager.broadcast(
+            fwd, role="executor", namespace=ns, conflate_key=key,
+            targets=space.ownership.executors_for(instance_id, payload))
+        dropped += await manager.broadcast(fwd, role="dashboard", namespace=ns, conflate_key=key)
+        return _expired(msg_id, expiry, stale, dropped)
 
     # ── HISTORY_RESPONSE (connector → preditor) ───────────
     if msg_type == "history_response":
-        await manager.broadcast(_envelope("history_response", instance_id, payload), role="preditor")
+        fwd = forward or _envelope("history_response", instance_id, payload)
+        await manager.broadcast(fwd, role="preditor", namespace=ns, compressible=True)
+        space.bars.add_history(history or history_columns(payload))
+        return ""
+
+    # ── HISTORY_CHUNK_* (connector → preditor, em streaming) ──
+    if msg_type in CHUNK_TYPES:
+        fwd_payload, err = chunk_transfers.process(msg_type, instance_id, payload)
+        if fwd_payload is not None:
+            fwd_type = msg_type if not err else "history_chunk_end"
+            await manager.broadcast(_envelope(fwd_type, instance_id, fwd_payload), role="preditor",
+                                    namespace=ns, compressible=fwd_type in COMPRESSIBLE_TYPES)
+        if err:
+            return _error(err, ref_id=msg_id)
         return ""
 
     # =================================================================
@@ -115,15 +330,17 @@ async def route_message(raw_data: str, instance_id: str) -> str:
 
     # ── TELEMETRY ────────────────────────────────────────
     if msg_type == "telemetry":
-        result = await telemetry_store.process(instance_id, payload)
-        fwd = _envelope("telemetry", instance_id, payload)
-        await manager.broadcast(fwd, role="dashboard")
-        await manager.broadcast(fwd, role="admin")
+        result = await space.telemetry.process(instance_id, payload)
+        # Um Outbound para as duas roles: comprimido uma vez por codec
+        fwd = Outbound(_envelope("telemetry", instance_id, payload), compressible=True)
+        key = _conflation_key("telemetry", instance_id, payload)
+        await manager.broadcast(fwd, role="dashboard", namespace=ns, conflate_key=key)
+        await manager.broadcast(fwd, role="admin", namespace=ns, conflate_key=key)
         return _ack(msg_id, "telemetry_ok", result)
 
     # ── ACK (resposta de comando) ────────────────────────
     if msg_type == "ack":
-        origin_id, response = command_router.process_ack(instance_id, payload)
+        origin_id, response = space.commands.process_ack(instance_id, payload)
         if origin_id and response:
             fwd = json.dumps({"type": "ack", "timestamp": time.time(), "payload": response})
             await manager.send(origin_id, fwd)
@@ -144,14 +361,21 @@ async def route_message(raw_data: str, instance_id: str) -> str:
 
         if not target:
             for role in ("connector", "executor", "preditor", "bot"):
-                candidates = [c for c in manager.get_by_role(role) if c != instance_id]
+                candidates = [c for c in manager.get_by_role(role, ns) if c != instance_id]
                 if candidates:
                     target = candidates[0]
                     break
             if not target:
                 return _error("No target connected", ref_id=msg_id)
+        elif namespaces.of(target) is not space:
+            # Comandos não cruzam namespaces
+            return _error(f"Target {target} not connected", ref_id=msg_id)
+
+        if not space.accepts_command():
+            space.metrics.incr("commands.rejected_limit")
+            return _error(f"Namespace {ns} pending command limit reached", ref_id=msg_id, code=4013)
 
-        cmd = command_router.create_command(action, target, instance_id, params, original_msg_id=msg_id)
+        cmd = space.commands.create_command(action, target, instance_id, params, original_msg_id=msg_id)
         if not cmd:
             return _error(f"Invalid action: {action}", ref_id=msg_id)
 
@@ -164,17 +388,86 @@ async def route_message(raw_data: str, instance_id: str) -> str:
     return _error(f"Unknown type: {msg_type}", ref_id=msg_id)
 
 
+def state_snapshot(instance_id: str) -> str:
+    """
+    Snapshot de estado (conta + posições por connector) para late-join.
+
+    Returns:
+        JSON string `state_snapshot`, ou "" se a role não recebe snapshot.
+    """
+    conn = manager.get(instance_id)
+    if not conn or not conn.authenticated or conn.role not in SNAPSHOT_ROLES:
+        return ""
+    return json.dumps({
+        "type": "state_snapshot",
+        "timestamp": time.time(),
+        "payload": {"connectors": namespaces.get(conn.namespace).state.snapshot()},
+    })
+
+
 # =================================================================
 # Helpers
 # =================================================================
 
-def _envelope(msg_type: str, from_id: str, payload: dict) -> str:
-    return json.dumps({
+def _envelope(msg_type: str, from_id: str, payload: dict, msg_id: str = "") -> str:
+    envelope = {
         "type": msg_type,
         "from": from_id,
         "payload": payload,
         "timestamp": time.time(),
-    })
+    }
+    if msg_id:
+        envelope["id"] = msg_id
+    return json.dumps(envelope)
+
+
+async def _disconnect_flooder(instance_id: str):
+    conn = manager.get(instance_id)
+    manager.disconnect(instance_id)
+    if conn:
+        try:
+            await conn.websocket.close(code=4029, reason="Rate limit exceeded")
+        except Exception:
+            pass
+
+
+def _not_shm_reader(conn) -> bool:
+    return not conn.shm_bars
+
+
+def _observe_inbound_latency(conn, client_ts) -> None:
+    """Latência cliente → Hub, corrigida pelo offset de relógio estimado."""
+    if conn.clock_offset_ms is None or not isinstance(client_ts, (int, float)):
+        return
+    latency_ms = (conn.last_message_at - client_ts) * 1000.0 + conn.clock_offset_ms
+    metrics.observe("inbound_latency_ms", max(0.0, latency_ms))
+
+
+def _expired(msg_id: str, expiry: Optional[Expiry], stale: bool, dropped: int = 0) -> str:
+    """Ack `expired` ao publicador (se pedido) quando o forward foi descartado por TTL."""
+    if expiry is None or not expiry.report or not (stale or dropped):
+        return ""
+    result = expiry.describe()
+    if not stale:
+        result["dropped"] = dropped
+    return _ack(msg_id, "expired", result)
+
+
+def _conflation_key(msg_type: str, from_id: str, payload: dict) -> Optional[tuple]:
+    """
+    Chave de conflação: (type, origem, symbol opcional). None se não conflacionável.
+
+    position_event inclui a posição (ticket/position_id, como no StateStore):
+    posições diferentes do mesmo symbol não se substituem.
+    """
+    if msg_type not in CONFLATABLE_TYPES:
+        return None
+    if not isinstance(payload, dict):
+        return (msg_type, from_id, None)
+    if msg_type == "position_event":
+        return (msg_type, from_id, payload.get("symbol"),
+                payload.get("ticket") or payload.get("position_id"))
+    return (msg_type, from_id, payload.get("symbol"))
 
 
 def _ack(ref_id: str, status: str, result: dict = None) -> str:
@@ -0,0 +1,113 @@
+"""
+OTS Hub — Sessão de conexão
+
+Ciclo de vida comum a todos os transportes (WebSocket, Unix socket, TCP):
+handshake de auth, snapshot de late-join, loop de mensagens e limpeza.
+O transporte só precisa expor a interface usada do WebSocket do Starlette
+(accept, receive_text, send_text, send_bytes, close) e levantar
+WebSocketDisconnect ao desconectar.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi import WebSocketDisconnect
+
+from app.core.config import settings
+from app.websockets.admission import admission
+from app.websockets.chunks import chunk_transfers
+from app.websockets.heartbeat import heartbeat
+from app.websockets.manager import manager
+from app.websockets.namespaces import namespaces
+from app.websockets.router import route_message, state_snapshot
+
+logger = logging.getLogger("hub.session")
+
+
+async def serve_session(websocket, instance_id: str, first_message: Optional[str] = None,
+                        role: Optional[str] = None):
+    """
+    Executa a sessão de uma conexão até desconectar.
+
+    Protocolo:
+    1. Aguarda slot de handshake (prioridade por `role`, ver admission.py)
+    2. Conecta
+    3. DEVE enviar 'auth' em AUTH_TIMEOUT segundos (ou já tê-lo enviado
+       em `first_message`, caso do transporte stream)
+    4. Loop: envia/recebe mensagens
+    """
+    if manager.draining:
+        # Restart em andamento: cliente deve reconectar no processo novo
+        await websocket.close(code=1012, reason="Service restart")
+        return
+
+    if not await admission.acquire(role, timeout=settings.ADMISSION_WAIT_S):
+        await websocket.close(code=1013, reason="Try again later")
+        return
+    handshaking = True
+
+    try:
+        info = await manager.connect(websocket, instance_id)
+    except Exception:
+        admission.release()
+        raise
+    restarting = False
+
+    try:
+        # Auth Handshake
+        try:
+            raw = first_message
+            if raw is None:
+                raw = await asyncio.wait_for(websocket.receive_text(), timeout=settings.AUTH_TIMEOUT)
+            response = await route_message(raw, instance_id)
+            if response:
+                await manager.reply(websocket, instance_id, response)
+
+            if not manager.is_authenticated(instance_id):
+                logger.warning(f"Auth failed for {instance_id}, closing")
+                await websocket.close(code=4001, reason="Unauthorized")
+                return
+
+            heartbeat.track(instance_id)
+
+            # Late-join: estado atual logo após o ack
+            snapshot = state_snapshot(instance_id)
+            if snapshot:
+                await manager.send(instance_id, snapshot, compressible=True)
+
+            admission.release()
+            handshaking = False
+
+        except asyncio.TimeoutError:
+            logger.warning(f"Auth timeout for {instance_id}")
+            await websocket.close(code=4001, reason="Auth timeout")
+            return
+
+        # Message Loop
+        while True:
+            raw = await websocket.receive_text()
+            response = await route_message(raw, instance_id)
+            if response:
+                await manager.reply(websocket, instance_id, response)
+
+    except WebSocketDisconnect as e:
+        # 1012: o próprio servidor está reiniciando
+        restarting = e.code == 1012
+    except Exception as e:
+        logger.error(f"Error with {instance_id}: {e}")
+    finally:
+        if handshaking:
+            admission.release()
+        # Reconexão com o mesmo instance_id substituiu esta sessão: o id
+        # (conexão, ownership, estado) agora é da sessão nova
+        if manager.get(instance_id) in (None, info):
+            space = namespaces.get(info.namespace)
+            manager.disconnect(instance_id)
+            if not (restarting or manager.draining):
+                # No restart o estado fica para o snapshot (app/websockets/drain.py)
+                space.telemetry.remove(instance_id)
+                space.state.remove(instance_id)
+            chunk_transfers.drop_owner(instance_id)
+            space.ownership.remove(instance_id)
+            space.resampler.remove(instance_id)
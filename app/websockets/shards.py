@@ -0,0 +1,456 @@
+"""
+OTS Hub — Loop shards (conexões em múltiplos event loops)
+
+Com LOOP_SHARDS = N > 0, N threads, cada uma com seu event loop,
+compartilham os sockets de escuta (o kernel distribui os accepts):
+
+- stream (Unix socket / TCP): cada shard é dono da E/S das suas conexões
+  — leitura e parsing de frames, parsing do auth, framing e escrita/drain
+  de saída, com registro próprio (`LoopShard.connections`)
+- HTTP/WebSocket (só com `python -m app.main`, que faz o bind e deixa o
+  uvicorn do loop principal sem listener): cada shard roda o protocolo do
+  uvicorn — parsing HTTP, handshake, frames WebSocket, compressão
+  permessage-deflate, escrita — com registro próprio de conexões
+  (`server_state` do uvicorn). A app ASGI roda no loop principal via
+  `AsgiBridge`: cada receive/send atravessa para o shard dono do socket.
+
+Roteamento, ConnectionManager, índices e stores continuam no loop
+principal (compartilhados, read-mostly). A passagem entre loops usa
+`Handoff`: deque (append/popleft atômicos sob o GIL, sem lock) + wake-up
+coalescido via call_soon_threadsafe — uma notificação por rajada, não
+por mensagem.
+
+As filas são limitadas (LOOP_SHARD_QUEUE mensagens por conexão e
+direção), com o mesmo backpressure de um socket lento:
+- saída cheia: o envio no loop principal espera o shard escrever (como o
+  send de um WebSocket espera o socket); os bytes ainda não escritos
+  contam em ConnectionStats/MemoryBudget
+- entrada cheia: o shard para de ler o socket e o TCP segura o cliente
+  (é o que faz a ação `slow` do rate limit funcionar também aqui)
+
+Sob o GIL o ganho vem da E/S, do protocolo e das syscalls fora do loop
+principal; o roteamento em si segue serial.
+"""
+
+import asyncio
+import logging
+import socket
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+from fastapi import WebSocketDisconnect
+
+from app.core.config import settings
+from app.websockets.accounting import ConnectionStats
+from app.websockets.session import serve_session
+from app.websockets.stream import StreamConnection, read_auth
+
+logger = logging.getLogger("hub.shards")
+
+
+class Handoff:
+    """
+    Fila entre threads: produtor em `producer_loop`, consumidor no `loop`.
+
+    Com `maxsize`, o produtor espera espaço em `wait_space()`; `put()` nunca
+    bloqueia (controle — close/disconnect — sempre passa).
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int = 0,
+                 producer_loop: Optional[asyncio.AbstractEventLoop] = None):
+        self._loop = loop
+        self._producer_loop = producer_loop
+        self.maxsize = maxsize
+        self.closed = False
+        self._items: deque = deque()
+        self._event: Optional[asyncio.Event] = None
+        self._wake_pending = False
+        # Lado do produtor: espera por espaço
+        self._space: Optional[asyncio.Event] = None
+        self._space_wanted = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self._items)
+
+    def put(self, item):
+        self._items.append(item)
+        if not self._wake_pending:
+            self._wake_pending = True
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                pass  # loop de destino já encerrado
+
+    def _ready(self) -> asyncio.Event:
+        if self._event is None:
+            self._event = asyncio.Event()
+        return self._event
+
+    def _wake(self):
+        self._wake_pending = False
+        self._ready().set()
+
+    async def get(self):
+        while not self._items:
+            event = self._ready()
+            event.clear()
+            if self._items:
+                break
+            await event.wait()
+        item = self._items.popleft()
+        if self._space_wanted and not self.full():
+            self._notify_space()
+        return item
+
+    async def wait_space(self):
+        """No loop do produtor: espera a fila sair de cheia (ou ser fechada)."""
+        while self.full() and not self.closed:
+            if self._space is None:
+                self._space = asyncio.Event()
+            self._space.clear()
+            self._space_wanted = True
+            # Revalida depois de sinalizar: o consumidor pode ter lido no meio
+            if not self.full() or self.closed:
+                break
+            await self._space.wait()
+
+    def close(self):
+        """Consumidor não lê mais: libera o produtor que espera espaço."""
+        self.closed = True
+        if self._space_wanted:
+            self._notify_space()
+
+    def _notify_space(self):
+        self._space_wanted = False
+        try:
+            self._producer_loop.call_soon_threadsafe(self._space.set)
+        except RuntimeError:
+            pass
+
+
+class ShardedConnection:
+    """
+    Face, no loop principal, de uma conexão servida por um shard.
+
+    Interface de WebSocket usada pela sessão: envios são enfileirados
+    para o shard (esperam só se a fila estiver cheia); recebimentos
+    chegam do shard.
+    """
+
+    def __init__(self, shard: "LoopShard", conn: StreamConnection, main_loop):
+        self.shard = shard
+        self._conn = conn
+        self._main_loop = main_loop
+        size = settings.LOOP_SHARD_QUEUE
+        self.inbound = Handoff(main_loop, size, producer_loop=shard.loop)
+        self.outbound = Handoff(shard.loop, size, producer_loop=main_loop)
+        self.closed = False
+        # Ligado pelo ConnectionManager no connect (bytes não escritos contam na conexão)
+        self.stats: Optional[ConnectionStats] = None
+        # Bytes enfileirados (escrito só pelo loop principal) / escritos (só pelo shard)
+        self._queued_bytes = 0
+        self._written_bytes = 0
+        self._settled_bytes = 0
+        self._settle_pending = False
+        self._released = False
+
+    @property
+    def max_frame_bytes(self) -> Optional[int]:
+        return self._conn.max_frame_bytes
+
+    @max_frame_bytes.setter
+    def max_frame_bytes(self, value: Optional[int]):
+        # Lido pelo shard no próximo cabeçalho de frame
+        self._conn.max_frame_bytes = value
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self) -> str:
+        item = await self.inbound.get()
+        if isinstance(item, WebSocketDisconnect):
+            self.closed = True
+            raise item
+        return item
+
+    async def _submit(self, op: str, arg, size: int):
+        await self.outbound.wait_space()
+        if self.closed or self.outbound.closed:
+            raise ConnectionError("Stream closed")
+        self._queued_bytes += size
+        if self.stats is not None:
+            self.stats.queue(size)
+        self.outbound.put((op, arg, size))
+
+    async def send_text(self, message: str):
+        await self._submit("text", message, len(message))
+
+    async def send_bytes(self, data: bytes):
+        await self._submit("bytes", data, len(data))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        if not self.closed:
+            self.closed = True
+            self.outbound.put(("close", (code, reason), 0))
+
+    def finish(self):
+        """Fim da sessão (loop principal): fecha o stream e libera os bytes não escritos."""
+        self.closed = True
+        self.outbound.put(("close", (1000, ""), 0))
+        self.inbound.close()
+        self._released = True
+        if self.stats is not None:
+            self.stats.dequeue(self._queued_bytes - self._settled_bytes)
+        self._settled_bytes = self._queued_bytes
+
+    def _settle(self):
+        # Loop principal: desconta os bytes que o shard já escreveu
+        self._settle_pending = False
+        written = self._written_bytes
+        if not self._released and self.stats is not None:
+            self.stats.dequeue(written - self._settled_bytes)
+        if not self._released:
+            self._settled_bytes = written
+
+    # ── Lado do shard ─────────────────────────────────────
+
+    def _written(self, size: int):
+        self._written_bytes += size
+        if not self._settle_pending:
+            self._settle_pending = True
+            try:
+                self._main_loop.call_soon_threadsafe(self._settle)
+            except RuntimeError:
+                pass
+
+    async def write_loop(self):
+        conn = self._conn
+        try:
+            while True:
+                op, arg, size = await self.outbound.get()
+                try:
+                    if op == "text":
+                        await conn.send_text(arg)
+                    elif op == "bytes":
+                        await conn.send_bytes(arg)
+                    else:
+                        await conn.close(*arg)
+                        return
+                    self.shard.messages_out += 1
+                except Exception:
+                    self.closed = True
+                    await conn.close()
+                    return
+                finally:
+                    self._written(size)
+        finally:
+            self.outbound.close()
+
+
+class AsgiBridge:
+    """
+    App ASGI servida num shard que executa `app` no loop principal.
+
+    O uvicorn do shard chama a bridge no loop do shard; receive/send da app
+    são agendados de volta nesse loop, então a E/S do socket nunca sai dele
+    e stores/manager só são tocados no loop principal.
+    """
+
+    def __init__(self, app, main_loop: asyncio.AbstractEventLoop):
+        self.app = app
+        self.main_loop = main_loop
+
+    async def __call__(self, scope, receive, send):
+        shard_loop = asyncio.get_running_loop()
+
+        async def main_receive():
+            return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(receive(), shard_loop))
+
+        async def main_send(message):
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(send(message), shard_loop))
+
+        future = asyncio.run_coroutine_threadsafe(
+            self.app(scope, main_receive, main_send), self.main_loop)
+        try:
+            await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+
+class LoopShard:
+    """Thread com event loop próprio servindo parte das conexões."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.connections: Dict[str, ShardedConnection] = {}
+        self.messages_in: int = 0
+        self.messages_out: int = 0
+        self._main_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._servers: List[asyncio.AbstractServer] = []
+        self._http = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, main_loop: asyncio.AbstractEventLoop):
+        self._main_loop = main_loop
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            ready.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        self._thread = threading.Thread(target=run, name=f"hub-shard-{self.index}", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def call(self, coro) -> asyncio.Future:
+        """Agenda `coro` no loop do shard; awaitable no loop principal."""
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    async def serve(self, sockets):
+        for sock in sockets:
+            self._servers.append(await asyncio.start_server(self._handle_client, sock=sock))
+
+    async def serve_http(self, sock: socket.socket, config):
+        """Serve HTTP/WebSocket em `sock` com o protocolo do uvicorn (config já carregado)."""
+        import uvicorn
+        server = uvicorn.Server(config)
+        # lifespan="off" (LifespanOff): startup só cria o listener neste loop
+        server.lifespan = config.lifespan_class(config)
+        await server.startup(sockets=[sock])
+        self._http = server
+
+    def stop_accepting(self):
+        for server in self._servers:
+            server.close()
+        self._servers.clear()
+
+    async def shutdown(self):
+        self.stop_accepting()
+        for proxy in list(self.connections.values()):
+            await proxy._conn.close(code=1001, reason="Shutting down")
+        if self._http is not None:
+            # Fecha o listener e as conexões (WebSocket restante recebe 1012)
+            await self._http.shutdown()
+            self._http = None
+
+    def join(self):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn = StreamConnection(reader, writer)
+        auth = await read_auth(conn)
+        if auth is None:
+            return
+        instance_id, raw, role = auth
+
+        proxy = ShardedConnection(self, conn, self._main_loop)
+        self.connections[instance_id] = proxy
+        writer_task = asyncio.create_task(proxy.write_loop())
+        session = asyncio.run_coroutine_threadsafe(
+            serve_session(proxy, instance_id, first_message=raw, role=role), self._main_loop)
+        # Fim da sessão (ex.: auth recusado; callback roda no loop principal)
+        # fecha o stream e libera a leitura
+        session.add_done_callback(lambda _: proxy.finish())
+        try:
+            while True:
+                # Entrada cheia (roteamento atrasado, rate limit `slow`): para de ler
+                await proxy.inbound.wait_space()
+                if proxy.inbound.closed:
+                    break
+                try:
+                    message = await conn.receive_text()
+                except WebSocketDisconnect as e:
+                    proxy.inbound.put(e)
+                    break
+                self.messages_in += 1
+                proxy.inbound.put(message)
+            await asyncio.wrap_future(session)
+        except Exception as e:
+            logger.error(f"Shard {self.index} connection {instance_id} failed: {e}")
+        finally:
+            if self.connections.get(instance_id) is proxy:
+                del self.connections[instance_id]
+            writer_task.cancel()
+            await conn.close()
+
+    def info(self) -> dict:
+        info = {"index": self.index, "connections": len(self.connections),
+                "messages_in": self.messages_in, "messages_out": self.messages_out}
+        if self._http is not None:
+            state = self._http.server_state
+            info["http"] = {"connections": len(state.connections), "requests": state.total_requests}
+        return info
+
+
+class LoopShards:
+    """Conjunto de shards; os listeners stream e HTTP são servidos por todos."""
+
+    def __init__(self):
+        self.shards: List[LoopShard] = []
+        # Listener HTTP/WebSocket (bind feito em app/main.py antes do uvicorn)
+        self.http_socket: Optional[socket.socket] = None
+        self.http_options: dict = {}
+
+    async def start(self, sockets, count: int):
+        main_loop = asyncio.get_running_loop()
+        for i in range(count):
+            shard = LoopShard(i)
+            shard.start(main_loop)
+            self.shards.append(shard)
+        await self.serve(sockets)
+
+    async def serve_http(self, app):
+        """Shards passam a servir o listener HTTP/WebSocket (no-op sem `http_socket`)."""
+        if self.http_socket is None:
+            return
+        import uvicorn
+        if not self.shards:
+            await self.start([], settings.LOOP_SHARDS)
+        config = uvicorn.Config(AsgiBridge(app, asyncio.get_running_loop()), lifespan="off",
+                                log_config=None,
+                                timeout_graceful_shutdown=max(1, int(settings.DRAIN_FLUSH_TIMEOUT_S)),
+                                **self.http_options)
+        config.load()
+        self.http_socket.setblocking(False)
+        for shard in self.shards:
+            # Um descritor por shard: o fechamento de um não derruba os outros
+            await shard.call(shard.serve_http(self.http_socket.dup(), config))
+        logger.info(f"HTTP/WebSocket listener on {len(self.shards)} loop shards")
+
+    async def serve(self, sockets):
+        """Todos os shards passam a aceitar nos `sockets` de escuta."""
+        for sock in sockets:
+            sock.setblocking(False)
+        for shard in self.shards:
+            await shard.call(shard.serve(sockets))
+
+    def stop_accepting(self):
+        for shard in self.shards:
+            shard.loop.call_soon_threadsafe(shard.stop_accepting)
+
+    async def stop(self):
+        for shard in self.shards:
+            try:
+                await asyncio.wait_for(shard.call(shard.shutdown()), timeout=5)
+            except Exception as e:
+                logger.warning(f"Shard {shard.index} shutdown: {e}")
+            await asyncio.to_thread(shard.join)
+        self.shards = []
+
+    def info(self) -> list:
+        return [shard.info() for shard in self.shards]
+
+
+loop_shards = LoopShards()
@@ -0,0 +1,206 @@
+"""
+OTS Hub — Transporte stream (Unix domain socket / TCP)
+
+Listener adicional para processos co-localizados, sem upgrade HTTP nem
+framing/masking WebSocket. Usa a mesma sessão (auth, ConnectionManager,
+route_message) do endpoint WebSocket: clientes locais e remotos
+interoperam de forma transparente.
+
+Frame: cabeçalho de 5 bytes `>IB` (tamanho do corpo, opcode) + corpo.
+  0x01 texto (JSON UTF-8)
+  0x02 binário (ex: mensagem comprimida, ver compression.py)
+  0x08 close (corpo: código `>H` + motivo UTF-8)
+
+A primeira mensagem deve ser o `auth`, com `payload.instance_id`
+(no WebSocket o instance_id vem do path /ws/{instance_id}).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+from typing import List, Optional, Tuple
+
+from fastapi import WebSocketDisconnect
+
+from app.core.config import settings
+from app.websockets.admission import role_hint
+from app.websockets.session import serve_session
+
+logger = logging.getLogger("hub.stream")
+
+OP_TEXT, OP_BINARY, OP_CLOSE = 0x01, 0x02, 0x08
+_HEADER = struct.Struct(">IB")
+
+
+def encode_frame(opcode: int, body: bytes) -> bytes:
+    return _HEADER.pack(len(body), opcode) + body
+
+
+class StreamConnection:
+    """Adapta um par StreamReader/StreamWriter à interface de WebSocket usada pelo Hub."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._closed = False
+        # Limite da role, definido no auth (ver accounting.frame_limit)
+        self.max_frame_bytes: Optional[int] = None
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self) -> str:
+        while True:
+            try:
+                header = await self._reader.readexactly(_HEADER.size)
+                length, opcode = _HEADER.unpack(header)
+                if length > (self.max_frame_bytes or settings.MAX_FRAME_BYTES):
+                    await self.close(code=4009, reason="Frame too large")
+                    raise WebSocketDisconnect(code=4009)
+                body = await self._reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self._closed = True
+                raise WebSocketDisconnect(code=1006)
+            if opcode == OP_TEXT:
+                return body.decode()
+            if opcode == OP_CLOSE:
+                await self.close()
+                raise WebSocketDisconnect(code=1000)
+            # Frames binários de entrada não são suportados: ignora
+
+    async def _write(self, frame: bytes):
+        if self._closed:
+            raise ConnectionError("Stream closed")
+        self._writer.write(frame)
+        await self._writer.drain()
+
+    async def send_text(self, message: str):
+        await self._write(encode_frame(OP_TEXT, message.encode()))
+
+    async def send_bytes(self, data: bytes):
+        await self._write(encode_frame(OP_BINARY, data))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        if self._closed:
+            return
+        try:
+            self._writer.write(encode_frame(OP_CLOSE, struct.pack(">H", code) + reason.encode()))
+            await self._writer.drain()
+        except Exception:
+            pass
+        self._closed = True
+        self._writer.close()
+
+
+async def read_auth(conn: StreamConnection) -> Optional[Tuple[str, str, Optional[str]]]:
+    """Lê o primeiro frame (auth). Retorna (instance_id, frame, role) ou fecha e retorna None."""
+    try:
+        raw = await asyncio.wait_for(conn.receive_text(), timeout=settings.AUTH_TIMEOUT)
+    except (asyncio.TimeoutError, WebSocketDisconnect):
+        await conn.close(code=4001, reason="Auth timeout")
+        return None
+
+    try:
+        data = json.loads(raw)
+        instance_id = str(data["payload"]["instance_id"])
+        if data.get("type") != "auth" or not instance_id:
+            raise ValueError
+    except (ValueError, KeyError, TypeError):
+        await conn.close(code=4001, reason="First frame must be auth with payload.instance_id")
+        return None
+
+    payload = data["payload"]
+    return instance_id, raw, role_hint(instance_id, payload.get("resume"))
+
+
+async def _handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    conn = StreamConnection(reader, writer)
+    auth = await read_auth(conn)
+    if auth is None:
+        return
+    instance_id, raw, role = auth
+    await serve_session(conn, instance_id, first_message=raw, role=role)
+    await conn.close()
+
+
+class StreamServers:
+    """Gerencia os listeners Unix socket / TCP configurados."""
+
+    def __init__(self):
+        self._servers: List[asyncio.AbstractServer] = []
+        self._unix_path: Optional[str] = None
+
+    async def start(self):
+        if settings.LOOP_SHARDS > 0:
+            await self._start_sharded()
+            return
+        if settings.UNIX_SOCKET_PATH:
+            path = settings.UNIX_SOCKET_PATH
+            if os.path.exists(path):
+                os.unlink(path)
+            self._servers.append(await asyncio.start_unix_server(_handle_client, path=path))
+            self._unix_path = path
+            logger.info(f"Stream listener on unix:{path}")
+        if settings.STREAM_TCP_PORT:
+            self._servers.append(await asyncio.start_server(
+                _handle_client, host=settings.STREAM_TCP_HOST, port=settings.STREAM_TCP_PORT))
+            logger.info(f"Stream listener on tcp:{settings.STREAM_TCP_HOST}:{settings.STREAM_TCP_PORT}")
+
+    async def _start_sharded(self):
+        from app.websockets.shards import loop_shards
+        sockets = self._listen_sockets()
+        if sockets:
+            await loop_shards.start(sockets, settings.LOOP_SHARDS)
+            logger.info(f"Stream listeners on {settings.LOOP_SHARDS} loop shards")
+
+    def _listen_sockets(self) -> list:
+        # Sockets de escuta compartilhados por todos os shards (ver shards.py)
+        sockets = []
+        if settings.UNIX_SOCKET_PATH:
+            path = settings.UNIX_SOCKET_PATH
+            if os.path.exists(path):
+                os.unlink(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(path)
+            sock.listen(128)
+            sockets.append(sock)
+            self._unix_path = path
+        if settings.STREAM_TCP_PORT:
+            sockets.append(socket.create_server((settings.STREAM_TCP_HOST, settings.STREAM_TCP_PORT)))
+        return sockets
+
+    def stop_accepting(self):
+        """Fecha os listeners; conexões já abertas seguem ativas."""
+        for server in self._servers:
+            server.close()
+        if settings.LOOP_SHARDS > 0:
+            from app.websockets.shards import loop_shards
+            loop_shards.stop_accepting()
+
+    async def resume_accepting(self):
+        """Reabre os listeners fechados por stop_accepting (drain abortado)."""
+        self._servers.clear()
+        if settings.LOOP_SHARDS > 0:
+            from app.websockets.shards import loop_shards
+            if loop_shards.shards:
+                await loop_shards.serve(self._listen_sockets())
+                return
+        await self.start()
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers.clear()
+        if settings.LOOP_SHARDS > 0:
+            from app.websockets.shards import loop_shards
+            await loop_shards.stop()
+        if self._unix_path and os.path.exists(self._unix_path):
+            os.unlink(self._unix_path)
+        self._unix_path = None
+
+
+stream_servers = StreamServers()
@@ -0,0 +1,80 @@
+"""
+OTS Hub — TTL de mensagens (expiração de dados velhos no roteamento)
+
+Um `bar` ou `signal` que chega atrasado (reconexão, fila do cliente) ou
+que espera no Hub atrás de um consumidor lento não deve ser entregue:
+operar em cima dele é pior do que não receber nada.
+
+Idade máxima por type (MESSAGE_TTLS_MS, sobrepõe DEFAULT_MESSAGE_TTLS_MS;
+0 desativa o type), contada a partir do `timestamp` do envelope —
+convertido para o relógio do Hub pelo offset do heartbeat — ou do
+recebimento no Hub, o que for mais antigo. Sem offset medido (antes do
+primeiro pong, clientes que não respondem ao heartbeat) o `timestamp`
+não é confiável e conta só o recebimento: um relógio atrasado não pode
+expirar tudo o que o cliente publica. O publicador pode pedir um TTL
+próprio na mensagem (`"ttl_ms"` no envelope).
+
+- Expirada ao chegar: efeitos locais (stores, estado) são aplicados, mas
+  o forward não é montado nem enviado
+- Expirada na fila de envio: descartada por destinatário antes de
+  comprimir/enviar (broadcast e fila conflacionada)
+- Contadas em metrics (`ttl.expired.<type>`, `ttl.expired_sends`); com
+  MESSAGE_TTL_REPORT ou `"report_expired": true` no envelope, o
+  publicador recebe um ack `expired`
+"""
+
+import time
+from typing import Dict, Optional
+
+from app.core.config import settings
+
+DEFAULT_MESSAGE_TTLS_MS: Dict[str, int] = {
+    "signal": 2_000,
+    "bar": 10_000,
+}
+
+
+def ttl_ms_for(msg_type: str) -> int:
+    ttls = {**DEFAULT_MESSAGE_TTLS_MS, **settings.MESSAGE_TTLS_MS}
+    return int(ttls.get(msg_type) or 0)
+
+
+class Expiry:
+    """Prazo de validade de uma mensagem no relógio do Hub (epoch s)."""
+
+    __slots__ = ("msg_type", "origin", "ttl_ms", "deadline", "report")
+
+    def __init__(self, msg_type: str, origin: float, ttl_ms: int, report: bool):
+        self.msg_type = msg_type
+        self.origin = origin
+        self.ttl_ms = ttl_ms
+        self.deadline = origin + ttl_ms / 1000.0
+        self.report = report
+
+    def passed(self, now: Optional[float] = None) -> bool:
+        return (time.time() if now is None else now) >= self.deadline
+
+    def age_ms(self, now: Optional[float] = None) -> float:
+        return ((time.time() if now is None else now) - self.origin) * 1000.0
+
+    def describe(self, now: Optional[float] = None) -> dict:
+        return {"type": self.msg_type, "age_ms": round(self.age_ms(now), 1), "ttl_ms": self.ttl_ms}
+
+
+def expiry_for(msg_type: str, data: dict, received_at: float,
+               clock_offset_ms: Optional[float] = None) -> Optional[Expiry]:
+    """Expiry da mensagem, ou None se o type não tem TTL."""
+    if not settings.MESSAGE_TTL_ENABLED:
+        return None
+    ttl_ms = data.get("ttl_ms")
+    if not isinstance(ttl_ms, (int, float)) or ttl_ms <= 0:
+        ttl_ms = ttl_ms_for(msg_type)
+    if ttl_ms <= 0:
+        return None
+    origin = received_at
+    client_ts = data.get("timestamp")
+    if clock_offset_ms is not None and isinstance(client_ts, (int, float)):
+        # Mesma correção de _observe_inbound_latency: relógio do cliente → Hub
+        origin = min(received_at, client_ts - clock_offset_ms / 1000.0)
+    report = bool(data.get("report_expired", settings.MESSAGE_TTL_REPORT))
+    return Expiry(msg_type, origin, ttl_ms, report)
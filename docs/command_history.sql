@@ -0,0 +1,31 @@
+-- ============================================================================
+-- Tabelas de destino do replicador do store local (app/modules/store)
+-- ============================================================================
+-- Comandos concluídos (ack ou expirados) e amostras de telemetria gravados
+-- localmente pelo Hub e replicados em lote quando o Supabase está
+-- acessível. O replicador faz upsert por chave estável (cmd_id /
+-- sample_id), então as colunas precisam de índice único.
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS command_history (
+    id BIGSERIAL PRIMARY KEY,
+    cmd_id TEXT NOT NULL,
+    target TEXT,
+    origin TEXT,
+    action TEXT,
+    sent_at DOUBLE PRECISION,
+    raw_data JSONB,
+    created_at TIMESTAMPTZ DEFAULT now()
+);
+
+-- Instalações anteriores (insert simples) podem ter duplicatas: mantém a última
+DELETE FROM command_history a USING command_history b
+    WHERE a.cmd_id = b.cmd_id AND a.id < b.id;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_command_history_cmd_id ON command_history (cmd_id);
+
+CREATE INDEX IF NOT EXISTS ix_command_history_target ON command_history (target, sent_at);
+CREATE INDEX IF NOT EXISTS ix_command_history_action ON command_history (action, sent_at);
+
+-- Telemetria: id estável "<instance_id>:<server_ts>" (NULL nas linhas antigas)
+ALTER TABLE telemetry ADD COLUMN IF NOT EXISTS sample_id TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_telemetry_sample_id ON telemetry (sample_id);
@@ -142,6 +142,20 @@ cmd_restart() {
     print_header "Reiniciando OTS Hub"
     check_service_exists
     
+    # Drain: clientes recebem reconnect_after e o estado vai para o snapshot
+    if [ -n "$OTS_TOKEN" ]; then
+        print_section "Drenando conexões..."
+        if curl -s -X POST http://localhost:$PORT/api/v1/admin/drain \
+            -H "Content-Type: application/json" \
+            -d "{\"token\": \"$OTS_TOKEN\"}"; then
+            echo ""
+        else
+            print_warning "Drain falhou, reiniciando mesmo assim"
+        fi
+    else
+        print_info "OTS_TOKEN não definido: restart sem drain"
+    fi
+
     print_section "Reiniciando serviço..."
     sudo systemctl restart $SERVICE_NAME
     
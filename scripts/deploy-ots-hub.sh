@@ -258,7 +258,9 @@ Type=simple
 User=$USER
 WorkingDirectory=$PROJECT_DIR
 Environment="PATH=$PROJECT_DIR/venv/bin"
-ExecStart=$PROJECT_DIR/venv/bin/uvicorn app.main:app --host 0.0.0.0 --port $PORT
+Environment="HOST=0.0.0.0"
+Environment="PORT=$PORT"
+ExecStart=$PROJECT_DIR/venv/bin/python -m app.main
 Restart=always
 RestartSec=10
 StandardOutput=journal
@@ -3,6 +3,7 @@ OTS Hub — Test Suite
 """
 
 import json
+import os
 import time
 import pytest
 from unittest.mock import AsyncMock, patch
@@ -109,6 +110,53 @@ class TestCommands:
         self.router.cleanup_stale(timeout=30)
         assert len(self.router.get_pending()) == 0
 
+    def test_audit_log_filters_and_latency(self):
+        a = self.router.create_command("close_all", "exec-01", "admin-01")
+        b = self.router.create_command("pause", "exec-02", "dash-01")
+        c = self.router.create_command("close_all", "exec-02", "admin-01")
+        self.router.process_ack("exec-01", {"ref_id": a["id"], "status": "success"})
+        self.router.process_ack("exec-02", {"ref_id": c["id"], "status": "error", "result": "busy"})
+
+        items, _ = self.router.query_log(action="close_all")
+        assert [r["id"] for r in items] == [c["id"], a["id"]]
+        assert items[0]["ack_from"] == "exec-02" and items[0]["latency_ms"] >= 0
+
+        assert [r["id"] for r in self.router.query_log(target="exec-02", status="pending")[0]] == [b["id"]]
+        assert [r["id"] for r in self.router.query_log(origin="admin-01", status="error")[0]] == [c["id"]]
+        assert self.router.query_log(action="reconnect")[0] == []
+        assert self.router.latency()["close_all"]["count"] == 2
+        assert "pause" not in self.router.latency()
+
+    def test_audit_log_pagination_and_time_window(self):
+        ids = []
+        for i in range(7):
+            cmd = self.router.create_command("status", "bot-01")
+            self.router._log.get(cmd["id"])["sent_at"] = 1000.0 + i
+            ids.append(cmd["id"])
+        self.router._log._times[-7:] = [1000.0 + i for i in range(7)]
+
+        page, cursor = self.router.query_log(limit=3)
+        assert [r["id"] for r in page] == ids[:-4:-1]
+        page, cursor = self.router.query_log(limit=3, before=cursor)
+        assert [r["id"] for r in page] == ids[3:0:-1]
+        page, cursor = self.router.query_log(limit=3, before=cursor)
+        assert [r["id"] for r in page] == [ids[0]] and cursor is None
+
+        window, _ = self.router.query_log(since=1002.0, until=1005.0)
+        assert [r["id"] for r in window] == [ids[4], ids[3], ids[2]]
+
+    def test_audit_log_is_bounded(self):
+        from app.modules.commands.service import CommandLog
+        log = CommandLog(capacity=4)
+        for i in range(20):
+            log.add({"id": f"c{i}", "target": f"t{i % 2}", "origin": "o", "action": "status",
+                     "status": "pending", "sent_at": float(i)})
+        log.update("c19", status="success")
+        assert len(log) == 4 and log.get("c3") is None
+        assert [r["id"] for r in log.query(target="t1")[0]] == ["c19", "c17"]
+        assert [r["id"] for r in log.query(status="pending")[0]] == ["c18", "c17", "c16"]
+        assert len(log._seqs) <= 4 + 4 // 4 + 1
+
 
 # ═══════════════════════════════════════════════════════════
 # Connection Manager
@@ -320,3 +368,2211 @@ class TestFastAPI:
             resp = await ac.get("/api/v1/status")
             assert resp.status_code == 200
             assert "connections" in resp.json()
+
+
+# ═══════════════════════════════════════════════════════════
+# Conflation
+# ═══════════════════════════════════════════════════════════
+
+class TestConflation:
+    @pytest.mark.asyncio
+    async def test_replaces_pending_in_place(self):
+        import asyncio
+        from app.websockets.manager import ConflatingSender
+        from app.websockets.compression import Outbound
+
+        ws = AsyncMock()
+        sender = ConflatingSender(ws, "dash-01")
+        sender.offer(("account_update", "conn-01", None), Outbound("a1"))
+        sender.offer(("telemetry", "conn-01", None), Outbound("t1"))
+        sender.offer(("account_update", "conn-01", None), Outbound("a2"))
+        assert sender.pending == 2
+        assert sender.replaced == 1
+
+        await asyncio.sleep(0.01)
+        sent = [c.args[0] for c in ws.send_text.call_args_list]
+        assert sent == ["a2", "t1"]
+        sender.close()
+
+    @pytest.mark.asyncio
+    async def test_interval_follows_hot_reloaded_setting(self):
+        import asyncio
+        from app.core.config import settings
+        from app.websockets.manager import ConflatingSender
+        from app.websockets.compression import Outbound
+
+        ws = AsyncMock()
+        sender = ConflatingSender(ws, "dash-hot", interval=None)
+        with patch.object(settings, "CONFLATE_INTERVAL_MS", 0):
+            sender.offer("k1", Outbound("a"))
+            sender.offer("k2", Outbound("b"))
+            await asyncio.sleep(0.01)
+            assert ws.send_text.call_count == 2
+
+            settings.CONFLATE_INTERVAL_MS = 200
+            sender.offer("k1", Outbound("c"))
+            sender.offer("k2", Outbound("d"))
+            await asyncio.sleep(0.05)
+            assert ws.send_text.call_count == 3
+        sender.close()
+
+    @pytest.mark.asyncio
+    async def test_router_conflates_account_update_for_dashboard(self):
+        import asyncio
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+
+        ws_conn = AsyncMock()
+        ws_dash = AsyncMock()
+        await manager.connect(ws_conn, "conn-cf")
+        await manager.connect(ws_dash, "dash-cf")
+        manager.authenticate("conn-cf", "connector")
+        manager.authenticate("dash-cf", "dashboard", conflate=True)
+
+        for equity in (100, 200, 300):
+            await route_message(
+                json.dumps({"type": "account_update", "payload": {"equity": equity}}), "conn-cf"
+            )
+        await asyncio.sleep(0.01)
+
+        sent = [json.loads(c.args[0]) for c in ws_dash.send_text.call_args_list]
+        assert len(sent) == 1
+        assert sent[0]["payload"]["equity"] == 300
+
+        manager.disconnect("conn-cf")
+        manager.disconnect("dash-cf")
+
+    @pytest.mark.asyncio
+    async def test_conflation_keeps_positions_apart(self):
+        import asyncio
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+
+        ws_dash = AsyncMock()
+        await manager.connect(AsyncMock(), "conn-cfp")
+        await manager.connect(ws_dash, "dash-cfp")
+        manager.authenticate("conn-cfp", "connector")
+        manager.authenticate("dash-cfp", "dashboard", conflate=True)
+
+        events = [{"symbol": "EURUSD", "ticket": 1, "event": "open"},
+                  {"symbol": "EURUSD", "ticket": 2, "event": "close"},
+                  {"symbol": "EURUSD", "ticket": 1, "event": "modify"}]
+        for payload in events:
+            await route_message(json.dumps({"type": "position_event", "payload": payload}),
+                                "conn-cfp")
+        for _ in range(20):
+            if ws_dash.send_text.await_count >= 2:
+                break
+            await asyncio.sleep(0.02)
+
+        sent = [json.loads(c.args[0])["payload"] for c in ws_dash.send_text.call_args_list]
+        assert sorted((p["ticket"], p["event"]) for p in sent) == [(1, "modify"), (2, "close")]
+
+        from app.modules.state.service import state_store
+        state_store.remove("conn-cfp")
+        manager.disconnect("conn-cfp")
+        manager.disconnect("dash-cfp")
+
+
+# ═══════════════════════════════════════════════════════════
+# State (late-join snapshot)
+# ═══════════════════════════════════════════════════════════
+
+class TestState:
+    def setup_method(self):
+        from app.modules.state.service import StateStore
+        self.store = StateStore()
+
+    def test_account_update_merges(self):
+        self.store.apply("account_update", "conn-01", {"balance": 1000, "equity": 1000})
+        self.store.apply("account_update", "conn-01", {"equity": 1050})
+        account = self.store.get("conn-01")["account"]
+        assert account == {"balance": 1000, "equity": 1050}
+
+    def test_position_lifecycle(self):
+        self.store.apply("order_result", "conn-01",
+                         {"success": True, "action": "open", "ticket": 1, "symbol": "EURUSD"})
+        self.store.apply("order_result", "conn-01",
+                         {"success": False, "action": "open", "ticket": 2, "symbol": "GBPUSD"})
+        assert [p["ticket"] for p in self.store.get("conn-01")["positions"]] == [1]
+
+        self.store.apply("position_event", "conn-01", {"ticket": 1, "status": "closed"})
+        assert self.store.get("conn-01")["positions"] == []
+
+    def test_remove(self):
+        self.store.apply("account_update", "conn-01", {"balance": 1})
+        self.store.remove("conn-01")
+        assert self.store.get("conn-01") is None
+
+    @pytest.mark.asyncio
+    async def test_snapshot_only_for_subscriber_roles(self):
+        from app.websockets.router import route_message, state_snapshot
+        from app.websockets.manager import manager
+
+        await manager.connect(AsyncMock(), "conn-st")
+        await manager.connect(AsyncMock(), "exec-st")
+        manager.authenticate("conn-st", "connector")
+        manager.authenticate("exec-st", "executor")
+        await route_message(
+            json.dumps({"type": "account_update", "payload": {"equity": 42}}), "conn-st"
+        )
+
+        assert state_snapshot("conn-st") == ""
+        snap = json.loads(state_snapshot("exec-st"))
+        assert snap["type"] == "state_snapshot"
+        assert snap["payload"]["connectors"]["conn-st"]["account"]["equity"] == 42
+
+        manager.disconnect("conn-st")
+        manager.disconnect("exec-st")
+
+
+# ═══════════════════════════════════════════════════════════
+# Events (SSE / ETag)
+# ═══════════════════════════════════════════════════════════
+
+class TestEvents:
+    @pytest.mark.asyncio
+    async def test_publish_bumps_version_and_delivers(self):
+        from app.modules.events.service import EventBus
+        bus = EventBus()
+        sub = bus.subscribe()
+        bus.publish("connection", {"instance_id": "x", "state": "connected"})
+        assert bus.version == 1
+        version, event, data = await sub.next(timeout=0.1)
+        assert (version, event, data["state"]) == (1, "connection", "connected")
+        bus.unsubscribe(sub)
+        assert bus.subscriber_count == 0
+
+    @pytest.mark.asyncio
+    async def test_overflow_requests_resync(self):
+        from app.modules.events.service import EventBus
+        bus = EventBus(queue_size=2)
+        sub = bus.subscribe()
+        for i in range(5):
+            bus.publish("telemetry", {"i": i})
+        assert sub.resync
+        _, event, _ = await sub.next(timeout=0.1)
+        assert event == "resync"
+        assert await sub.next(timeout=0.01) is None
+
+    @pytest.mark.asyncio
+    async def test_status_etag_304(self):
+        from httpx import AsyncClient, ASGITransport
+        from app.main import app
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            resp = await ac.get("/api/v1/status")
+            etag = resp.headers["etag"]
+            resp = await ac.get("/api/v1/status", headers={"If-None-Match": etag})
+            assert resp.status_code == 304
+
+            # Contador volátil não invalida o ETag; o corpo nem é montado
+            from app.websockets.accounting import memory_budget
+            memory_budget.shed += 1
+            try:
+                with patch("app.main._status_payload") as payload:
+                    resp = await ac.get("/api/v1/status", headers={"If-None-Match": etag})
+                assert resp.status_code == 304
+                payload.assert_not_called()
+                live = await ac.get("/api/v1/status/live")
+                assert live.json()["memory"]["shed"] == memory_budget.shed
+            finally:
+                memory_budget.shed -= 1
+
+            # Telemetria nova (com valor não-JSON) invalida e serializa com str()
+            import datetime
+            from app.modules.telemetry.service import telemetry_store
+            telemetry_store._latest["conn-etag"] = {"instance_id": "conn-etag", "server_ts": 1.0,
+                                                    "at": datetime.date(2026, 1, 2)}
+            try:
+                resp = await ac.get("/api/v1/status", headers={"If-None-Match": etag})
+                assert resp.status_code == 200
+                assert resp.json()["telemetry"]["conn-etag"]["at"] == "2026-01-02"
+            finally:
+                telemetry_store.remove("conn-etag")
+
+    @pytest.mark.asyncio
+    async def test_stream_starts_with_snapshot(self):
+        from app.main import stream
+        request = AsyncMock()
+        request.is_disconnected.return_value = False
+        resp = await stream(request)
+        body = resp.body_iterator
+        first = await body.__anext__()
+        assert first.startswith("id: ")
+        assert "event: snapshot" in first
+        await body.aclose()
+
+
+# ═══════════════════════════════════════════════════════════
+# Heartbeat
+# ═══════════════════════════════════════════════════════════
+
+class TestHeartbeat:
+    @pytest.mark.asyncio
+    async def test_pong_measures_rtt_and_offset(self):
+        from app.websockets.heartbeat import record_pong
+        from app.websockets.manager import ConnectionInfo
+
+        conn = ConnectionInfo(AsyncMock(), "exec-hb")
+        conn.ping_id = "hb-1"
+        conn.last_ping_at = 1000.0
+        # Cliente 2s adiantado; RTT de 100 ms
+        rtt = record_pong(conn, {"ref_id": "hb-1"}, client_ts=1002.05, now=1000.1)
+        assert rtt == pytest.approx(100.0)
+        assert conn.clock_offset_ms == pytest.approx(2000.0)
+        # Pong repetido é ignorado
+        assert record_pong(conn, {"ref_id": "hb-1"}, client_ts=1002.05, now=1000.2) is None
+
+    @pytest.mark.asyncio
+    async def test_pings_then_evicts_silent_connection(self):
+        import asyncio
+        from app.websockets.heartbeat import HeartbeatMonitor
+        from app.websockets.manager import manager
+
+        ws = AsyncMock()
+        conn = await manager.connect(ws, "hb-silent")
+        manager.authenticate("hb-silent", "executor")
+        monitor = HeartbeatMonitor()
+        with patch("app.websockets.heartbeat.settings") as s:
+            s.HEARTBEAT_INTERVAL_S = 10
+            s.HEARTBEAT_TIMEOUT_S = 30
+            s.HEARTBEAT_LEGACY_TIMEOUT_S = 300
+            monitor.track("hb-silent")
+
+            await monitor.run_due(conn.connected_at + 10)
+            await asyncio.sleep(0)
+            ping = json.loads(ws.send_text.call_args[0][0])
+            assert ping["type"] == "ping"
+            assert manager.get("hb-silent") is conn
+
+            # Já respondeu pong antes: vale o timeout curto
+            conn.rtt_ms = 5.0
+            await monitor.run_due(conn.connected_at + 31)
+            assert manager.get("hb-silent") is None
+            ws.close.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_exact_deadline_evicts_without_spinning(self):
+        from app.websockets.heartbeat import HeartbeatMonitor
+        from app.websockets.manager import manager
+
+        ws = AsyncMock()
+        conn = await manager.connect(ws, "hb-edge")
+        manager.authenticate("hb-edge", "dashboard")
+        conn.connected_at = conn.last_message_at = conn.last_ping_at = 1000.0
+        monitor = HeartbeatMonitor()
+        with patch("app.websockets.heartbeat.settings") as s:
+            s.HEARTBEAT_INTERVAL_S = 10
+            s.HEARTBEAT_TIMEOUT_S = 30
+            s.HEARTBEAT_LEGACY_TIMEOUT_S = 300
+            monitor._push(1300.0, conn)
+            with patch.object(monitor, "_check", wraps=monitor._check) as check:
+                await monitor.run_due(1300.0)
+            assert check.call_count == 1
+        assert manager.get("hb-edge") is None
+        ws.close.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_client_without_pong_keeps_legacy_timeout(self):
+        from app.websockets.heartbeat import HeartbeatMonitor
+        from app.websockets.manager import manager
+
+        ws = AsyncMock()
+        conn = await manager.connect(ws, "hb-legacy")
+        manager.authenticate("hb-legacy", "dashboard")
+        monitor = HeartbeatMonitor()
+        with patch("app.websockets.heartbeat.settings") as s:
+            s.HEARTBEAT_INTERVAL_S = 10
+            s.HEARTBEAT_TIMEOUT_S = 30
+            s.HEARTBEAT_LEGACY_TIMEOUT_S = 300
+            monitor.track("hb-legacy")
+            for t in range(10, 300, 10):
+                await monitor.run_due(conn.connected_at + t)
+            assert manager.get("hb-legacy") is conn
+
+            await monitor.run_due(conn.connected_at + 301)
+            assert manager.get("hb-legacy") is None
+            ws.close.assert_called_once()
+
+
+# ═══════════════════════════════════════════════════════════
+# Rate Limiting
+# ═══════════════════════════════════════════════════════════
+
+class TestRateLimit:
+    def test_token_bucket(self):
+        from app.websockets.ratelimit import TokenBucket
+        bucket = TokenBucket(rate=10, burst=2)
+        now = bucket.updated
+        for _ in range(2):
+            assert bucket.deficit(now) == 0.0
+            bucket.consume()
+        assert bucket.deficit(now) == pytest.approx(0.1)
+        assert bucket.deficit(now + 0.1) == 0.0
+
+    @pytest.mark.asyncio
+    async def test_soft_drops_excess(self):
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+
+        ws_dash = AsyncMock()
+        await manager.connect(ws_dash, "dash-rl")
+        manager.authenticate("dash-rl", "dashboard")
+        with patch("app.websockets.ratelimit.settings") as s:
+            s.RATE_LIMIT_ENABLED = True
+            s.RATE_LIMITS = {"dashboard": {"*": [1, 2]}}
+            responses = [
+                await route_message(json.dumps({"type": "signal", "payload": {}}), "dash-rl")
+                for _ in range(4)
+            ]
+        assert responses[:2] == ["", ""]
+        assert json.loads(responses[2])["payload"]["code"] == 4029
+        assert responses[3] == ""
+        assert manager.get("dash-rl").limiter.hits == 2
+        manager.disconnect("dash-rl")
+
+    @pytest.mark.asyncio
+    async def test_hard_disconnects(self):
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+
+        ws = AsyncMock()
+        await manager.connect(ws, "flood-rl")
+        with patch("app.websockets.ratelimit.settings") as s:
+            s.RATE_LIMIT_ENABLED = True
+            s.RATE_LIMITS = {"unknown": {"*": [1, 1]}}
+            await route_message(json.dumps({"type": "bar", "payload": {}}), "flood-rl")
+            await route_message(json.dumps({"type": "bar", "payload": {}}), "flood-rl")
+        assert manager.get("flood-rl") is None
+        ws.close.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_slow_delays_instead_of_dropping(self):
+        from app.websockets.ratelimit import admit
+        from app.websockets.manager import ConnectionInfo
+
+        conn = ConnectionInfo(AsyncMock(), "conn-rl")
+        conn.role = "connector"
+        with patch("app.websockets.ratelimit.settings") as s:
+            s.RATE_LIMIT_ENABLED = True
+            s.RATE_LIMITS = {"connector": {"*": [20, 1]}}
+            assert await admit(conn, "bar") is None
+            start = time.monotonic()
+            assert await admit(conn, "bar") is None
+            assert time.monotonic() - start >= 0.04
+        assert conn.limiter.hits == 1
+
+
+# ═══════════════════════════════════════════════════════════
+# Bulk transfers (chunks / off-loop decode / frame cap)
+# ═══════════════════════════════════════════════════════════
+
+class TestBulk:
+    def test_chunk_transfer_verified(self):
+        import zlib
+        from app.websockets.chunks import ChunkTransfers
+        transfers = ChunkTransfers()
+        parts = ['[{"close": 1.1}]', '[{"close": 1.2}]']
+        crc = zlib.crc32(parts[1].encode(), zlib.crc32(parts[0].encode()))
+
+        assert transfers.process("history_chunk_start", "conn", {"transfer_id": "t1"})[1] is None
+        for seq, part in enumerate(parts):
+            fwd, err = transfers.process("history_chunk", "conn",
+                                         {"transfer_id": "t1", "seq": seq, "data": part})
+            assert err is None and fwd["seq"] == seq
+        end, err = transfers.process("history_chunk_end", "conn",
+                                     {"transfer_id": "t1", "chunks": 2, "crc32": crc})
+        assert err is None and end["verified"] is True
+        assert transfers.active == 0
+
+    def test_out_of_order_aborts(self):
+        from app.websockets.chunks import ChunkTransfers
+        transfers = ChunkTransfers()
+        transfers.process("history_chunk_start", "conn", {"transfer_id": "t1"})
+        fwd, err = transfers.process("history_chunk", "conn",
+                                     {"transfer_id": "t1", "seq": 1, "data": "[]"})
+        assert err and fwd["aborted"] is True
+        assert transfers.active == 0
+
+    def test_decode_frame_passthrough(self):
+        from app.websockets.codec import decode_frame
+        raw = json.dumps({"type": "history_response", "id": "h1", "payload": {"bars": [1, 2]}})
+        header, envelope, history = decode_frame(raw, "conn-01", 123.0)
+        assert history is None
+        assert header == {"type": "history_response", "id": "h1"}
+        assert json.loads(envelope) == {
+            "type": "history_response", "from": "conn-01",
+            "payload": {"bars": [1, 2]}, "timestamp": 123.0,
+        }
+
+    @pytest.mark.asyncio
+    async def test_router_frame_cap_and_offload(self):
+        from app.core.config import settings
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+
+        ws_pred = AsyncMock()
+        await manager.connect(AsyncMock(), "conn-bulk")
+        await manager.connect(ws_pred, "pred-bulk")
+        manager.authenticate("conn-bulk", "connector")
+        manager.authenticate("pred-bulk", "preditor")
+
+        frame = json.dumps({"type": "history_response", "payload": {"bars": list(range(100))}})
+        with patch.object(settings, "MAX_FRAME_BYTES", 100):
+            resp = json.loads(await route_message(frame, "conn-bulk"))
+            assert resp["payload"]["code"] == 4009
+
+        with patch.object(settings, "OFFLOAD_FRAME_BYTES", 100), \
+                patch.object(settings, "DECODE_WORKERS", 0):
+            assert await route_message(frame, "conn-bulk") == ""
+        msg = json.loads(ws_pred.send_text.call_args[0][0])
+        assert msg["from"] == "conn-bulk"
+        assert msg["payload"]["bars"][-1] == 99
+
+        manager.disconnect("conn-bulk")
+        manager.disconnect("pred-bulk")
+
+
+# ═══════════════════════════════════════════════════════════
+# Compression
+# ═══════════════════════════════════════════════════════════
+
+class TestCompression:
+    def test_negotiate(self):
+        from app.websockets.compression import negotiate
+        assert negotiate(None) is None
+        assert negotiate(["brotli", "zlib"]) == "zlib"
+        assert negotiate("lz4") is None
+
+    @pytest.mark.asyncio
+    async def test_small_or_latency_critical_stay_text(self):
+        from app.websockets.compression import Outbound
+        assert await Outbound("x" * 10, compressible=True).frame_for("zlib") is None
+        assert await Outbound("x" * 100_000, compressible=False).frame_for("zlib") is None
+
+    @pytest.mark.asyncio
+    async def test_large_frames_compressed_off_loop_once(self):
+        import asyncio
+        import threading
+        import zlib
+        from app.core.config import settings
+        from app.websockets.compression import Outbound
+
+        threads = []
+
+        def fake(data, codec):
+            threads.append(threading.current_thread())
+            return zlib.compress(data)
+
+        out = Outbound("x" * 200_000, compressible=True)
+        with patch.object(settings, "COMPRESS_OFFLOAD_BYTES", 64 * 1024), \
+                patch("app.websockets.compression.compress", side_effect=fake):
+            first, second = await asyncio.gather(out.frame_for("zlib"), out.frame_for("zlib"))
+            assert await out.frame_for("zlib") is first
+
+        assert first is second
+        assert len(threads) == 1 and threads[0] is not threading.main_thread()
+        assert zlib.decompress(first) == b"x" * 200_000
+
+    @pytest.mark.asyncio
+    async def test_broadcast_compresses_once(self):
+        import zlib
+        from app.websockets.manager import ConnectionManager
+
+        mgr = ConnectionManager()
+        ws_a, ws_b, ws_plain = AsyncMock(), AsyncMock(), AsyncMock()
+        for ws, iid, codec in ((ws_a, "a", "zlib"), (ws_b, "b", "zlib"), (ws_plain, "c", None)):
+            await mgr.connect(ws, iid)
+            mgr.authenticate(iid, "preditor", compression=codec)
+
+        message = json.dumps({"type": "history_response", "payload": {"bars": [1.0] * 5000}})
+        with patch("app.websockets.compression.compress",
+                   side_effect=lambda data, codec: zlib.compress(data)) as comp:
+            await mgr.broadcast(message, role="preditor", compressible=True)
+            assert comp.call_count == 1
+
+        frame = ws_a.send_bytes.call_args[0][0]
+        assert zlib.decompress(frame).decode() == message
+        assert ws_b.send_bytes.call_args[0][0] is frame
+        ws_plain.send_text.assert_called_once_with(message)
+
+    @pytest.mark.asyncio
+    async def test_telemetry_compressed_once_across_roles(self):
+        import zlib
+        from app.modules.telemetry.service import telemetry_store
+        from app.websockets.manager import manager
+        from app.websockets.router import route_message
+
+        ws_dash, ws_admin = AsyncMock(), AsyncMock()
+        await manager.connect(ws_dash, "dash-cx")
+        await manager.connect(ws_admin, "admin-cx")
+        manager.authenticate("dash-cx", "dashboard", compression="zlib")
+        manager.authenticate("admin-cx", "admin", compression="zlib")
+        await manager.connect(AsyncMock(), "conn-cx")
+        manager.authenticate("conn-cx", "connector")
+
+        msg = json.dumps({"type": "telemetry", "payload": {"blob": "x" * 10_000}})
+        with patch("app.websockets.compression.compress",
+                   side_effect=lambda data, codec: zlib.compress(data)) as comp:
+            await route_message(msg, "conn-cx")
+            assert comp.call_count == 1
+        assert ws_admin.send_bytes.call_args[0][0] is ws_dash.send_bytes.call_args[0][0]
+        for iid in ("dash-cx", "admin-cx", "conn-cx"):
+            manager.disconnect(iid)
+        telemetry_store.remove("conn-cx")
+
+
+# ═══════════════════════════════════════════════════════════
+# Bars (resampling)
+# ═══════════════════════════════════════════════════════════
+
+class TestBarResampler:
+    def setup_method(self):
+        from app.modules.bars.service import BarResampler
+        self.rs = BarResampler()
+
+    @staticmethod
+    def _bar(t, o, h, l, c, v=1, tf="M1"):
+        return {"symbol": "EURUSD", "timeframe": tf, "time": t,
+                "open": o, "high": h, "low": l, "close": c, "volume": v}
+
+    def test_timeframe_seconds(self):
+        from app.modules.bars.service import timeframe_seconds
+        assert timeframe_seconds("M5") == 300
+        assert timeframe_seconds("h1") == 3600
+        assert timeframe_seconds("X9") is None
+
+    def test_m5_closes_on_last_base_bar(self):
+        assert self.rs.subscribe("pred-01", "EURUSD", ["M5", "bogus"]) == ["M5"]
+        out = []
+        for i in range(5):
+            out += self.rs.process("conn-01", self._bar(600 + 60 * i, 1 + i, 2 + i, 0.5, 1.5 + i))
+        assert len(out) == 1
+        bar, subs = out[0]
+        assert subs == {"pred-01"}
+        assert (bar["time"], bar["open"], bar["high"], bar["low"], bar["close"], bar["volume"]) == \
+            (600, 1, 6, 0.5, 5.5, 5)
+        # Barra atrasada do bucket já emitido é ignorada
+        assert self.rs.process("conn-01", self._bar(780, 1, 1, 1, 1)) == []
+
+    def test_repeated_base_bar_updates_in_place(self):
+        self.rs.subscribe("pred-01", "EURUSD", ["M5"])
+        out = []
+        for i in range(5):
+            for _ in range(2):
+                out += self.rs.process("conn-01", self._bar(60 * i, 1, 2, 0.5, 1.5, v=10))
+        assert len(out) == 1
+        assert out[0][0]["volume"] == 50
+        # Correção da última barra base depois do fechamento: reemite com a mesma time
+        out = self.rs.process("conn-01", self._bar(240, 1, 3, 0.5, 2.5, v=12))
+        assert len(out) == 1
+        assert (out[0][0]["time"], out[0][0]["high"], out[0][0]["close"], out[0][0]["volume"]) == \
+            (0, 3, 2.5, 52)
+
+    def test_string_prices_compared_as_numbers(self):
+        self.rs.subscribe("pred-01", "EURUSD", ["M5"])
+        out = []
+        for i, (h, l) in enumerate([("9.5", "9.0"), ("10.5", "8.5"), ("9.8", "9.1"),
+                                    ("9.7", "9.2"), ("9.6", "9.3")]):
+            out += self.rs.process("conn-01", self._bar(600 + 60 * i, "9.2", h, l, "9.4", v="2"))
+        bar = out[0][0]
+        # Como string, "9.5" > "10.5" e "8.5" < "9.0" seriam lexicográficos
+        assert (bar["open"], bar["high"], bar["low"], bar["close"], bar["volume"]) == \
+            (9.2, 10.5, 8.5, 9.4, 10.0)
+
+    def test_out_of_order_base_bar_ignored(self):
+        self.rs.subscribe("pred-01", "EURUSD", ["M5"])
+        self.rs.process("conn-01", self._bar(600, 1, 2, 1, 1.5))
+        self.rs.process("conn-01", self._bar(720, 1.5, 3, 1.4, 2.5))
+        # Chega atrasada a barra de 660: não sobrescreve o close de 720
+        self.rs.process("conn-01", self._bar(660, 1.5, 9, 0.1, 1.0))
+        out = self.rs.process("conn-01", self._bar(900, 3, 3, 3, 3, tf=None))
+        bar = out[0][0]
+        assert (bar["high"], bar["low"], bar["close"], bar["volume"]) == (3, 1, 2.5, 2)
+
+    def test_closes_on_next_bucket_without_base_timeframe(self):
+        self.rs.subscribe("pred-01", "EURUSD", ["M5"])
+        assert self.rs.process("conn-01", self._bar(0, 1, 1, 1, 1, tf=None)) == []
+        out = self.rs.process("conn-01", self._bar(300, 2, 2, 2, 2, tf=None))
+        assert [b["time"] for b, _ in out] == [0]
+
+    def test_no_subscribers_no_work(self):
+        assert self.rs.process("conn-01", self._bar(0, 1, 1, 1, 1)) == []
+        self.rs.subscribe("pred-01", "EURUSD", ["M5"])
+        self.rs.remove("pred-01")
+        assert self.rs.get_subscriptions() == {}
+
+    @pytest.mark.asyncio
+    async def test_router_sends_derived_bar_to_subscriber_only(self):
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+
+        ws_sub, ws_other = AsyncMock(), AsyncMock()
+        await manager.connect(AsyncMock(), "conn-rs")
+        await manager.connect(ws_sub, "pred-rs1")
+        await manager.connect(ws_other, "pred-rs2")
+        manager.authenticate("conn-rs", "connector")
+        manager.authenticate("pred-rs1", "preditor")
+        manager.authenticate("pred-rs2", "preditor")
+
+        resp = await route_message(json.dumps(
+            {"type": "bar_subscribe", "id": "s1", "payload": {"symbol": "GBPUSD", "timeframes": ["M5"]}}
+        ), "pred-rs1")
+        assert json.loads(resp)["payload"]["result"]["timeframes"] == ["M5"]
+
+        for i in range(5):
+            bar = {**self._bar(60 * i, 1, 1, 1, 1), "symbol": "GBPUSD"}
+            await route_message(json.dumps({"type": "bar", "payload": bar}), "conn-rs")
+
+        derived = [json.loads(c.args[0]) for c in ws_sub.send_text.call_args_list
+                   if json.loads(c.args[0])["payload"].get("derived")]
+        assert len(derived) == 1 and derived[0]["payload"]["timeframe"] == "M5"
+        assert ws_other.send_text.call_count == 5
+
+        for iid in ("conn-rs", "pred-rs1", "pred-rs2"):
+            manager.disconnect(iid)
+        from app.modules.bars.service import bar_resampler
+        bar_resampler.remove("pred-rs1")
+
+
+# ═══════════════════════════════════════════════════════════
+# Bars (armazenamento colunar / export)
+# ═══════════════════════════════════════════════════════════
+
+class TestBarStore:
+    @staticmethod
+    def _bar(t, c):
+        return {"symbol": "EURUSD", "timeframe": "M1", "time": t,
+                "open": c, "high": c + 1, "low": c - 1, "close": c, "volume": 10}
+
+    def test_append_update_and_merge(self):
+        from app.modules.bars.service import BarStore, history_columns
+        store = BarStore()
+        for t in (120, 180, 180, 60):  # 180 repetido atualiza; 60 fora de ordem é ignorado
+            store.add_bar(self._bar(t, t))
+        series = store.get("EURUSD", "m1")
+        assert list(series.cols["time"]) == [120, 180]
+
+        history = history_columns({"symbol": "EURUSD", "timeframe": "M1",
+                                   "bars": [self._bar(t, 1.0) for t in (0, 60, 120)]})
+        store.add_history(history)
+        assert list(series.cols["time"]) == [0, 60, 120, 180]
+        assert list(series.cols["close"]) == [1.0, 1.0, 1.0, 180.0]
+
+    def test_bounds_and_trim(self):
+        from app.modules.bars.service import BarSeries
+        series = BarSeries(capacity=4)
+        for t in range(10):
+            series.append(self._bar(t * 60, 1.0))
+        assert len(series) <= 5
+        i, j = series.bounds(start=series.cols["time"][1], limit=2)
+        assert j - i == 2
+
+    def test_npy_header(self):
+        import struct
+        from app.modules.bars.service import BarSeries, to_npy
+        series = BarSeries(capacity=10)
+        for t in range(3):
+            series.append(self._bar(t * 60, 2.5))
+        blob = to_npy(series, "close", 0, 3)
+        assert blob[:8] == b"\x93NUMPY\x01\x00"
+        hlen = struct.unpack("<H", blob[8:10])[0]
+        assert (10 + hlen) % 64 == 0
+        assert "'<f8'" in blob[10:10 + hlen].decode() and "(3,)" in blob[10:10 + hlen].decode()
+        assert struct.unpack("<3d", blob[10 + hlen:]) == (2.5, 2.5, 2.5)
+
+    @pytest.mark.asyncio
+    async def test_export_endpoint(self):
+        import io
+        import struct
+        import zipfile
+        from httpx import AsyncClient, ASGITransport
+        from app.main import app
+        from app.modules.bars.service import bar_store
+
+        for t in range(5):
+            bar_store.add_bar({**self._bar(t * 60, float(t)), "symbol": "XAUUSD"})
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            resp = await ac.get("/api/v1/bars/XAUUSD/M1",
+                                params={"format": "raw", "column": "close", "start": 60, "end": 240})
+            assert resp.status_code == 200
+            assert resp.headers["x-bar-count"] == "3"
+            assert struct.unpack("<3d", resp.content) == (1.0, 2.0, 3.0)
+
+            resp = await ac.get("/api/v1/bars/XAUUSD/M1", params={"columns": "time,close"})
+            names = zipfile.ZipFile(io.BytesIO(resp.content)).namelist()
+            assert names == ["time.npy", "close.npy"]
+
+            assert (await ac.get("/api/v1/bars/NOPE/M1")).status_code == 404
+
+
+# ═══════════════════════════════════════════════════════════
+# Stream transport (Unix socket / TCP)
+# ═══════════════════════════════════════════════════════════
+
+class TestStreamTransport:
+    @staticmethod
+    async def _read_frame(reader):
+        import struct
+        length, opcode = struct.unpack(">IB", await reader.readexactly(5))
+        return opcode, await reader.readexactly(length)
+
+    @pytest.mark.asyncio
+    async def test_unix_socket_interops_with_websocket(self, tmp_path):
+        import asyncio
+        from app.core.config import settings
+        from app.websockets.manager import manager
+        from app.websockets.stream import OP_TEXT, StreamServers, encode_frame
+
+        ws_pred = AsyncMock()
+        await manager.connect(ws_pred, "pred-uds")
+        manager.authenticate("pred-uds", "preditor")
+
+        path = str(tmp_path / "hub.sock")
+        servers = StreamServers()
+        with patch.object(settings, "UNIX_SOCKET_PATH", path), \
+                patch("app.websockets.router.validate_token", return_value=True):
+            await servers.start()
+            reader, writer = await asyncio.open_unix_connection(path)
+            auth = {"type": "auth", "id": "a1",
+                    "payload": {"token": "ok", "role": "connector", "instance_id": "conn-uds"}}
+            writer.write(encode_frame(OP_TEXT, json.dumps(auth).encode()))
+            opcode, body = await self._read_frame(reader)
+            assert opcode == OP_TEXT
+            assert json.loads(body)["payload"]["status"] == "authenticated"
+            assert manager.get("conn-uds").role == "connector"
+
+            bar = {"type": "bar", "payload": {"symbol": "EURUSD", "close": 1.1}}
+            writer.write(encode_frame(OP_TEXT, json.dumps(bar).encode()))
+            await writer.drain()
+            for _ in range(50):
+                if ws_pred.send_text.called:
+                    break
+                await asyncio.sleep(0.01)
+            msg = json.loads(ws_pred.send_text.call_args[0][0])
+            assert msg["type"] == "bar" and msg["from"] == "conn-uds"
+
+            writer.close()
+            for _ in range(50):
+                if manager.get("conn-uds") is None:
+                    break
+                await asyncio.sleep(0.01)
+            assert manager.get("conn-uds") is None
+            await servers.stop()
+        manager.disconnect("pred-uds")
+
+    @pytest.mark.asyncio
+    async def test_first_frame_must_be_auth_with_instance_id(self, tmp_path):
+        import asyncio
+        import struct
+        from app.core.config import settings
+        from app.websockets.stream import OP_CLOSE, OP_TEXT, StreamServers, encode_frame
+
+        path = str(tmp_path / "hub.sock")
+        servers = StreamServers()
+        with patch.object(settings, "UNIX_SOCKET_PATH", path):
+            await servers.start()
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(encode_frame(OP_TEXT, b'{"type": "bar", "payload": {}}'))
+            opcode, body = await self._read_frame(reader)
+            assert opcode == OP_CLOSE
+            assert struct.unpack(">H", body[:2])[0] == 4001
+            writer.close()
+            await servers.stop()
+
+
+class TestLoopShards:
+    @pytest.mark.asyncio
+    async def test_handoff_coalesces_wakeups(self):
+        import asyncio
+        import threading
+        from app.websockets.shards import Handoff
+
+        loop = asyncio.get_running_loop()
+        handoff = Handoff(loop)
+        with patch.object(loop, "call_soon_threadsafe", wraps=loop.call_soon_threadsafe) as wake:
+            t = threading.Thread(target=lambda: [handoff.put(i) for i in range(100)])
+            t.start()
+            t.join()
+            assert [await handoff.get() for _ in range(100)] == list(range(100))
+        assert wake.call_count < 100
+
+    @pytest.mark.asyncio
+    async def test_handoff_bounded_backpressure(self):
+        import asyncio
+        from app.websockets.shards import Handoff
+
+        loop = asyncio.get_running_loop()
+        handoff = Handoff(loop, maxsize=2, producer_loop=loop)
+        handoff.put(1)
+        handoff.put(2)
+        waiter = asyncio.create_task(handoff.wait_space())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        assert await handoff.get() == 1
+        await asyncio.wait_for(waiter, 1)
+
+        handoff.put(3)
+        waiter = asyncio.create_task(handoff.wait_space())
+        await asyncio.sleep(0.01)
+        handoff.close()  # consumidor saiu: produtor não fica preso
+        await asyncio.wait_for(waiter, 1)
+
+    @pytest.mark.asyncio
+    async def test_sharded_send_counts_bytes_until_written(self):
+        import asyncio
+        from types import SimpleNamespace
+        from app.core.config import settings
+        from app.websockets.accounting import ConnectionStats, memory_budget
+        from app.websockets.shards import ShardedConnection
+
+        loop = asyncio.get_running_loop()
+        shard = SimpleNamespace(loop=loop, messages_out=0)
+        stream = AsyncMock()
+        with patch.object(settings, "LOOP_SHARD_QUEUE", 2):
+            proxy = ShardedConnection(shard, stream, loop)
+        proxy.stats = stats = ConnectionStats()
+        before = memory_budget.queued
+
+        await proxy.send_text("x" * 100)
+        await proxy.send_text("y" * 50)
+        assert stats.queued_bytes == 150 and memory_budget.queued == before + 150
+        # Fila cheia: o envio espera o shard escrever
+        blocked = asyncio.create_task(proxy.send_text("z" * 10))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+
+        writer = asyncio.create_task(proxy.write_loop())
+        await asyncio.wait_for(blocked, 1)
+        await asyncio.sleep(0.01)
+        assert stream.send_text.await_count == 3
+        assert stats.queued_bytes == 0 and memory_budget.queued == before
+
+        # Fim da sessão libera o que não foi escrito
+        stream.send_text.side_effect = lambda _: asyncio.sleep(10)
+        await proxy.send_text("w" * 30)
+        await proxy.send_text("v" * 20)
+        proxy.finish()
+        assert stats.queued_bytes == 0 and memory_budget.queued == before
+        writer.cancel()
+
+    @pytest.mark.asyncio
+    async def test_sharded_unix_socket_interops_with_websocket(self, tmp_path):
+        import asyncio
+        from app.core.config import settings
+        from app.websockets.manager import manager
+        from app.websockets.shards import loop_shards
+        from app.websockets.stream import OP_CLOSE, OP_TEXT, StreamServers, encode_frame
+
+        ws_pred = AsyncMock()
+        await manager.connect(ws_pred, "pred-shard")
+        manager.authenticate("pred-shard", "preditor")
+
+        path = str(tmp_path / "hub.sock")
+        servers = StreamServers()
+        with patch.object(settings, "UNIX_SOCKET_PATH", path), \
+                patch.object(settings, "LOOP_SHARDS", 2), \
+                patch("app.websockets.router.validate_token", return_value=True):
+            await servers.start()
+            assert len(loop_shards.info()) == 2
+            reader, writer = await asyncio.open_unix_connection(path)
+            auth = {"type": "auth", "id": "a1",
+                    "payload": {"token": "ok", "role": "connector", "instance_id": "conn-shard"}}
+            writer.write(encode_frame(OP_TEXT, json.dumps(auth).encode()))
+            opcode, body = await TestStreamTransport._read_frame(reader)
+            assert opcode == OP_TEXT
+            assert json.loads(body)["payload"]["status"] == "authenticated"
+            assert manager.get("conn-shard").role == "connector"
+            assert sum(s["connections"] for s in loop_shards.info()) == 1
+
+            bar = {"type": "bar", "payload": {"symbol": "EURUSD", "close": 1.1}}
+            writer.write(encode_frame(OP_TEXT, json.dumps(bar).encode()))
+            await writer.drain()
+            for _ in range(50):
+                if ws_pred.send_text.called:
+                    break
+                await asyncio.sleep(0.01)
+            msg = json.loads(ws_pred.send_text.call_args[0][0])
+            assert msg["type"] == "bar" and msg["from"] == "conn-shard"
+
+            writer.close()
+            for _ in range(50):
+                if manager.get("conn-shard") is None:
+                    break
+                await asyncio.sleep(0.01)
+            assert manager.get("conn-shard") is None
+
+            # Auth recusado: a sessão termina no loop principal e o shard fecha o stream
+            with patch("app.websockets.router.validate_token", return_value=False):
+                reader, writer = await asyncio.open_unix_connection(path)
+                auth["payload"]["instance_id"] = "conn-bad"
+                writer.write(encode_frame(OP_TEXT, json.dumps(auth).encode()))
+                opcodes = []
+                while OP_CLOSE not in opcodes:
+                    opcode, _ = await asyncio.wait_for(TestStreamTransport._read_frame(reader), 2)
+                    opcodes.append(opcode)
+                writer.close()
+            await servers.stop()
+            assert loop_shards.info() == []
+        manager.disconnect("pred-shard")
+
+    @pytest.mark.asyncio
+    async def test_http_listener_served_by_shards(self):
+        import asyncio
+        import socket
+        import threading
+        pytest.importorskip("uvicorn")
+        from app.core.config import settings
+        from app.websockets.shards import loop_shards
+
+        app_threads = []
+
+        async def app(scope, receive, send):
+            # A app roda no loop principal; receive/send fazem a E/S no shard
+            app_threads.append(threading.current_thread())
+            await receive()
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-length", b"2")]})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        sock = socket.create_server(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        with patch.object(settings, "LOOP_SHARDS", 2):
+            loop_shards.http_socket = sock
+            try:
+                await loop_shards.serve_http(app)
+                assert len(loop_shards.info()) == 2
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(b"GET / HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+                response = await asyncio.wait_for(reader.read(), 2)
+                writer.close()
+                assert response.startswith(b"HTTP/1.1 200") and response.endswith(b"ok")
+                assert app_threads == [threading.main_thread()]
+                assert sum(s["http"]["requests"] for s in loop_shards.info()) == 1
+            finally:
+                loop_shards.http_socket = None
+                sock.close()
+                await loop_shards.stop()
+        assert loop_shards.info() == []
+
+
+# ═══════════════════════════════════════════════════════════
+# Shared-memory bar ring
+# ═══════════════════════════════════════════════════════════
+
+class TestSharedBarRing:
+    def test_write_read_and_overrun(self):
+        import uuid
+        from app.modules.bars.shm import BarRing, BarRingReader
+
+        ring = BarRing(f"T{uuid.uuid4().hex[:8]}", "M1", capacity=4)
+        try:
+            # No mesmo processo o registro do produtor não deve ser desfeito
+            with patch("multiprocessing.resource_tracker.unregister"):
+                reader = BarRingReader(ring.name, from_latest=True)
+            ring.write(60, 1.0, 2.0, 0.5, 1.5, 10.0)
+            bars, lost = reader.read()
+            assert lost == 0
+            assert bars == [(1, 60, 1.0, 2.0, 0.5, 1.5, 10.0)]
+
+            for i in range(6):
+                ring.write(120 + 60 * i, 1.0, 1.0, 1.0, 1.0, 1.0)
+            bars, lost = reader.read()
+            assert lost == 2
+            assert [b[0] for b in bars] == [4, 5, 6, 7]
+            reader.close()
+        finally:
+            ring.close()
+
+    @pytest.mark.asyncio
+    async def test_router_skips_socket_delivery_for_shm_readers(self):
+        from app.core.config import settings
+        from app.modules.bars.shm import shared_bar_rings
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+
+        ws_local, ws_remote = AsyncMock(), AsyncMock()
+        await manager.connect(AsyncMock(), "conn-shm")
+        await manager.connect(ws_local, "pred-local")
+        await manager.connect(ws_remote, "pred-remote")
+        manager.authenticate("conn-shm", "connector")
+        manager.authenticate("pred-local", "preditor", shm_bars=True)
+        manager.authenticate("pred-remote", "preditor")
+
+        bar = {"symbol": "SHMTEST", "timeframe": "M1", "time": 60,
+               "open": 1, "high": 1, "low": 1, "close": 1, "volume": 1}
+        with patch.object(settings, "SHM_BARS_ENABLED", True):
+            await route_message(json.dumps({"type": "bar", "payload": bar}), "conn-shm")
+        try:
+            ws_local.send_text.assert_not_called()
+            ws_remote.send_text.assert_called_once()
+            ring = [r for r in shared_bar_rings.list_rings() if r["symbol"] == "SHMTEST"][0]
+            assert ring["write_seq"] == 1
+        finally:
+            shared_bar_rings.close()
+            for iid in ("conn-shm", "pred-local", "pred-remote"):
+                manager.disconnect(iid)
+
+
+# ═══════════════════════════════════════════════════════════
+# Config service
+# ═══════════════════════════════════════════════════════════
+
+class TestConfigService:
+    def setup_method(self):
+        from app.core.config import Settings
+        from app.core.config_supabase import ConfigService
+        self.settings = Settings(ORACLE_TOKEN="old", AUTH_TIMEOUT=5)
+        self.service = ConfigService(self.settings)
+
+    def test_apply_validates_and_versions(self):
+        changed = self.service.apply(
+            {"oracle_token": "new", "auth_timeout": "9", "port": "not-a-number",
+             "supabase_url": "http://evil", "unknown_key": "x"},
+            source="supabase",
+        )
+        assert changed == {"ORACLE_TOKEN": "new", "AUTH_TIMEOUT": 9}
+        assert self.settings.ORACLE_TOKEN == "new"
+        assert self.settings.SUPABASE_URL == ""
+        assert self.service.version == 1
+        # Mesmo conteúdo: nenhuma nova versão
+        self.service.apply({"oracle_token": "new", "auth_timeout": "9", "port": "not-a-number",
+                            "supabase_url": "http://evil", "unknown_key": "x"}, source="supabase")
+        assert self.service.version == 1
+
+    def test_only_hot_reload_keys_accepted(self):
+        changed = self.service.apply(
+            {"local_store_path": "/tmp/evil.db", "hub_snapshot_path": "/tmp/x",
+             "config_snapshot_path": "/tmp/y", "unix_socket_path": "/tmp/s",
+             "namespace_tokens": '{"alpha": "x"}', "host": "127.0.0.1",
+             "heartbeat_timeout_s": "45"},
+            source="supabase",
+        )
+        assert changed == {"HEARTBEAT_TIMEOUT_S": 45}
+        assert self.settings.LOCAL_STORE_PATH == ""
+        assert self.settings.NAMESPACE_TOKENS == {}
+
+    def test_listeners_receive_changes(self):
+        seen = []
+        self.service.on_change(seen.append)
+        self.service.apply({"debug": "true"}, source="supabase")
+        assert seen == [{"DEBUG": True}]
+
+    @pytest.mark.asyncio
+    async def test_refresh_off_loop_writes_snapshot(self, tmp_path):
+        from app.core.config import Settings
+        from app.core.config_supabase import ConfigService
+        self.settings.CONFIG_SNAPSHOT_PATH = str(tmp_path / "snap.json")
+
+        with patch.object(ConfigService, "_fetch", return_value={"conflate_interval_ms": "30"}):
+            assert await self.service.refresh() is True
+        assert self.settings.CONFLATE_INTERVAL_MS == 30
+        assert (tmp_path / "snap.json").stat().st_mode & 0o777 == 0o600
+
+        # Novo processo: sobe instantâneo a partir do snapshot
+        fresh = Settings(CONFIG_SNAPSHOT_PATH=str(tmp_path / "snap.json"))
+        service = ConfigService(fresh)
+        assert service.load_snapshot() is True
+        assert fresh.CONFLATE_INTERVAL_MS == 30
+        assert service.source == "snapshot"
+
+    @pytest.mark.asyncio
+    async def test_removed_keys_revert_to_env(self):
+        from app.core.config import Settings
+        from app.core.config_supabase import ConfigService
+        with patch.object(ConfigService, "_fetch",
+                          return_value={"oracle_token": "new", "heartbeat_timeout_s": "45"}):
+            await self.service.refresh()
+        assert self.settings.HEARTBEAT_TIMEOUT_S == 45
+
+        with patch.object(ConfigService, "_fetch", return_value={"heartbeat_timeout_s": "45"}):
+            await self.service.refresh()
+        assert self.settings.ORACLE_TOKEN == "old"
+        assert self.settings.HEARTBEAT_TIMEOUT_S == 45
+
+        with patch.object(ConfigService, "_fetch", return_value={}):
+            assert await self.service.refresh() is True
+        assert self.settings.HEARTBEAT_TIMEOUT_S == Settings().HEARTBEAT_TIMEOUT_S
+
+    def test_telemetry_interval_not_hot_reloadable(self):
+        assert self.service.apply({"telemetry_interval_min": "3"}, source="supabase") == {}
+
+    @pytest.mark.asyncio
+    async def test_refresh_failure_keeps_config(self):
+        with patch("app.core.config_supabase.ConfigService._fetch", side_effect=RuntimeError("down")):
+            assert await self.service.refresh() is False
+        assert self.settings.ORACLE_TOKEN == "old"
+        assert self.service.version == 0
+
+
+# ═══════════════════════════════════════════════════════════
+# Restart sem downtime (drain + snapshot)
+# ═══════════════════════════════════════════════════════════
+
+class TestRestart:
+    def _fresh_stores(self):
+        from app.modules.bars.service import BarStore
+        from app.modules.commands.service import CommandRouter
+        from app.modules.state.service import StateStore
+        from app.modules.telemetry.service import TelemetryStore
+        return {"telemetry": TelemetryStore(), "commands": CommandRouter(),
+                "state": StateStore(), "bars": BarStore()}
+
+    @pytest.mark.asyncio
+    async def test_snapshot_roundtrip(self, tmp_path):
+        from app.modules.snapshot.service import HubSnapshot
+        path = str(tmp_path / "hub.json.gz")
+
+        old = self._fresh_stores()
+        with patch.dict("app.modules.snapshot.service._STORES", old):
+            await old["telemetry"].process("conn-rs1", {"balance": 1000})
+            cmd = old["commands"].create_command("status", "conn-rs1", "admin-01",
+                                                 original_msg_id="orig-1")
+            old["state"].apply("account_update", "conn-rs1", {"equity": 1234,
+                               "positions": [{"ticket": 7, "symbol": "EURUSD"}]})
+            for t in (60, 120, 180):
+                old["bars"].add_bar({"symbol": "EURUSD", "time": t, "open": 1, "high": 2,
+                                     "low": 0.5, "close": 1.5, "volume": t})
+            assert await HubSnapshot().write(path)
+
+        new = self._fresh_stores()
+        with patch.dict("app.modules.snapshot.service._STORES", new):
+            assert HubSnapshot().restore(path)
+
+        assert new["telemetry"].get_latest("conn-rs1")["balance"] == 1000
+        assert new["state"].get("conn-rs1")["account"]["equity"] == 1234
+        assert new["state"].get("conn-rs1")["positions"][0]["ticket"] == 7
+        assert list(new["bars"].get("EURUSD", "M1").cols["volume"]) == [60, 120, 180]
+        # Ack de comando emitido antes do restart ainda chega à origem
+        origin, ack = new["commands"].process_ack("conn-rs1", {"ref_id": cmd["id"], "status": "ok"})
+        assert origin == "admin-01" and ack["ref_id"] == "orig-1"
+
+    @pytest.mark.asyncio
+    async def test_stale_snapshot_ignored(self, tmp_path):
+        from app.core.config import settings
+        from app.modules.snapshot.service import HubSnapshot
+        path = str(tmp_path / "hub.json.gz")
+
+        with patch.dict("app.modules.snapshot.service._STORES", self._fresh_stores()):
+            assert await HubSnapshot().write(path)
+        with patch.object(settings, "HUB_SNAPSHOT_MAX_AGE_S", -1):
+            assert HubSnapshot().restore(path) is False
+        assert HubSnapshot().restore(str(tmp_path / "missing.json.gz")) is False
+
+    @pytest.mark.asyncio
+    async def test_drain_flushes_snapshots_and_hints_reconnect(self, tmp_path):
+        from app.core.config import settings
+        from app.websockets.compression import Outbound
+        from app.websockets.drain import HubDrain
+        from app.websockets.manager import ConnectionManager
+        from app.websockets.session import serve_session
+
+        local = ConnectionManager()
+        ws_exec, ws_dash = AsyncMock(), AsyncMock()
+        await local.connect(ws_exec, "exec-dr")
+        await local.connect(ws_dash, "dash-dr")
+        local.authenticate("exec-dr", "executor")
+        local.authenticate("dash-dr", "dashboard", conflate=True)
+        local.get("dash-dr").conflater.interval = 0.02
+        for i in range(3):
+            local.get("dash-dr").conflater.offer(("telemetry", i), Outbound(f"t{i}"))
+
+        path = tmp_path / "hub.json.gz"
+        with patch("app.websockets.drain.manager", local), \
+             patch("app.websockets.session.manager", local), \
+             patch.object(settings, "HUB_SNAPSHOT_PATH", str(path)), \
+             patch.object(settings, "RECONNECT_BASE_MS", 100), \
+             patch.object(settings, "RECONNECT_JITTER_MS", 50):
+            drain = HubDrain()
+            result = await drain.run()
+
+            assert result["snapshot"] and path.exists()
+            assert result["closed"] == 2
+            assert local.draining
+            # Fila conflacionada entregue antes do hint
+            sent = [c.args[0] for c in ws_dash.send_text.call_args_list]
+            assert sent[:3] == ["t0", "t1", "t2"]
+            hint = json.loads(sent[-1])
+            assert hint["type"] == "reconnect_after"
+            assert 100 <= hint["payload"]["delay_ms"] <= 150
+            ws_exec.close.assert_awaited_with(code=1012, reason="Service restart")
+
+            # Idempotente; novas conexões recusadas durante o drain
+            assert await drain.run() is result
+            ws_new = AsyncMock()
+            await serve_session(ws_new, "late-dr")
+            ws_new.accept.assert_not_awaited()
+            ws_new.close.assert_awaited_with(code=1012, reason="Service restart")
+
+    @pytest.mark.asyncio
+    async def test_drain_aborts_when_snapshot_fails(self, tmp_path):
+        from app.core.config import settings
+        from app.websockets.drain import HubDrain
+        from app.websockets.manager import ConnectionManager
+
+        local = ConnectionManager()
+        ws = AsyncMock()
+        await local.connect(ws, "exec-da")
+        local.authenticate("exec-da", "executor")
+        # Destino é um diretório: os.replace falha
+        with patch("app.websockets.drain.manager", local), \
+             patch.object(settings, "HUB_SNAPSHOT_PATH", str(tmp_path)):
+            drain = HubDrain()
+            result = await drain.run()
+            assert result["aborted"] and not result["snapshot"]
+            assert not local.draining and not drain.done
+            ws.close.assert_not_awaited()
+
+        with patch("app.websockets.drain.manager", local), \
+             patch.object(settings, "HUB_SNAPSHOT_PATH", str(tmp_path / "hub.json.gz")):
+            assert (await drain.run())["closed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_server_restart_disconnect_keeps_state(self):
+        from fastapi import WebSocketDisconnect
+        from app.modules.state.service import state_store
+        from app.websockets.session import serve_session
+
+        ws = AsyncMock()
+        ws.receive_text.side_effect = [
+            json.dumps({"type": "auth", "payload": {"token": "t", "role": "connector"}}),
+            json.dumps({"type": "account_update", "payload": {"equity": 5}}),
+            WebSocketDisconnect(code=1012),
+        ]
+        with patch("app.websockets.router.validate_token", return_value=True):
+            await serve_session(ws, "conn-keep")
+        assert state_store.get("conn-keep")["account"]["equity"] == 5
+        state_store.remove("conn-keep")
+
+
+# ═══════════════════════════════════════════════════════════
+# Admission control + resume tickets
+# ═══════════════════════════════════════════════════════════
+
+class TestAdmission:
+    def test_resume_ticket(self):
+        from app.core.config import settings
+        from app.modules.auth.service import issue_resume_ticket, verify_resume_ticket
+
+        with patch.object(settings, "ORACLE_TOKEN", "tok-adm"):
+            ticket, expires_at = issue_resume_ticket("exec-adm", "executor")
+            assert expires_at > time.time()
+            assert verify_resume_ticket(ticket, "exec-adm") == "executor"
+            assert verify_resume_ticket(ticket, "other-adm") is None
+            assert verify_resume_ticket(ticket[:-2] + "xx", "exec-adm") is None
+            with patch("app.modules.auth.service.time.time",
+                       return_value=expires_at + 1):
+                assert verify_resume_ticket(ticket, "exec-adm") is None
+        # Token trocado invalida tickets emitidos
+        with patch.object(settings, "ORACLE_TOKEN", "tok-new"):
+            assert verify_resume_ticket(ticket, "exec-adm") is None
+
+    @pytest.mark.asyncio
+    async def test_auth_with_resume_ticket(self):
+        from app.core.config import settings
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+
+        with patch.object(settings, "ORACLE_TOKEN", "tok-adm"):
+            await manager.connect(AsyncMock(), "conn-adm")
+            resp = json.loads(await route_message(json.dumps(
+                {"type": "auth", "id": "a1", "payload": {"token": "tok-adm", "role": "connector"}}),
+                "conn-adm"))
+            ticket = resp["payload"]["result"]["resume_ticket"]
+            manager.disconnect("conn-adm")
+
+            await manager.connect(AsyncMock(), "conn-adm")
+            resp = json.loads(await route_message(json.dumps(
+                {"type": "auth", "id": "a2", "payload": {"resume": ticket, "role": "admin"}}),
+                "conn-adm"))
+            assert resp["payload"]["status"] == "authenticated"
+            assert manager.get("conn-adm").role == "connector"
+
+            await manager.connect(AsyncMock(), "spoof-adm")
+            resp = json.loads(await route_message(json.dumps(
+                {"type": "auth", "payload": {"resume": ticket}}), "spoof-adm"))
+            assert resp["type"] == "error"
+        manager.disconnect("conn-adm")
+        manager.disconnect("spoof-adm")
+
+    @pytest.mark.asyncio
+    async def test_priority_queue(self):
+        import asyncio
+        from app.core.config import settings
+        from app.websockets.admission import AdmissionController
+
+        ctrl = AdmissionController()
+        order = []
+
+        async def handshake(role):
+            assert await ctrl.acquire(role, timeout=1.0)
+            order.append(role)
+
+        with patch.object(settings, "HANDSHAKE_CONCURRENCY", 1):
+            assert await ctrl.acquire("dashboard")
+            tasks = [asyncio.create_task(handshake(r))
+                     for r in ("dashboard", "preditor", "executor", "connector")]
+            await asyncio.sleep(0)
+            assert ctrl.info()["queued"] == 4
+            for _ in range(5):
+                ctrl.release()
+                await asyncio.sleep(0)
+            await asyncio.gather(*tasks)
+
+        assert order == ["executor", "connector", "preditor", "dashboard"]
+        assert ctrl.info()["active"] == 0
+
+    @pytest.mark.asyncio
+    async def test_session_rejected_when_queue_wait_expires(self):
+        from app.core.config import settings
+        from app.websockets.session import serve_session
+
+        ctrl_patch = patch("app.websockets.session.admission.acquire",
+                           AsyncMock(return_value=False))
+        ws = AsyncMock()
+        with ctrl_patch, patch.object(settings, "ADMISSION_WAIT_S", 0.01):
+            await serve_session(ws, "dash-late", role="dashboard")
+        ws.accept.assert_not_awaited()
+        ws.close.assert_awaited_with(code=1013, reason="Try again later")
+
+
+    @pytest.mark.asyncio
+    async def test_unverified_role_hint_gets_lowest_priority(self):
+        from app.core.config import settings
+        from app.modules.auth.service import issue_resume_ticket
+        from app.websockets.admission import ROLE_PRIORITY, UNVERIFIED_PRIORITY, role_hint
+
+        assert UNVERIFIED_PRIORITY > max(ROLE_PRIORITY.values())
+        with patch.object(settings, "ORACLE_TOKEN", "tok-adm"):
+            ticket, _ = issue_resume_ticket("conn-hint", "connector")
+            assert role_hint("conn-hint", ticket) == "connector"
+            assert role_hint("conn-hint", "forged") is None
+            assert role_hint("conn-hint") is None
+
+    @pytest.mark.asyncio
+    async def test_replaced_session_cleanup_keeps_new_connection(self):
+        import asyncio
+        from fastapi import WebSocketDisconnect
+        from app.websockets.manager import manager
+        from app.websockets.namespaces import namespaces
+        from app.websockets.session import serve_session
+
+        auth = json.dumps({"type": "auth", "payload": {"token": "t", "role": "connector",
+                                                        "accounts": ["acc-rp"]}})
+
+        def session_ws(closed: asyncio.Event):
+            # auth, depois bloqueia até `closed` e desconecta
+            frames = [auth]
+
+            async def receive_text():
+                if frames:
+                    return frames.pop()
+                await closed.wait()
+                raise WebSocketDisconnect(code=1000)
+
+            ws = AsyncMock()
+            ws.receive_text.side_effect = receive_text
+            return ws
+
+        release_old, new_blocked = asyncio.Event(), asyncio.Event()
+        ws_old, ws_new = session_ws(release_old), session_ws(new_blocked)
+
+        with patch("app.websockets.router.validate_token", return_value=True):
+            old = asyncio.create_task(serve_session(ws_old, "conn-rp"))
+            await asyncio.sleep(0.01)
+            new = asyncio.create_task(serve_session(ws_new, "conn-rp"))
+            await asyncio.sleep(0.01)
+            release_old.set()
+            await old
+
+            assert manager.get("conn-rp").websocket is ws_new
+            assert namespaces.get().ownership.owner_of(account="acc-rp") == "conn-rp"
+            new_blocked.set()
+            await new
+        assert manager.get("conn-rp") is None
+        assert namespaces.get().ownership.owner_of(account="acc-rp") is None
+
+
+# ═══════════════════════════════════════════════════════════
+# Dedup de ordens
+# ═══════════════════════════════════════════════════════════
+
+class TestOrderDedup:
+    def test_ttl_and_size_bounds(self):
+        from app.core.config import settings
+        from app.websockets.dedup import DedupIndex
+
+        index = DedupIndex()
+        with patch.object(settings, "ORDER_DEDUP_TTL_S", 10), \
+             patch.object(settings, "ORDER_DEDUP_MAX", 3):
+            assert index.check("a", "ref-a", now=0) is None
+            assert index.check("a", "ref-a", now=5).ref_id == "ref-a"
+            assert index.check("a", "ref-a", now=11) is None  # expirou
+            index.bind("a", ["conn"])
+            for k in ("b", "c", "d"):
+                index.check(k, f"ref-{k}", now=12)
+                index.bind(k, ["conn"])
+            assert len(index) == 3
+            assert index.attach_result("conn", "ref-a", "{}") is False  # expulsa por tamanho
+            assert index.attach_result("other", "ref-d", "{}") is False  # outro escopo
+            assert index.attach_result("conn", "ref-d", "{}") is True
+            index.discard("d")
+            assert index.check("d", "ref-d", now=12) is None
+
+    @pytest.mark.asyncio
+    async def test_retried_order_command_not_rebroadcast(self):
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+
+        ws_exec, ws_conn = AsyncMock(), AsyncMock()
+        await manager.connect(ws_exec, "exec-dd")
+        await manager.connect(ws_conn, "conn-dd")
+        manager.authenticate("exec-dd", "executor")
+        manager.authenticate("conn-dd", "connector")
+
+        order = json.dumps({"type": "order_command", "id": "ord-dd-1",
+                            "payload": {"action": "open", "symbol": "EURUSD"}})
+        assert await route_message(order, "exec-dd") == ""
+        fwd = json.loads(ws_conn.send_text.call_args.args[0])
+        assert fwd["id"] == "ord-dd-1"
+
+        # Retry antes do resultado: ack duplicate, sem novo envio ao connector
+        resp = json.loads(await route_message(order, "exec-dd"))
+        assert resp["payload"]["status"] == "duplicate"
+        assert ws_conn.send_text.await_count == 1
+
+        result = json.dumps({"type": "order_result", "id": "res-dd-1",
+                             "payload": {"ref_id": "ord-dd-1", "success": True, "ticket": 9}})
+        await route_message(result, "conn-dd")
+        await route_message(result, "conn-dd")  # reenvio do connector: descartado
+        assert ws_exec.send_text.await_count == 1
+
+        # Retry depois do resultado: recebe o order_result em cache
+        resp = json.loads(await route_message(order, "exec-dd"))
+        assert resp["type"] == "order_result" and resp["payload"]["ticket"] == 9
+        assert ws_conn.send_text.await_count == 1
+
+        # Chave de idempotência do cliente vale mesmo com id novo
+        keyed = {"type": "order_command", "payload": {"action": "close", "idempotency_key": "k-dd"}}
+        await route_message(json.dumps({**keyed, "id": "ord-dd-2"}), "exec-dd")
+        resp = json.loads(await route_message(json.dumps({**keyed, "id": "ord-dd-3"}), "exec-dd"))
+        assert resp["payload"]["result"]["ref_id"] == "ord-dd-2"
+        assert ws_conn.send_text.await_count == 2
+
+        manager.disconnect("exec-dd")
+        manager.disconnect("conn-dd")
+
+
+    @pytest.mark.asyncio
+    async def test_undelivered_order_not_recorded(self):
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+
+        ws_exec, ws_conn = AsyncMock(), AsyncMock()
+        await manager.connect(ws_exec, "exec-du")
+        manager.authenticate("exec-du", "executor")
+        order = json.dumps({"type": "order_command", "id": "ord-du-1",
+                            "payload": {"action": "open", "symbol": "EURUSD"}})
+        # Nenhum connector: nada entregue, o retry não vira duplicate
+        assert await route_message(order, "exec-du") == ""
+
+        await manager.connect(ws_conn, "conn-du")
+        manager.authenticate("conn-du", "connector")
+        assert await route_message(order, "exec-du") == ""
+        assert ws_conn.send_text.await_count == 1
+        manager.disconnect("exec-du")
+        manager.disconnect("conn-du")
+
+    @pytest.mark.asyncio
+    async def test_result_attaches_only_to_own_executor(self):
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+
+        ws_a, ws_b, ws_conn = AsyncMock(), AsyncMock(), AsyncMock()
+        for ws, iid, role in ((ws_a, "exec-sa", "executor"), (ws_b, "exec-sb", "executor"),
+                              (ws_conn, "conn-sa", "connector")):
+            await manager.connect(ws, iid)
+            manager.authenticate(iid, role, namespace="ns-sa" if iid != "exec-sb" else "ns-sb")
+
+        order = json.dumps({"type": "order_command", "id": "ord-same", "payload": {"action": "open"}})
+        await route_message(order, "exec-sa")
+        # Mesmo id, outro namespace: sem connector, não registrado
+        await route_message(order, "exec-sb")
+        result = json.dumps({"type": "order_result", "id": "res-sa",
+                             "payload": {"ref_id": "ord-same", "ticket": 1}})
+        await route_message(result, "conn-sa")
+
+        assert json.loads(await route_message(order, "exec-sa"))["type"] == "order_result"
+        assert await route_message(order, "exec-sb") == ""
+        for iid in ("exec-sa", "exec-sb", "conn-sa"):
+            manager.disconnect(iid)
+
+
+# ═══════════════════════════════════════════════════════════
+# Ownership routing
+# ═══════════════════════════════════════════════════════════
+
+class TestOwnership:
+    def test_conflict_and_failover(self):
+        from app.websockets.ownership import OwnershipIndex
+
+        index = OwnershipIndex()
+        assert index.declare("conn-a", "connector", ["111"], ["eurusd"]) == []
+        conflicts = index.declare("conn-b", "connector", ["222"], ["EURUSD"])
+        assert conflicts == [{"kind": "symbol", "value": "EURUSD",
+                              "owner": "conn-a", "claimant": "conn-b"}]
+        assert index.owner_of(symbol="EURUSD") == "conn-a"
+        assert index.owner_of(account="222", symbol="EURUSD") == "conn-b"
+        assert index.info()["conflicts"][0]["claimants"] == ["conn-b"]
+
+        index.remove("conn-a")
+        assert index.owner_of(symbol="eurusd") == "conn-b"
+        assert index.conflicts() == []
+
+    @pytest.mark.asyncio
+    async def test_point_to_point_order_routing(self):
+        from app.websockets.router import route_message
+        from app.websockets.manager import manager
+        from app.websockets.ownership import ownership
+
+        sockets = {iid: AsyncMock() for iid in
+                   ("conn-o1", "conn-o2", "conn-legacy", "exec-o1", "exec-o2", "exec-all")}
+        declarations = {
+            "conn-o1": ("connector", {"accounts": ["111"], "symbols": ["EURUSD"]}),
+            "conn-o2": ("connector", {"accounts": ["222"], "symbols": ["GBPUSD"]}),
+            "conn-legacy": ("connector", {}),
+            "exec-o1": ("executor", {"accounts": ["111"]}),
+            "exec-o2": ("executor", {"symbols": ["GBPUSD"]}),
+            "exec-all": ("executor", {}),
+        }
+        with patch("app.websockets.router.validate_token", return_value=True):
+            for iid, (role, decl) in declarations.items():
+                await manager.connect(sockets[iid], iid)
+                await route_message(json.dumps({"type": "auth", "payload": {
+                    "token": "t", "role": role, **decl}}), iid)
+        for ws in sockets.values():
+            ws.send_text.reset_mock()
+
+        await route_message(json.dumps({"type": "order_command", "id": "own-1",
+                                        "payload": {"account": "222", "symbol": "GBPUSD"}}),
+                            "exec-o2")
+        assert sockets["conn-o2"].send_text.await_count == 1
+        assert sockets["conn-o1"].send_text.await_count == 0
+        assert sockets["conn-legacy"].send_text.await_count == 0
+
+        # Symbol sem dono → só o connector legado
+        await route_message(json.dumps({"type": "order_command", "id": "own-2",
+                                        "payload": {"symbol": "USDJPY"}}), "exec-all")
+        assert sockets["conn-legacy"].send_text.await_count == 1
+        assert sockets["conn-o1"].send_text.await_count == 0
+
+        # order_result da conta 111: executor da conta + executor sem declaração
+        await route_message(json.dumps({"type": "order_result", "id": "own-r1",
+                                        "payload": {"symbol": "EURUSD"}}), "conn-o1")
+        assert sockets["exec-o1"].send_text.await_count == 1
+        assert sockets["exec-all"].send_text.await_count == 1
+        assert sockets["exec-o2"].send_text.await_count == 0
+
+        for iid in sockets:
+            manager.disconnect(iid)
+            ownership.remove(iid)
+
+
+# ═══════════════════════════════════════════════════════════
+# TTL de mensagens
+# ═══════════════════════════════════════════════════════════
+
+class TestMessageTTL:
+    def test_expiry_from_envelope_timestamp(self):
+        from app.websockets.ttl import expiry_for
+
+        now = 1_000.0
+        # Sem timestamp: conta do recebimento no Hub
+        assert expiry_for("signal", {}, now).deadline == pytest.approx(now + 2.0)
+        # Timestamp do cliente corrigido pelo offset de relógio (cliente 500 ms adiantado)
+        expiry = expiry_for("signal", {"timestamp": now - 1.0}, now, clock_offset_ms=500)
+        assert expiry.age_ms(now) == pytest.approx(1500.0)
+        # Relógio do cliente no futuro não estende o prazo
+        assert expiry_for("signal", {"timestamp": now + 60}, now, clock_offset_ms=0).origin == now
+        # Sem offset medido o timestamp do cliente não é usado (relógio atrasado)
+        assert expiry_for("signal", {"timestamp": now - 60}, now).origin == now
+        # TTL da mensagem sobrepõe o do type; types sem TTL não expiram
+        assert expiry_for("telemetry", {"ttl_ms": 100}, now).ttl_ms == 100
+        assert expiry_for("telemetry", {}, now) is None
+        from app.core.config import settings
+        with patch.object(settings, "MESSAGE_TTLS_MS", {"signal": 0}):
+            assert expiry_for("signal", {}, now) is None
+
+    @pytest.mark.asyncio
+    async def test_stale_signal_not_forwarded(self):
+        import time
+        from app.modules.metrics.service import metrics
+        from app.websockets.manager import manager
+        from app.websockets.router import route_message
+
+        pred, execu = AsyncMock(), AsyncMock()
+        await manager.connect(pred, "pred-ttl")
+        manager.authenticate("pred-ttl", "preditor")
+        await manager.connect(execu, "exec-ttl")
+        manager.authenticate("exec-ttl", "executor")
+        manager.get("pred-ttl").clock_offset_ms = 0.0  # já respondeu ao heartbeat
+        before = metrics.counter("ttl.expired.signal")
+
+        old = time.time() - 5
+        resp = await route_message(json.dumps({"type": "signal", "timestamp": old,
+                                               "payload": {"symbol": "EURUSD"}}), "pred-ttl")
+        assert resp == ""
+        assert execu.send_text.await_count == 0
+        assert metrics.counter("ttl.expired.signal") == before + 1
+
+        resp = await route_message(json.dumps({"type": "signal", "id": "s1", "timestamp": old,
+                                               "report_expired": True,
+                                               "payload": {"symbol": "EURUSD"}}), "pred-ttl")
+        ack = json.loads(resp)["payload"]
+        assert ack["status"] == "expired" and ack["ref_id"] == "s1"
+        assert ack["result"]["type"] == "signal" and ack["result"]["age_ms"] >= 5000
+
+        await route_message(json.dumps({"type": "signal", "timestamp": time.time(),
+                                        "payload": {"symbol": "EURUSD"}}), "pred-ttl")
+        assert execu.send_text.await_count == 1
+        manager.disconnect("pred-ttl")
+        manager.disconnect("exec-ttl")
+
+    @pytest.mark.asyncio
+    async def test_stale_bar_stored_but_not_forwarded(self):
+        import time
+        from app.modules.bars.service import bar_store
+        from app.websockets.manager import manager
+        from app.websockets.router import route_message
+
+        conn_ws, pred = AsyncMock(), AsyncMock()
+        await manager.connect(conn_ws, "conn-ttl")
+        manager.authenticate("conn-ttl", "connector")
+        await manager.connect(pred, "pred-ttl2")
+        manager.authenticate("pred-ttl2", "preditor")
+        manager.get("conn-ttl").clock_offset_ms = 0.0
+
+        bar = {"symbol": "TTLUSD", "timeframe": "M1", "time": 60, "open": 1, "high": 1,
+               "low": 1, "close": 1, "volume": 1}
+        await route_message(json.dumps({"type": "bar", "timestamp": time.time() - 60,
+                                        "payload": bar}), "conn-ttl")
+        assert pred.send_text.await_count == 0
+        assert bar_store.get("TTLUSD", "M1") is not None
+        manager.disconnect("conn-ttl")
+        manager.disconnect("pred-ttl2")
+
+    @pytest.mark.asyncio
+    async def test_broadcast_drops_after_deadline(self):
+        import asyncio
+        import time
+        from app.websockets.compression import Outbound
+        from app.websockets.manager import ConflatingSender, manager
+
+        slow, late = AsyncMock(), AsyncMock()
+        await manager.connect(slow, "exec-slow")
+        manager.authenticate("exec-slow", "executor")
+        await manager.connect(late, "exec-late")
+        manager.authenticate("exec-late", "executor")
+
+        async def slow_send(_):
+            await asyncio.sleep(0.05)
+        slow.send_text.side_effect = slow_send
+        dropped = await manager.broadcast("{}", role="executor", deadline=time.time() + 0.02,
+                                          targets=["exec-slow", "exec-late"])
+        assert dropped == 1
+        assert late.send_text.await_count == 0
+        manager.disconnect("exec-slow")
+        manager.disconnect("exec-late")
+
+        ws = AsyncMock()
+        sender = ConflatingSender(ws, "dash-ttl")
+        sender.offer("k1", Outbound("old", deadline=time.time() - 1))
+        sender.offer("k2", Outbound("new"))
+        await sender.flush(1.0)
+        assert [c.args[0] for c in ws.send_text.await_args_list] == ["new"]
+        sender.close()
+
+
+# ═══════════════════════════════════════════════════════════
+# Namespaces
+# ═══════════════════════════════════════════════════════════
+
+class TestNamespaces:
+    def test_tokens_and_tickets_scoped_per_namespace(self):
+        from app.core.config import settings
+        from app.modules.auth.service import (
+            issue_resume_ticket, validate_token, verify_resume_ticket,
+        )
+
+        with patch.object(settings, "ORACLE_TOKEN", "root"), \
+                patch.object(settings, "NAMESPACE_TOKENS", {"alpha": "tok-a"}):
+            assert validate_token("root") is True
+            assert validate_token("tok-a", "alpha") is True
+            assert validate_token("root", "alpha") is False
+            assert validate_token("tok-a", "beta") is False
+
+            ticket, _ = issue_resume_ticket("exec-ns", "executor", "alpha")
+            assert verify_resume_ticket(ticket, "exec-ns", "alpha") == "executor"
+            assert verify_resume_ticket(ticket, "exec-ns", "default") is None
+            assert verify_resume_ticket(ticket, "exec-ns") == "executor"
+
+    @pytest.mark.asyncio
+    async def test_routing_isolated_per_namespace(self):
+        from app.websockets.manager import manager
+        from app.websockets.namespaces import namespaces
+        from app.websockets.router import route_message
+
+        layout = {
+            "pred-a": ("preditor", "alpha", {}), "exec-a": ("executor", "alpha", {}),
+            "conn-a": ("connector", "alpha", {"accounts": ["111"]}),
+            "exec-b": ("executor", "beta", {}),
+            "conn-b": ("connector", "beta", {"accounts": ["111"]}),
+        }
+        sockets = {iid: AsyncMock() for iid in layout}
+        with patch("app.websockets.router.validate_token", return_value=True):
+            for iid, (role, ns, decl) in layout.items():
+                await manager.connect(sockets[iid], iid)
+                resp = json.loads(await route_message(json.dumps({"type": "auth", "payload": {
+                    "token": "t", "role": role, "namespace": ns, **decl}}), iid))
+                # Mesma conta em namespaces diferentes não conflita
+                assert "conflicts" not in resp["payload"]["result"]
+        for ws in sockets.values():
+            ws.send_text.reset_mock()
+        assert manager.get_by_role("executor", "alpha") == ["exec-a"]
+        assert manager.count_in("beta") == 2
+
+        await route_message(json.dumps({"type": "signal", "payload": {"symbol": "EURUSD"}}),
+                            "pred-a")
+        assert sockets["exec-a"].send_text.await_count == 1
+        assert sockets["exec-b"].send_text.await_count == 0
+
+        await route_message(json.dumps({"type": "order_command", "id": "ns-o1",
+                                        "payload": {"account": "111"}}), "exec-b")
+        assert sockets["conn-b"].send_text.await_count == 1
+        assert sockets["conn-a"].send_text.await_count == 0
+
+        await route_message(json.dumps({"type": "telemetry", "payload": {"balance": 1}}), "conn-b")
+        assert namespaces.get("beta").telemetry.get_latest("conn-b") is not None
+        assert namespaces.get("alpha").telemetry.get_latest("conn-b") is None
+        assert namespaces.get("beta").metrics.counter("messages.telemetry") == 1
+
+        # Comandos não cruzam namespaces
+        resp = json.loads(await route_message(json.dumps({
+            "type": "command", "id": "ns-c1",
+            "payload": {"target": "conn-a", "action": "get_status"}}), "exec-b"))
+        assert resp["type"] == "error"
+
+        for iid in layout:
+            namespaces.of(iid).ownership.remove(iid)
+            manager.disconnect(iid)
+        assert manager.count_in("alpha") == 0
+
+    @pytest.mark.asyncio
+    async def test_namespace_connection_limit(self):
+        from app.core.config import settings
+        from app.websockets.manager import manager
+        from app.websockets.router import route_message
+
+        auth = {"type": "auth", "payload": {"token": "t", "role": "preditor", "namespace": "tiny"}}
+        with patch("app.websockets.router.validate_token", return_value=True), \
+                patch.object(settings, "NAMESPACE_LIMITS", {"tiny": {"max_connections": 1}}):
+            for iid in ("pred-t1", "pred-t2"):
+                await manager.connect(AsyncMock(), iid)
+            ok = json.loads(await route_message(json.dumps(auth), "pred-t1"))
+            assert ok["payload"]["status"] == "authenticated"
+            # Re-auth de quem já está no namespace continua valendo
+            ok = json.loads(await route_message(json.dumps(auth), "pred-t1"))
+            assert ok["payload"]["status"] == "authenticated"
+            rejected = json.loads(await route_message(json.dumps(auth), "pred-t2"))
+            assert rejected["type"] == "error" and rejected["payload"]["code"] == 4013
+        manager.disconnect("pred-t1")
+        manager.disconnect("pred-t2")
+
+    @pytest.mark.asyncio
+    async def test_state_isolated_per_namespace(self):
+        from app.websockets.manager import manager
+        from app.websockets.namespaces import namespaces
+        from app.websockets.router import route_message, state_snapshot
+
+        layout = {"conn-sa": ("connector", "st-alpha"), "exec-sa": ("executor", "st-alpha"),
+                  "conn-sb": ("connector", "st-beta"), "exec-sb": ("executor", "st-beta")}
+        with patch("app.websockets.router.validate_token", return_value=True):
+            for iid, (role, ns) in layout.items():
+                await manager.connect(AsyncMock(), iid)
+                await route_message(json.dumps({"type": "auth", "payload": {
+                    "token": "t", "role": role, "namespace": ns}}), iid)
+        for iid in ("conn-sa", "conn-sb"):
+            await route_message(json.dumps({"type": "account_update",
+                                            "payload": {"balance": 1}}), iid)
+
+        assert namespaces.get("st-alpha").state.get("conn-sb") is None
+        assert list(json.loads(state_snapshot("exec-sa"))["payload"]["connectors"]) == ["conn-sa"]
+        # Desconectado, o estado continua no namespace em que foi publicado
+        manager.disconnect("conn-sb")
+        assert list(json.loads(state_snapshot("exec-sb"))["payload"]["connectors"]) == ["conn-sb"]
+        assert "conn-sb" not in namespaces.get("default").state.snapshot()
+
+        for iid, (_, ns) in layout.items():
+            namespaces.get(ns).state.remove(iid)
+            manager.disconnect(iid)
+
+    @pytest.mark.asyncio
+    async def test_bars_isolated_per_namespace(self):
+        from fastapi.testclient import TestClient
+        from app.main import app
+        from app.websockets.manager import manager
+        from app.websockets.namespaces import namespaces
+        from app.websockets.router import route_message
+
+        with patch("app.websockets.router.validate_token", return_value=True):
+            for iid, ns in (("conn-ba", "bar-alpha"), ("conn-bb", "bar-beta")):
+                await manager.connect(AsyncMock(), iid)
+                await route_message(json.dumps({"type": "auth", "payload": {
+                    "token": "t", "role": "connector", "namespace": ns}}), iid)
+        for iid, close in (("conn-ba", 1.0), ("conn-bb", 2.0)):
+            await route_message(json.dumps({"type": "bar", "payload": {
+                "symbol": "NSBAR", "time": 600, "open": close, "high": close,
+                "low": close, "close": close, "volume": 1}}), iid)
+
+        assert list(namespaces.get("bar-alpha").bars.get("NSBAR", "M1").cols["close"]) == [1.0]
+        assert list(namespaces.get("bar-beta").bars.get("NSBAR", "M1").cols["close"]) == [2.0]
+        assert namespaces.get("default").bars.get("NSBAR", "M1") is None
+
+        client = TestClient(app)
+        resp = client.get("/api/v1/bars/NSBAR/M1", params={"format": "raw", "column": "close",
+                                                          "namespace": "bar-beta"})
+        assert resp.headers["X-Bar-Count"] == "1"
+        assert client.get("/api/v1/bars/NSBAR/M1").status_code == 404
+        assert [s["symbol"] for s in client.get(
+            "/api/v1/bars", params={"namespace": "bar-alpha"}).json()["series"]] == ["NSBAR"]
+        for iid in ("conn-ba", "conn-bb"):
+            manager.disconnect(iid)
+
+    def test_shm_ring_names_per_namespace(self):
+        from app.modules.bars.shm import ring_name
+
+        assert ring_name("EURUSD", "M1") == "ots_bars_EURUSD_M1"
+        assert ring_name("EURUSD", "M1", "scalper-eu") == "ots_bars.scalper_eu.EURUSD_M1"
+
+    def test_unacked_commands_expire(self):
+        import time
+        from app.core.config import settings
+        from app.websockets.namespaces import namespaces
+
+        commands = namespaces.get("exp-ns").commands
+        commands._pending["cmd-exp"] = {
+            "command": {"type": "command", "id": "cmd-exp", "payload": {"action": "pause"}},
+            "target": "exec-exp", "origin": "admin-exp", "sent_at": time.time() - 60}
+        with patch.object(settings, "COMMAND_ACK_TIMEOUT_S", 30):
+            namespaces.expire_commands()
+        assert "cmd-exp" not in commands._pending
+
+
+# ═══════════════════════════════════════════════════════════
+# Store local (SQLite write-behind)
+# ═══════════════════════════════════════════════════════════
+
+class TestLocalStore:
+    def _entry(self, cmd_id, target, action, sent_at, status="ok"):
+        return {"command": {"type": "command", "id": cmd_id, "payload": {"action": action}},
+                "target": target, "origin": "admin-ls", "sent_at": sent_at,
+                "ack": {"status": status, "received_at": sent_at + 1}}
+
+    @pytest.mark.asyncio
+    async def test_batched_writes_and_indexed_queries(self, tmp_path):
+        from app.core.config import settings
+        from app.modules.store.service import LocalStore
+
+        store = LocalStore()
+        with patch.object(settings, "LOCAL_STORE_PATH", str(tmp_path / "hub.db")):
+            for i, iid in enumerate(["conn-ls1", "conn-ls2", "conn-ls1"]):
+                store.add_telemetry({"instance_id": iid, "server_ts": 100.0 + i, "equity": i})
+            store.add_command(self._entry("cmd-1", "exec-ls", "pause", 100.0))
+            store.add_command(self._entry("cmd-2", "exec-ls", "resume", 200.0))
+            store.add_command(self._entry("cmd-3", "pred-ls", "pause", 300.0, status="error"))
+            assert store.queued == 6
+            assert await store.flush() == 6
+            assert store.queued == 0
+
+            samples = await store.query_telemetry("conn-ls1")
+            assert [s["equity"] for s in samples] == [2, 0]
+            assert len(await store.query_telemetry(since=101.0)) == 2
+
+            assert [c["command"]["id"] for c in await store.query_commands(action="pause")] == \
+                ["cmd-3", "cmd-1"]
+            assert [c["command"]["id"] for c in await store.query_commands(target="exec-ls",
+                                                                           until=150.0)] == ["cmd-1"]
+            assert len(await store.query_commands(status="error")) == 1
+            await store.stop()
+
+    @pytest.mark.asyncio
+    async def test_failed_write_keeps_batch(self, tmp_path):
+        from app.core.config import settings
+        from app.modules.store.service import LocalStore
+
+        store = LocalStore()
+        with patch.object(settings, "LOCAL_STORE_PATH", str(tmp_path / "missing" / "hub.db")):
+            store.add_telemetry({"instance_id": "conn-ls3", "server_ts": 1.0})
+            assert await store.flush() == 0
+            assert store.queued == 1 and store.last_error
+
+    @pytest.mark.asyncio
+    async def test_poison_row_quarantined_after_retries(self, tmp_path):
+        from app.core.config import settings
+        from app.modules.store.service import LocalStore
+
+        store = LocalStore()
+        with patch.object(settings, "LOCAL_STORE_PATH", str(tmp_path / "hub.db")), \
+             patch.object(settings, "LOCAL_STORE_MAX_RETRIES", 2):
+            store.add_telemetry({"instance_id": "conn-ls7", "server_ts": 1.0})
+            store.add_telemetry({"server_ts": 2.0})  # sem instance_id: nunca grava
+            store.add_command(self._entry("cmd-7", "exec-ls", "status", 1.0))
+            assert await store.flush() == 0
+            assert store.queued == 3
+            assert await store.flush() == 2
+            assert store.queued == 0 and store.quarantined == 1
+
+            store.add_telemetry({"instance_id": "conn-ls7", "server_ts": 3.0})
+            assert await store.flush() == 1
+            assert len(await store.query_telemetry("conn-ls7")) == 2
+            await store.stop()
+
+    @pytest.mark.asyncio
+    async def test_replicates_pending_rows_only(self, tmp_path):
+        from unittest.mock import MagicMock
+        from app.core.config import settings
+        from app.modules.store.service import LocalStore
+
+        store = LocalStore()
+        client = MagicMock()
+        with patch.object(settings, "LOCAL_STORE_PATH", str(tmp_path / "hub.db")), \
+             patch.object(settings, "SUPABASE_URL", "https://x.supabase.co"), \
+             patch.object(settings, "SUPABASE_KEY", "k"), \
+             patch("app.modules.store.service.get_supabase", return_value=client):
+            store.add_telemetry({"instance_id": "conn-ls4", "server_ts": 1.0}, replicate=True)
+            store.add_telemetry({"instance_id": "conn-ls4", "server_ts": 2.0})
+            store.add_command(self._entry("cmd-4", "exec-ls", "status", 1.0))
+            await store.flush()
+
+            client.table.return_value.upsert.return_value.execute.side_effect = OSError("down")
+            assert await store.replicate() == 0
+            client.table.return_value.upsert.return_value.execute.side_effect = None
+            assert await store.replicate() == 2
+            assert await store.replicate() == 0
+            tables = [c.args[0] for c in client.table.call_args_list]
+            assert tables[-2:] == ["telemetry", "command_history"]
+            upserts = client.table.return_value.upsert.call_args_list
+            assert [c.kwargs["on_conflict"] for c in upserts[-2:]] == ["sample_id", "cmd_id"]
+            assert upserts[-2].args[0][0]["sample_id"] == "conn-ls4:1.0"
+            assert upserts[-1].args[0][0]["cmd_id"] == "cmd-4"
+            await store.stop()
+
+    @pytest.mark.asyncio
+    async def test_prunes_local_only_commands(self, tmp_path):
+        from app.core.config import settings
+        from app.modules.store.service import LocalStore
+
+        store = LocalStore()
+        with patch.object(settings, "LOCAL_STORE_PATH", str(tmp_path / "hub.db")), \
+             patch.object(settings, "SUPABASE_URL", ""), \
+             patch.object(settings, "LOCAL_STORE_RETENTION_DAYS", 1):
+            store.add_command(self._entry("cmd-old", "exec-ls", "status", time.time() - 2 * 86400))
+            store.add_command(self._entry("cmd-new", "exec-ls", "status", time.time()))
+            with patch("app.modules.store.service.json.dumps", wraps=json.dumps) as dumps:
+                store.add_telemetry({"instance_id": "conn-ls6", "server_ts": time.time()})
+                assert dumps.call_count == 0  # serialização só na thread de escrita
+            await store.flush()
+            store._prune()
+            assert [c["command"]["id"] for c in await store.query_commands()] == ["cmd-new"]
+            await store.stop()
+
+    @pytest.mark.asyncio
+    async def test_telemetry_goes_through_store(self):
+        from app.modules.telemetry.service import TelemetryStore
+
+        with patch("app.modules.telemetry.service.local_store") as store, \
+             patch("app.modules.telemetry.service.supabase_configured", return_value=True):
+            store.enabled = True
+            tel = TelemetryStore()
+            await tel.process("conn-ls5", {"equity": 1})
+            await tel.process("conn-ls5", {"equity": 2})
+        flags = [c.kwargs["replicate"] for c in store.add_telemetry.call_args_list]
+        assert flags == [True, False]
+
+
+# ═══════════════════════════════════════════════════════════
+# Accounting por conexão
+# ═══════════════════════════════════════════════════════════
+
+class TestAccounting:
+    @pytest.mark.asyncio
+    async def test_traffic_counters_per_connection(self):
+        from app.websockets.manager import manager
+        from app.websockets.router import route_message
+
+        await manager.connect(AsyncMock(), "pred-acc")
+        manager.authenticate("pred-acc", "preditor")
+        await manager.connect(AsyncMock(), "exec-acc")
+        manager.authenticate("exec-acc", "executor")
+
+        frame = json.dumps({"type": "signal", "payload": {"symbol": "EURUSD", "side": "buy"}})
+        await route_message(frame, "pred-acc")
+        await route_message(frame, "pred-acc")
+
+        pred = manager.get("pred-acc").stats.info()
+        assert pred["in"]["signal"] == {"messages": 2, "bytes": 2 * len(frame)}
+        assert pred["largest_in"] == len(frame)
+        execu = manager.get("exec-acc").stats.info()
+        assert execu["out"]["signal"]["messages"] == 2
+        assert execu["largest_out"] > 0 and execu["avg_send_ms"] is not None
+        assert execu["queued_bytes"] == 0
+        listed = {c["instance_id"]: c for c in manager.list_connections()}
+        assert listed["exec-acc"]["traffic"]["out"]["signal"]["messages"] == 2
+        manager.disconnect("pred-acc")
+        manager.disconnect("exec-acc")
+
+    @pytest.mark.asyncio
+    async def test_frame_limit_per_role(self):
+        from app.core.config import settings
+        from app.websockets.manager import manager
+        from app.websockets.router import route_message
+
+        await manager.connect(AsyncMock(), "dash-acc")
+        manager.authenticate("dash-acc", "dashboard")
+        frame = json.dumps({"type": "command", "payload": {"action": "x" * 200}})
+        with patch.object(settings, "MAX_FRAME_BYTES_BY_ROLE", {"dashboard": 100}):
+            resp = json.loads(await route_message(frame, "dash-acc"))
+            assert resp["payload"]["code"] == 4009
+        assert manager.get("dash-acc").stats.info()["in"]["oversized"]["messages"] == 1
+        manager.disconnect("dash-acc")
+
+    @pytest.mark.asyncio
+    async def test_frame_limit_counts_utf8_bytes(self):
+        from app.core.config import settings
+        from app.websockets.manager import manager
+        from app.websockets.router import route_message
+
+        await manager.connect(AsyncMock(), "dash-utf8")
+        manager.authenticate("dash-utf8", "dashboard")
+        # 91 caracteres, mas 191 bytes em UTF-8
+        frame = json.dumps({"type": "command", "payload": {"a": "€" * 50}}, ensure_ascii=False)
+        assert len(frame) < 100 < len(frame.encode())
+        with patch.object(settings, "MAX_FRAME_BYTES_BY_ROLE", {"dashboard": 100}):
+            resp = json.loads(await route_message(frame, "dash-utf8"))
+            assert resp["payload"]["code"] == 4009
+        manager.disconnect("dash-utf8")
+
+    @pytest.mark.asyncio
+    async def test_frame_limit_counts_bytes_and_unknown_types(self):
+        from app.core.config import settings
+        from app.websockets.accounting import ws_max_size
+        from app.websockets.manager import manager
+        from app.websockets.namespaces import namespaces
+        from app.websockets.router import route_message
+
+        await manager.connect(AsyncMock(), "dash-utf")
+        manager.authenticate("dash-utf", "dashboard")
+        # 60 caracteres, 180 bytes UTF-8
+        frame = json.dumps({"type": "command", "payload": {"action": "€" * 60}},
+                           ensure_ascii=False)
+        with patch.object(settings, "MAX_FRAME_BYTES_BY_ROLE", {"dashboard": 150}):
+            assert len(frame) < 150
+            resp = json.loads(await route_message(frame, "dash-utf"))
+            assert resp["payload"]["code"] == 4009
+            assert ws_max_size() == settings.MAX_FRAME_BYTES
+        with patch.object(settings, "MAX_FRAME_BYTES_BY_ROLE", {"connector": 2 ** 30}):
+            assert ws_max_size() == 2 ** 30
+
+        for i in range(3):
+            await route_message(json.dumps({"type": f"made-up-{i}"}), "dash-utf")
+        inbound = manager.get("dash-utf").stats.info()["in"]
+        assert inbound["other"]["messages"] == 3
+        assert not any(key.startswith("made-up") for key in inbound)
+        assert namespaces.get("default").metrics.counter("messages.other") >= 3
+        assert namespaces.get("default").metrics.counter("messages.made-up-0") == 0
+        manager.disconnect("dash-utf")
+
+    @pytest.mark.asyncio
+    async def test_memory_budget_sheds_low_priority(self):
+        import asyncio
+        from app.core.config import settings
+        from app.websockets.accounting import memory_budget
+        from app.websockets.manager import manager
+
+        slow, dash, execu = AsyncMock(), AsyncMock(), AsyncMock()
+        release = asyncio.Event()
+
+        async def stuck(_):
+            await release.wait()
+        slow.send_text.side_effect = stuck
+        for ws, iid, role in ((slow, "pred-slow", "preditor"), (dash, "dash-mem", "dashboard"),
+                              (execu, "exec-mem", "executor")):
+            await manager.connect(ws, iid)
+            manager.authenticate(iid, role)
+
+        with patch.object(settings, "MEMORY_BUDGET_BYTES", 100):
+            # Envio preso retém bytes acima do orçamento
+            big = json.dumps({"type": "bar", "payload": {"pad": "x" * 200}})
+            task = asyncio.create_task(manager.send("pred-slow", big))
+            await asyncio.sleep(0)
+            assert memory_budget.exceeded()
+            assert manager.get("pred-slow").stats.queued_bytes == len(big)
+
+            signal = json.dumps({"type": "signal", "payload": {}})
+            await manager.broadcast(signal, role="dashboard")
+            await manager.broadcast(signal, role="executor")
+            assert dash.send_text.await_count == 0
+            assert execu.send_text.await_count == 1
+            assert manager.get("dash-mem").stats.shed == 1
+
+            release.set()
+            await task
+            assert not memory_budget.exceeded()
+            await manager.broadcast(signal, role="dashboard")
+            assert dash.send_text.await_count == 1
+        for iid in ("pred-slow", "dash-mem", "exec-mem"):
+            manager.disconnect(iid)
+
+
+# ═══════════════════════════════════════════════════════════
+# Cold start budget
+# ═══════════════════════════════════════════════════════════
+
+# Import + startup + primeira conexão aceita, num processo novo
+STARTUP_BUDGET_S = float(os.environ.get("OTS_STARTUP_BUDGET_S", "3.0"))
+
+_COLD_START_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import app.main
+from app.core.startup import startup_timer
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+    with client.websocket_connect("/ws/cold-start-probe"):
+        total = time.perf_counter() - t0
+print(json.dumps({"total_s": total, "report": startup_timer.report(),
+                  "supabase_loaded": "supabase" in sys.modules,
+                  "pool_loaded": "concurrent.futures.process" in sys.modules}))
+"""
+
+
+class TestColdStart:
+    def test_import_to_first_accept_within_budget(self):
+        import subprocess
+        import sys
+
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = {**os.environ, "SUPABASE_URL": "", "SUPABASE_KEY": "",
+               "CONFIG_SNAPSHOT_PATH": "", "HUB_SNAPSHOT_PATH": ""}
+        out = subprocess.run([sys.executable, "-c", _COLD_START_PROBE], cwd=root, env=env,
+                             capture_output=True, text=True, timeout=60)
+        assert out.returncode == 0, out.stderr
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+
+        assert result["report"]["complete"], result
+        assert list(result["report"]["phases_ms"]) == ["import", "settings", "ready", "first_accept"]
+        assert not result["supabase_loaded"] and not result["pool_loaded"]
+        assert result["total_s"] <= STARTUP_BUDGET_S, result